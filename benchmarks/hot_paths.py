@@ -0,0 +1,228 @@
+"""Micro-benchmarks for the per-lookup helpers in ``server.app``.
+
+Run from the repository root::
+
+    python -m benchmarks.hot_paths                 # compare with benchmarks/baseline.json
+    python -m benchmarks.hot_paths --update        # record a new baseline
+    python -m benchmarks.hot_paths --sizes 20,1000 --threshold 1.5
+
+Every case runs on synthetic followup pages of 20 to 50,000 records whose
+customer codes are mostly lookalikes of the one being searched (``C37700``,
+``C3770A``, ``C377`` ...). Timings are divided by a fixed pure-Python
+calibration loop so a baseline recorded on one machine stays comparable on
+another. The run exits with status 1 when a case is slower than
+``--threshold`` times its baseline.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+# Keep the app's local indexes and caches away from real data while importing it.
+os.environ.setdefault("MAQUA_DATA_DIR", tempfile.mkdtemp(prefix="maqua-bench-"))
+
+from server import app as server_app  # noqa: E402
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DEFAULT_SIZES = (20, 1000, 50000)
+DEFAULT_THRESHOLD = 1.3
+EXPECTED_CODE = "C3770"
+LOOKALIKES = ("C37700", "C3770A", "C377", "C3771", "C37707", "C3707", "CC3770", "C3770-1")
+NAMES = ("偉業行貿易公司", "新興餐廳", "大昌洗衣", "MAQUA 體驗店")
+
+
+def _code_for(rng: random.Random) -> str:
+    # One record in ten belongs to the searched customer.
+    return EXPECTED_CODE if rng.random() < 0.1 else rng.choice(LOOKALIKES)
+
+
+def _followup(rng: random.Random, index: int, today: date) -> Dict[str, Any]:
+    code = _code_for(rng)
+    follow_day = today - timedelta(days=rng.randint(-60, 900))
+    item: Dict[str, Any] = {
+        "id": str(index),
+        "org": "1001",
+        "ower_name": rng.choice(("維修幫-陳師傅", "維修幫-李師傅", "客服003", "銷售部")),
+        "followTime": f"{follow_day.isoformat()} {rng.randint(8, 18):02d}:00:00",
+    }
+    layout = index % 4
+    if layout == 0:
+        item["customer_code"] = code
+        item["customer"] = str(2000000 + index)
+    elif layout == 1:
+        item["customer"] = {"code": code, "name": rng.choice(NAMES)}
+    elif layout == 2:
+        item["customer"] = str(2000000 + index)
+        item["customer_name"] = f"{code}{rng.choice(NAMES)}"
+    else:
+        item["customer"] = str(2000000 + index)
+        item["customer_name"] = rng.choice(NAMES)
+    for slot in range(1, 6):
+        roll = rng.random()
+        if roll < 0.45:
+            item[f"picture{slot}"] = f"{rng.getrandbits(96):024x}"
+        elif roll < 0.55:
+            item[f"picture{slot}"] = "null"
+    return item
+
+
+def _task(rng: random.Random, today: date) -> Dict[str, Any]:
+    start = today + timedelta(days=rng.randint(-400, 200))
+    field = rng.choice(("startDate", "startDate", "planDate", "endDate"))
+    return {
+        field: f"{start.isoformat()} 09:00:00",
+        "ower_name": rng.choice(("客服003", "維修幫-陳師傅", "銷售部")),
+        "customer_code": _code_for(rng),
+    }
+
+
+def build_fixtures(size: int, seed: int = 20240601) -> Dict[str, Any]:
+    rng = random.Random(seed + size)
+    today = date.today()
+    records = [_followup(rng, index, today) for index in range(size)]
+    tasks = [_task(rng, today) for _ in range(max(5, size // 10))]
+    photo_ids = [
+        str(item[key]) for item in records[: max(1, size // 5)]
+        for key in ("picture1", "picture2") if item.get(key, "null") != "null"
+    ]
+    files_response = {
+        "data": {
+            photo_id: [{
+                "fileId": f"f{photo_id}",
+                "fileName": rng.choice(("IMG_0001.JPG", "photo.jpeg", "report.pdf", "scan.heic", "notes")),
+                "signedUrl": f"https://oss.example.com/{photo_id}?Expires=1900000000&Signature=abc",
+                "fileSize": rng.randint(10_000, 4_000_000),
+            }]
+            for photo_id in photo_ids
+        }
+    }
+    return {
+        "records": records,
+        "tasks": tasks,
+        "photo_ids": photo_ids,
+        "files_response": files_response,
+        "files": server_app._extract_query_files(files_response, photo_ids),
+        "follow_times": [item["followTime"] for item in records],
+        "followup_data": {"code": "200", "data": {"recordList": records}},
+    }
+
+
+def build_cases(fx: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    records = fx["records"]
+    tasks = fx["tasks"]
+    owner_keyword = getattr(server_app.config, "MAINTENANCE_TASK_OWNER_KEYWORD", None)
+    today = date.today()
+    return {
+        "matches_code": lambda: [item for item in records if server_app._matches_code(item, EXPECTED_CODE)],
+        "collect_photo_ids": lambda: [server_app._collect_photo_ids(item) for item in records],
+        "extract_query_files": lambda: server_app._extract_query_files(fx["files_response"], fx["photo_ids"]),
+        "split_files": lambda: server_app._split_files(fx["files"]),
+        "parse_follow_date": lambda: [server_app._parse_follow_date(value) for value in fx["follow_times"]],
+        "select_task_base_date": lambda: server_app._select_task_base_date(
+            tasks, owner_keyword, today - timedelta(days=30), today - timedelta(days=200)
+        ),
+        "extract_maintenance_summary": lambda: server_app._extract_maintenance_summary(
+            EXPECTED_CODE, fx["followup_data"], tasks
+        ),
+    }
+
+
+def best_time(func: Callable[[], Any], repeat: int = 5) -> float:
+    """Fastest per-call time in seconds (timeit autorange, best of ``repeat``)."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def calibrate() -> float:
+    def _work() -> int:
+        rows = [{"key": f"c{i}", "value": i} for i in range(20000)]
+        return sum(len(row["key"].upper()) for row in rows if row["value"] % 3)
+
+    return best_time(_work)
+
+
+def run(sizes: Tuple[int, ...]) -> Tuple[float, Dict[str, Dict[str, float]]]:
+    # Calibrate between sizes as well and keep the fastest, so a slow start
+    # (CPU frequency ramp-up, noisy neighbours) does not skew every score.
+    units = [calibrate()]
+    timings: Dict[str, float] = {}
+    for size in sizes:
+        fixtures = build_fixtures(size)
+        for name, func in build_cases(fixtures).items():
+            timings[f"{name}[{size}]"] = best_time(func)
+        units.append(calibrate())
+    unit = min(units)
+    return unit, {case: {"seconds": seconds, "score": seconds / unit} for case, seconds in timings.items()}
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    lines: List[str] = []
+    regressions: List[str] = []
+    reference = baseline.get("cases") or {}
+    for case, result in results.items():
+        base = reference.get(case)
+        if base is None:
+            lines.append(f"{case:40s} {result['seconds'] * 1e3:10.3f} ms   (no baseline)")
+            continue
+        ratio = result["score"] / base
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(case)
+        lines.append(f"{case:40s} {result['seconds'] * 1e3:10.3f} ms   x{ratio:5.2f}{flag}")
+    print("\n".join(lines))
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fail when a case is this many times slower than its baseline")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    sizes = tuple(int(part) for part in args.sizes.split(",") if part.strip())
+    unit, results = run(sizes)
+    print(f"calibration unit: {unit * 1e3:.3f} ms ({platform.python_implementation()} {platform.python_version()})")
+
+    if args.update:
+        # Show the change against the previous baseline, then replace it.
+        baseline = json.loads(args.baseline.read_text("utf-8")) if args.baseline.exists() else {}
+        compare(results, baseline, args.threshold)
+        cases = baseline.get("cases") or {}
+        cases.update({case: float(f"{result['score']:.4g}") for case, result in results.items()})
+        payload = {
+            "python": platform.python_version(),
+            "calibrationSeconds": round(unit, 6),
+            "cases": dict(sorted(cases.items())),
+        }
+        args.baseline.write_text(json.dumps(payload, indent=2, ensure_ascii=False) + "\n", "utf-8")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}; run with --update first", file=sys.stderr)
+        return 2
+    regressions = compare(results, json.loads(args.baseline.read_text("utf-8")), args.threshold)
+    if regressions:
+        print(f"{len(regressions)} case(s) regressed beyond x{args.threshold}: {', '.join(regressions)}",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,155 @@
+"""Cold-start benchmark: import time and time to first response of ``server.app``.
+
+Run from the repository root::
+
+    python -m benchmarks.startup                   # compare with benchmarks/startup_baseline.json
+    python -m benchmarks.startup --update          # record a new baseline
+    python -m benchmarks.startup --runs 15 --threshold 1.5
+
+Every run starts a fresh interpreter with an empty data directory, the way a
+scaled-to-zero instance boots. It measures:
+
+- ``import``: the time to import ``server.app``
+- ``firstPage``: that import plus the first ``GET /``
+- ``firstApi``: that import plus ``GET /`` and the first ``GET /api/customers/suggest``
+  (the local index only; no gateway call)
+- ``process``: the wall time from spawning the interpreter to that first API response
+
+The fastest of ``--runs`` is kept. Timings are divided by the startup time of
+a bare interpreter (``python -c pass``), so baselines from different machines
+stay comparable. The run exits with status 1 when a case is slower than
+``--threshold`` times its baseline, and also lists the slowest imports
+(``-X importtime``) so a regression can be traced to a module.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).with_name("startup_baseline.json")
+DEFAULT_RUNS = 7
+DEFAULT_THRESHOLD = 1.3
+
+# Runs in the child interpreter; prints one JSON line right after the first API response.
+_CHILD = """
+import json, os, time
+started = time.perf_counter()
+import server.app as server_app
+imported = time.perf_counter()
+client = server_app.app.test_client()
+client.get("/")
+first_page = time.perf_counter()
+client.get("/api/customers/suggest?q=C37")
+first_api = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "firstPage": first_page - started,
+    "firstApi": first_api - started,
+}), flush=True)
+os._exit(0)
+"""
+
+
+def _spawn(args: List[str]) -> Tuple[float, str, str]:
+    env = dict(os.environ, MAQUA_DATA_DIR=tempfile.mkdtemp(prefix="maqua-startup-"))
+    started = time.perf_counter()
+    done = subprocess.run(args, cwd=str(ROOT_DIR), env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, done.stdout, done.stderr
+
+
+def calibrate(runs: int) -> float:
+    return min(_spawn([sys.executable, "-c", "pass"])[0] for _ in range(runs))
+
+
+def measure(runs: int) -> Dict[str, float]:
+    best: Dict[str, float] = {}
+    for _ in range(runs):
+        elapsed, stdout, _ = _spawn([sys.executable, "-c", _CHILD])
+        sample = json.loads(stdout.strip().splitlines()[-1])
+        sample["process"] = elapsed
+        for case, seconds in sample.items():
+            best[case] = min(seconds, best.get(case, seconds))
+    return best
+
+
+def slowest_imports(limit: int = 10) -> List[Tuple[int, str]]:
+    """Modules with the largest cumulative import time (microseconds), outermost first."""
+    _, _, stderr = _spawn([sys.executable, "-X", "importtime", "-c", "import server.app"])
+    rows: List[Tuple[int, str]] = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    lines: List[str] = []
+    regressions: List[str] = []
+    reference = baseline.get("cases") or {}
+    for case, result in results.items():
+        base = reference.get(case)
+        if base is None:
+            lines.append(f"{case:12s} {result['seconds'] * 1e3:10.1f} ms   (no baseline)")
+            continue
+        ratio = result["score"] / base
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(case)
+        lines.append(f"{case:12s} {result['seconds'] * 1e3:10.1f} ms   x{ratio:5.2f}{flag}")
+    print("\n".join(lines))
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fail when a case is this many times slower than its baseline")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    unit = calibrate(args.runs)
+    results = {case: {"seconds": seconds, "score": seconds / unit} for case, seconds in measure(args.runs).items()}
+    print(f"bare interpreter: {unit * 1e3:.1f} ms ({platform.python_implementation()} {platform.python_version()})")
+
+    if args.update:
+        baseline = json.loads(args.baseline.read_text("utf-8")) if args.baseline.exists() else {}
+        compare(results, baseline, args.threshold)
+        payload = {
+            "python": platform.python_version(),
+            "interpreterSeconds": round(unit, 6),
+            "cases": {case: float(f"{result['score']:.4g}") for case, result in sorted(results.items())},
+        }
+        args.baseline.write_text(json.dumps(payload, indent=2, ensure_ascii=False) + "\n", "utf-8")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}; run with --update first", file=sys.stderr)
+        return 2
+    regressions = compare(results, json.loads(args.baseline.read_text("utf-8")), args.threshold)
+    if regressions:
+        print(f"{len(regressions)} case(s) regressed beyond x{args.threshold}: {', '.join(regressions)}",
+              file=sys.stderr)
+        print("slowest imports (cumulative):", file=sys.stderr)
+        for micros, module in slowest_imports():
+            print(f"  {micros / 1e3:8.1f} ms {module}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,21 @@
+"""Gunicorn settings; loaded automatically when gunicorn starts from the repo root.
+
+Importing ``server.app`` does no I/O and starts no threads, so ``--preload``
+is safe. The master then imports the app once and loads the file-backed
+indexes, and each forked worker only opens its own connections.
+"""
+
+
+def when_ready(server):
+    # Runs in the master before the first fork; only useful with --preload.
+    if server.cfg.preload_app:
+        from server.warmup import WARMUP
+
+        WARMUP.preload()
+
+
+def post_worker_init(worker):
+    # Warm up before this worker accepts connections; see server/warmup.py.
+    from server.warmup import WARMUP
+
+    WARMUP.run()
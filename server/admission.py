@@ -0,0 +1,152 @@
+"""Admission control for requests that need the CRM gateway.
+
+A request is only counted when it makes its first real gateway call.
+Static pages and requests answered from the L2 cache, the replica or the
+local indexes are never held back. At that first call the request takes
+one of ``ADMISSION_MAX_UPSTREAM_REQUESTS`` slots shared by every worker on
+the host (``flock`` on slot files, released automatically if a worker
+dies). When the recent p90 gateway latency is above
+``ADMISSION_SLOW_GATEWAY_SECONDS``, only ``ADMISSION_SLOW_MAX_UPSTREAM_REQUESTS``
+slots are used. That keeps workers free for cheap requests while YonBIP is
+slow. A request that gets no slot, or that already waited longer than
+``ADMISSION_MAX_QUEUE_MS`` in front of the app (``X-Request-Start`` set by
+the proxy), fails fast with ``AdmissionRejected``. The app turns that into
+503 with ``Retry-After``.
+
+Each tenant (server/tenants.py) has its own slots, in its own data dir,
+and its own latency window, so a slow gateway for one tenant does not shed
+the others. ``ADMISSION_MAX_UPSTREAM_REQUESTS`` and
+``ADMISSION_SLOW_MAX_UPSTREAM_REQUESTS`` can be set per tenant.
+
+Calls made outside a request (replica sync, warm-up, export jobs) are not
+limited.
+"""
+from __future__ import annotations
+
+import contextvars
+import fcntl
+import math
+import threading
+import time
+from collections import deque
+from typing import IO, Any, Deque, Dict, Optional, Tuple
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+
+SLOT_DIR_NAME = "admission"
+
+
+class AdmissionRejected(RuntimeError):
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, queue_ms: Optional[float]) -> None:
+        self.queue_ms = queue_ms
+        self.slot: Optional[IO[str]] = None
+
+
+_ticket: contextvars.ContextVar[Optional[_Ticket]] = contextvars.ContextVar("admission_ticket", default=None)
+
+
+def parse_request_start(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Milliseconds since the proxy received the request (``t=<s|ms|us>`` or a bare number)."""
+    if not value:
+        return None
+    try:
+        stamp = float(value.strip().removeprefix("t="))
+    except ValueError:
+        return None
+    if stamp > 1e14:
+        stamp /= 1e6
+    elif stamp > 1e11:
+        stamp /= 1e3
+    return max(0.0, ((now or time.time()) - stamp) * 1000)
+
+
+class AdmissionController:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}
+
+    def enabled(self) -> bool:
+        return bool(getattr(config, "ADMISSION_ENABLED", True))
+
+    def configure(self, client: Any) -> None:
+        client.add_call_listener(self._on_upstream_call)
+
+    def _on_upstream_call(self, path: str, elapsed: float, error: Optional[BaseException]) -> None:
+        now = time.monotonic()
+        window = getattr(config, "ADMISSION_LATENCY_WINDOW_SECONDS", 60)
+        with self._lock:
+            samples = self._samples.setdefault(tenants.current().name, deque())
+            samples.append((now, elapsed))
+            while samples and now - samples[0][0] > window:
+                samples.popleft()
+
+    def gateway_latency(self) -> float:
+        """p90 gateway call time of the current tenant over the recent window (0 without samples)."""
+        window = getattr(config, "ADMISSION_LATENCY_WINDOW_SECONDS", 60)
+        now = time.monotonic()
+        with self._lock:
+            samples = self._samples.get(tenants.current().name) or ()
+            values = sorted(elapsed for at, elapsed in samples if now - at <= window)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(len(values) * 0.9))]
+
+    def limit(self) -> int:
+        if self.gateway_latency() > getattr(config, "ADMISSION_SLOW_GATEWAY_SECONDS", 3.0):
+            return max(1, int(tenants.setting("ADMISSION_SLOW_MAX_UPSTREAM_REQUESTS", 1)))
+        return max(1, int(tenants.setting("ADMISSION_MAX_UPSTREAM_REQUESTS", 4)))
+
+    def retry_after(self) -> int:
+        return max(1, min(30, math.ceil(self.gateway_latency() * 2)))
+
+    # ------------------------------------------------------------- requests
+    def begin_request(self, request_start: Optional[str] = None) -> None:
+        if self.enabled():
+            _ticket.set(_Ticket(parse_request_start(request_start)))
+
+    def end_request(self) -> None:
+        ticket = _ticket.get()
+        _ticket.set(None)
+        if ticket is not None and ticket.slot is not None:
+            fcntl.flock(ticket.slot, fcntl.LOCK_UN)
+            ticket.slot.close()
+
+    def before_upstream(self, path: str) -> None:
+        """Called before every gateway call; admits the current request on its first one."""
+        ticket = _ticket.get()
+        if ticket is None or ticket.slot is not None:
+            return
+        max_queue = getattr(config, "ADMISSION_MAX_QUEUE_MS", 5000)
+        if ticket.queue_ms is not None and max_queue and ticket.queue_ms > max_queue:
+            raise AdmissionRejected(f"queued {ticket.queue_ms:.0f} ms before {path}", self.retry_after())
+        slot = self._acquire_slot()
+        if slot is None:
+            raise AdmissionRejected(f"all {self.limit()} gateway slots busy before {path}", self.retry_after())
+        ticket.slot = slot
+
+    def _acquire_slot(self) -> Optional[IO[str]]:
+        directory = local_store.data_path(SLOT_DIR_NAME)
+        directory.mkdir(parents=True, exist_ok=True)
+        for index in range(self.limit()):
+            handle = open(directory / f"slot-{index}.lock", "w")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            return handle
+        return None
+
+
+ADMISSION = AdmissionController()
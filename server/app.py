@@ -1,41 +1,192 @@
 """Flask application exposing simplified endpoints for CRM follow-up assets."""
 from __future__ import annotations
 
+import json
 import os
 import re
-from datetime import date, timedelta
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
-
-from flask import Flask, jsonify, request, send_from_directory, send_file
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    request,
+    send_file,
+    send_from_directory,
+    stream_with_context,
+)
 
 try:
     import server.config as config  # type: ignore
 except ImportError:  # pragma: no cover
     import server.config_example as config  # type: ignore
 
+from server import compression, deadline, photo_export, structured_log, tenants
+from server.admission import ADMISSION, AdmissionRejected
+from server.attachment_cache import ATTACHMENT_CACHE
+from server.export_jobs import EXPORT_JOBS, ExportError, summarize as summarize_export
+from server.cache_warmer import CACHE_WARMER
 from server.crm_client import CRM_CLIENT
+from server.crm_events import CRM_EVENTS, EventError
+from server.customer_index import CUSTOMER_INDEX
+from server.known_codes import KNOWN_CODES, NEGATIVE_CACHE
+from server.l2_cache import L2_CACHE
+from server.phone_index import OWNER_CODE_FIELDS, PHONE_INDEX
+from server.profiler import PROFILER
+from server.record_utils import CODE_TOKEN_RE, extract_nested, record_customer_code
+from server.replica import REPLICA
+from server.static_assets import STATIC_ASSETS
 from server.token_service import TOKEN_SERVICE
+from server.warmup import WARMUP
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
 
+structured_log.install()
 app = Flask(__name__)
-app.logger.setLevel("DEBUG")
+app.wsgi_app = tenants.TenantMiddleware(app.wsgi_app)  # type: ignore[method-assign]
+
+
+@app.before_request
+def _bind_tenant() -> None:
+    # TenantMiddleware 已依 Host 或路徑前綴選好租戶；之後的每個服務都用該租戶的實例
+    tenants.activate(tenants.get(request.environ.get(tenants.ENVIRON_KEY, "")) or tenants.DEFAULT)
+
+
+@app.teardown_request
+def _unbind_tenant(exc: Optional[BaseException]) -> None:
+    # Registered first, so it runs after every other teardown (which may still use tenant services).
+    tenants.activate(tenants.DEFAULT)
+
+
+@app.before_request
+def _begin_request_log() -> None:
+    if request.path.startswith("/api/"):
+        structured_log.begin_request(request.headers.get("X-Request-Id"), request.headers.get("X-Debug-Log"))
+
+
+@app.after_request
+def _tag_request_id(response: Any) -> Any:
+    rid = structured_log.request_id()
+    if rid:
+        response.headers["X-Request-Id"] = rid
+    return response
+
+
+@app.teardown_request
+def _end_request_log(exc: Optional[BaseException]) -> None:
+    # Registered right after the tenant's, so it runs after every other teardown (which may still log).
+    structured_log.end_request()
+
+
+# 寫入不做負載卸除：儲存紀錄失敗比慢一點更糟
+ADMISSION_EXEMPT_ENDPOINTS = {"api_save_followup", "api_crm_events"}
+
+
+@app.before_request
+def _ensure_warm_up() -> None:
+    # gunicorn 已在 post_worker_init 預熱；其他伺服器由第一個請求在背景啟動
+    if not WARMUP.started():
+        WARMUP.start()
+
+
+@app.before_request
+def _begin_admission() -> None:
+    # 請求第一次真正呼叫閘道時才佔用名額；靜態頁面與快取命中不受限
+    if request.path.startswith("/api/") and request.endpoint not in ADMISSION_EXEMPT_ENDPOINTS:
+        ADMISSION.begin_request(request.headers.get("X-Request-Start"))
+
+
+@app.teardown_request
+def _end_admission(exc: Optional[BaseException]) -> None:
+    ADMISSION.end_request()
+
+
+@app.errorhandler(AdmissionRejected)
+def _admission_rejected(exc: AdmissionRejected) -> Any:
+    app.logger.warning("[Admission] %s %s rejected: %s", request.method, request.path, exc)
+    response = jsonify({"code": "OVERLOADED", "message": "系統繁忙，請稍後再試。", "retryAfter": exc.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response
+
+
+@app.before_request
+def _apply_crm_events() -> None:
+    # Events received by other workers: drop this worker's in-memory entries for those customers.
+    if request.path.startswith("/api/"):
+        CRM_EVENTS.catch_up()
+
+
+@app.before_request
+def _start_request_profile() -> None:
+    if not request.path.startswith("/api/"):
+        return
+    flag = request.headers.get("X-Profile") or request.args.get("_profile")
+    if not flag:
+        return
+    session, reason = PROFILER.begin(
+        flag, request.headers.get("X-Profile-Token", ""), f"{request.method} {request.full_path}"
+    )
+    g.profile_session = session
+    g.profile_status = reason
+
+
+@app.after_request
+def _tag_request_profile(response: Any) -> Any:
+    session = g.get("profile_session")
+    if session is not None:
+        response.headers["X-Profile-Id"] = session.id
+    elif g.get("profile_status"):
+        response.headers["X-Profile-Skipped"] = g.profile_status
+    g.profile_response_status = response.status
+    return response
+
+
+@app.after_request
+def _compress_api_response(response: Any) -> Any:
+    if request.path.startswith("/api/"):
+        return compression.compress_response(response, request.accept_encodings)
+    return response
+
+
+@app.teardown_request
+def _finish_request_profile(exc: Optional[BaseException]) -> None:
+    # Runs after a streamed body has been sent as well, so SSE lookups are profiled in full.
+    session = g.pop("profile_session", None)
+    if session is not None:
+        status = f"error: {exc}" if exc else g.get("profile_response_status")
+        PROFILER.end(session, status)
 
 
 @app.route("/")
 def index_page() -> Any:  # pragma: no cover - static file helper
-    return send_from_directory(ROOT_DIR, "index.html")
+    return STATIC_ASSETS.html_response(ROOT_DIR / "index.html")
 
 
 @app.route("/report.html")
 def report_page() -> Any:  # pragma: no cover - static file helper
-    return send_from_directory(ROOT_DIR, "report.html")
+    return STATIC_ASSETS.html_response(ROOT_DIR / "report.html")
 
 
 @app.route("/records.html")
 def records_page() -> Any:  # pragma: no cover - static file helper
-    return send_from_directory(ROOT_DIR, "records.html")
+    return STATIC_ASSETS.html_response(ROOT_DIR / "records.html")
+
+
+@app.route("/sw.js")
+def service_worker() -> Any:  # pragma: no cover - static file helper
+    # 技師頁面的離線快取；大張 pic_hd 圖只在瀏覽時進執行期快取，不預先下載
+    return STATIC_ASSETS.service_worker_response(
+        ROOT_DIR / "sw.js",
+        pages=["./", "records.html", "report.html"],
+        assets=["style.css", "assets/12731758007267_.pic_hd.jpg"],
+    )
 
 
 @app.route("/members.html")
@@ -49,13 +200,24 @@ def members_style() -> Any:  # pragma: no cover - static file helper
 
 
 @app.route("/style.css")
-def style_file() -> Any:  # pragma: no cover - static file helper
-    return send_from_directory(ROOT_DIR, "style.css")
+@app.route("/style.<digest>.css")
+def style_file(digest: Optional[str] = None) -> Any:  # pragma: no cover - static file helper
+    hashed = STATIC_ASSETS.send(f"style.{digest}.css") if digest else None
+    return hashed or send_from_directory(ROOT_DIR, "style.css")
 
 
 @app.route("/assets/<path:filename>")
 def assets_file(filename: str) -> Any:  # pragma: no cover - static file helper
-    return send_from_directory(ROOT_DIR / "assets", filename)
+    # 內容雜湊檔名（python -m server.static_assets 產生）可永久快取，其餘照舊
+    hashed = STATIC_ASSETS.send(f"assets/{filename}")
+    return hashed or send_from_directory(ROOT_DIR / "assets", filename)
+
+
+@app.route("/healthz/ready")
+def healthz_ready() -> Any:
+    """Readiness probe: 503 until this worker has finished warming up."""
+    report = WARMUP.report()
+    return jsonify(report), 200 if WARMUP.ready() else 503
 
 
 @app.route("/api/token")
@@ -81,39 +243,158 @@ def api_save_followup() -> Any:
         
         # 調用CRM客戶端保存跟進記錄
         result = CRM_CLIENT.save_followup(request_data)
-        
+
+        saved = result.get("data") if isinstance(result, dict) else None
+        saved_records = [request_data, saved if isinstance(saved, dict) else {}]
+        CUSTOMER_INDEX.observe_records(saved_records)
+        CUSTOMER_INDEX.save()
+        saved_codes = {record_customer_code(item) for item in saved_records}
+        saved_codes |= {REPLICA.code_for_customer_id(item.get("customer")) for item in saved_records}
+        saved_codes.discard("")
+        for saved_code in saved_codes:
+            REPLICA.invalidate_customer(saved_code)
+            KNOWN_CODES.add(saved_code)
+        # 新紀錄可能讓先前查無資料的編碼或電話變成有結果
+        NEGATIVE_CACHE.clear()
+        if saved_codes and CRM_CLIENT.response_cache is not None:
+            # save_followup only sees codes present in the payload; add ones mapped from customer ids
+            CRM_CLIENT.response_cache.invalidate(
+                saved_codes, paths=[config.FOLLOWUP_LIST_PATH, getattr(config, "TASK_LIST_PATH", "")]
+            )
+
         return jsonify(result)
         
     except Exception as e:
         return jsonify({"code": 500, "message": f"保存失敗: {str(e)}"}), 500
 
 
+@app.route("/api/crm/events", methods=["POST"])
+def api_crm_events() -> Any:
+    """CRM 變更事件（YonBIP 事件推送）：只失效相關客戶的快取與本地索引。"""
+    if not CRM_EVENTS.enabled():
+        return jsonify({"code": 404, "message": "CRM 事件接收未啟用"}), 404
+    body = request.get_data(cache=True)
+    if not CRM_EVENTS.verify(
+        body, request.headers.get("X-Event-Timestamp", ""), request.headers.get("X-Event-Signature", "")
+    ):
+        return jsonify({"code": 401, "message": "簽章驗證失敗"}), 401
+    try:
+        results = CRM_EVENTS.handle(json.loads(body or b"null"))
+    except (ValueError, EventError) as exc:
+        return jsonify({"code": 400, "message": f"事件格式錯誤: {exc}"}), 400
+    return jsonify({"code": "OK", "events": results})
+
+
 @app.route("/api/customers/<customer_code>/followups")
 def api_customer_followups(customer_code: str) -> Any:
     page = int(request.args.get("page", 1))
     page_size = int(request.args.get("pageSize", config.DEFAULT_PAGE_SIZE))
+    try:
+        with deadline.budget(getattr(config, "REQUEST_DEADLINE_SECONDS", 20)):
+            return jsonify(_lookup_customer_followups(customer_code, page, page_size))
+    except deadline.DeadlineExceeded as exc:
+        app.logger.warning("[Deadline] followups for %s: %s", customer_code, exc)
+        return jsonify({"code": "DEADLINE", "message": "查詢逾時，請稍後再試。", "partial": True}), 504
+
+
+@app.route("/api/customers/<customer_code>/followups/stream")
+def api_customer_followups_stream(customer_code: str) -> Any:
+    """同一查詢的 Server-Sent Events 版本：先送出解析結果與保養摘要，照片查完再推送紀錄。
+
+    與一般 API 相同只回傳第一筆有照片的紀錄，因此只有一個 record 事件，其後的附件不再查詢。
+    """
+    page = int(request.args.get("page", 1))
+    page_size = int(request.args.get("pageSize", config.DEFAULT_PAGE_SIZE))
+
+    def _events() -> Iterator[str]:
+        try:
+            with deadline.budget(getattr(config, "REQUEST_DEADLINE_SECONDS", 20)):
+                for event, data in _followup_pipeline(customer_code, page, page_size):
+                    yield _sse_event(event, data)
+        except deadline.DeadlineExceeded as exc:
+            app.logger.warning("[Deadline] followup stream for %s: %s", customer_code, exc)
+            yield _sse_event("error", {"code": "DEADLINE", "message": "查詢逾時，請稍後再試。"})
+        except AdmissionRejected as exc:
+            app.logger.warning("[Admission] followup stream for %s rejected: %s", customer_code, exc)
+            yield _sse_event("error", {
+                "code": "OVERLOADED", "message": "系統繁忙，請稍後再試。", "retryAfter": exc.retry_after,
+            })
+        except Exception:  # pragma: no cover - runtime logging
+            app.logger.exception("Followup stream failed for %s", customer_code)
+            yield _sse_event("error", {"code": 500, "message": "查詢時發生錯誤，請稍後再試。"})
+
+    return Response(
+        stream_with_context(_events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    body = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {body}\n\n"
+
+
+def _lookup_customer_followups(customer_code: str, page: int, page_size: int) -> Dict[str, Any]:
+    """查詢客戶的跟進紀錄、照片與保養摘要（API 與快取預熱共用）。"""
+    payload: Dict[str, Any] = {}
+    for event, data in _followup_pipeline(customer_code, page, page_size):
+        if event == "done":
+            payload = data
+    return payload
+
+
+def _followup_pipeline(
+    customer_code: str, page: int, page_size: int
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """依序產生 resolved → summary → record… → done 事件；一般與串流 API 共用。"""
     identifier = str(customer_code or "").strip()
 
-    def _looks_like_phone(text: str) -> bool:
-        digits = [ch for ch in text if ch.isdigit()]
-        if len(digits) < 6:
-            return False
-        non_digits = [ch for ch in text if not (ch.isdigit() or ch in {"+", "-", " ", "#"})]
-        return len(non_digits) <= 3
+    rejected = _rejected_lookup(customer_code, identifier)
+    if rejected is not None:
+        yield "resolved", {
+            "customerCode": customer_code,
+            "resolvedCustomerCode": None,
+            "suggestedCodes": rejected["suggestedCodes"],
+            "searchMode": rejected["filterInfo"].get("searchMode"),
+            "partial": False,
+            "skippedStages": [],
+        }
+        yield "summary", {"summary": None, "tasks": [], "partial": False, "skippedStages": []}
+        yield "done", rejected
+        return
 
     search_kwargs: Dict[str, Any] = {}
     search_mode = "code"
     search_field_used: Optional[str] = None
+    query_value = identifier
+    phone_codes: List[str] = []
+    # 剩餘時間不足時略過的可選階段，回傳給前端作為 partial 標記
+    skipped: List[str] = []
     if _looks_like_phone(identifier):
-        search_kwargs = {"search_field": "customer.name", "search_operator": "like"}
         search_mode = "phone"
+        # 先查本地電話索引，命中則直接以客戶編碼精確查詢，避免 customer.name like 掃描
+        phone_codes = PHONE_INDEX.lookup(identifier)
+        if phone_codes:
+            query_value = phone_codes[0]
+            search_kwargs = {"search_field": "customer.code", "search_operator": "eq"}
+        else:
+            search_kwargs = {"search_field": "customer.name", "search_operator": "like"}
 
-    followup_data = CRM_CLIENT.get_followups(
-        identifier,
-        page=page,
-        page_size=page_size,
-        **search_kwargs,
-    )
+    try:
+        if search_mode == "phone" and not phone_codes:
+            followup_data = CRM_CLIENT.get_followups(
+                query_value,
+                page=page,
+                page_size=page_size,
+                **search_kwargs,
+            )
+        else:
+            followup_data = _replica_or_live_followups(query_value, page, page_size, **search_kwargs)
+    except deadline.DeadlineExceeded as exc:
+        app.logger.warning("[Deadline] followup list for %s: %s", identifier, exc)
+        _skip_stage(skipped, "followups")
+        followup_data = {"data": {"recordList": []}}
     search_field_used = search_kwargs.get("search_field") or config.FOLLOWUP_CUSTOMER_FIELD
     meta = followup_data.get("_meta") if isinstance(followup_data, dict) else None
     if isinstance(meta, dict) and meta.get("searchField"):
@@ -123,6 +404,10 @@ def api_customer_followups(customer_code: str) -> Any:
         "searchMode": search_mode,
         "searchField": search_field_used,
     }
+    if isinstance(meta, dict) and meta.get("source"):
+        filter_info["source"] = meta.get("source")
+    if phone_codes:
+        filter_info["phoneIndexCodes"] = phone_codes
 
     # Guardrail: If backend uses fuzzy matching (e.g., LIKE), restrict to exact code here
     resolved_code: Optional[str] = None
@@ -131,15 +416,31 @@ def api_customer_followups(customer_code: str) -> Any:
         raw_list = (
             followup_data.get("data", {}).get("recordList", []) or []
         )
-        if search_mode == "phone" and not raw_list:
+        if search_mode == "phone" and phone_codes and not raw_list and "followups" not in skipped:
+            # 索引命中卻查無紀錄：電話可能已換到其他客戶，重讀索引中客戶的地址，並改走電話模糊查詢
+            filter_info["phoneIndexStale"] = phone_codes
+            filter_info.pop("phoneIndexCodes", None)
+            _refresh_stale_phone_codes(phone_codes, skipped)
+            phone_codes = []
+            query_value = identifier
+        if (
+            search_mode == "phone"
+            and not phone_codes
+            and not raw_list
+            and "followups" not in skipped
+            and _optional_stage("searchFallback", skipped)
+        ):
             fallback_field = "customer.name"
-            followup_data = CRM_CLIENT.get_followups(
-                identifier,
-                page=page,
-                page_size=page_size,
-                search_field=fallback_field,
-                search_operator="like",
-            )
+            try:
+                followup_data = CRM_CLIENT.get_followups(
+                    identifier,
+                    page=page,
+                    page_size=page_size,
+                    search_field=fallback_field,
+                    search_operator="like",
+                )
+            except AdmissionRejected as exc:
+                _shed_stage(skipped, "searchFallback", exc)
             raw_list = (
                 followup_data.get("data", {}).get("recordList", []) or []
             )
@@ -149,42 +450,21 @@ def api_customer_followups(customer_code: str) -> Any:
                 filter_info["searchFallback"] = fallback_field
         else:
             filter_info["searchField"] = search_field_used
-        expected = str(identifier or "").strip().upper()
+        expected = str(query_value or "").strip().upper()
         detail_cache: Dict[Tuple[str, str], str] = {}
         detail_hits = 0
 
-        def _is_code_like(text: str) -> bool:
-            return any(ch.isalpha() for ch in text)
-
-        def _matches_code(item: Dict[str, Any], expected_code: str) -> bool:
-            # Common flat fields
-            for key in ("customer_code", "customerCode"):
-                val = str(item.get(key) or "").strip().upper()
-                if val and val == expected_code:
-                    return True
-            # Some payloads put the code in 'customer' (while IDs are usually numeric)
-            cust = item.get("customer")
-            if isinstance(cust, str):
-                val = cust.strip().upper()
-                if val and _is_code_like(val) and val == expected_code:
-                    return True
-            # Nested structure fallback (rare)
-            nested = _extract_nested(item, "customer.code")
-            if isinstance(nested, str) and nested.strip().upper() == expected_code:
+        def _matches_code_or_detail(item: Dict[str, Any], expected_code: str) -> bool:
+            if _matches_code(item, expected_code):
                 return True
-            # Sometimes code is embedded in name like "C4021偉業行貿易公司..."
-            for key in ("customer_name", "customer.name", "customerName"):
-                name_val = item.get(key) if "." not in key else _extract_nested(item, key)
-                if isinstance(name_val, str) and name_val:
-                    m = CODE_TOKEN_RE.search(name_val.upper())
-                    if m and m.group(0) == expected_code:
-                        return True
             # Fallback: query customer detail to retrieve authoritative code
             cust_id = item.get("customer")
             org_id = item.get("org")
             if cust_id:
                 key = (str(cust_id), str(org_id or ""))
                 if key not in detail_cache:
+                    if "detailFallback" in skipped or not _optional_stage("detailFallback", skipped):
+                        return False
                     try:
                         if not org_id:
                             raise ValueError("missing org id for customer detail lookup")
@@ -192,13 +472,23 @@ def api_customer_followups(customer_code: str) -> Any:
                         detail_data = detail_resp.get("data") or {}
                         detail_code = str(detail_data.get("code") or "").strip().upper()
                         detail_cache[key] = detail_code
+                        PHONE_INDEX.observe_detail(detail_data)
+                        CUSTOMER_INDEX.add(detail_code, _detail_customer_name(detail_data))
+                        REPLICA.remember_customer_id(cust_id, detail_code)
+                    except deadline.DeadlineExceeded:
+                        _skip_stage(skipped, "detailFallback")
+                        return False
+                    except AdmissionRejected as exc:
+                        _shed_stage(skipped, "detailFallback", exc)
+                        return False
                     except Exception as exc:  # pragma: no cover - runtime diagnostics
-                        app.logger.debug(
-                            "[Filter] detail lookup failed for %s/%s: %s",
-                            cust_id,
-                            org_id,
-                            exc,
-                        )
+                        if structured_log.debug_on():
+                            app.logger.debug(
+                                "[Filter] detail lookup failed for %s/%s: %s",
+                                cust_id,
+                                org_id,
+                                exc,
+                            )
                         detail_cache[key] = ""
                 detail_code = detail_cache.get(key, "")
                 if detail_code and detail_code == expected_code:
@@ -217,7 +507,7 @@ def api_customer_followups(customer_code: str) -> Any:
                     candidate = str(value).strip().upper()
                     break
             if not candidate:
-                nested_code = _extract_nested(item, "customer.code")
+                nested_code = extract_nested(item, "customer.code")
                 if isinstance(nested_code, str):
                     candidate = nested_code.strip().upper()
             if not candidate and isinstance(item.get("customer"), str):
@@ -234,10 +524,12 @@ def api_customer_followups(customer_code: str) -> Any:
                     "followTime": item.get("followTime") or item.get("followUpTime"),
                 })
 
-        detail_unique = sorted({code for code in detail_cache.values() if code})
+        detail_unique: List[str] = []
 
         if expected and raw_list:
-            exact_list = [it for it in raw_list if _matches_code(it, expected)]
+            exact_list = [it for it in raw_list if _matches_code_or_detail(it, expected)]
+            # detail_cache 只會在 _matches_code_or_detail 中填入，需在比對後才彙整
+            detail_unique = sorted({code for code in detail_cache.values() if code})
 
             def _detail_code(item: Dict[str, Any]) -> str:
                 cust_id = item.get("customer")
@@ -262,11 +554,17 @@ def api_customer_followups(customer_code: str) -> Any:
                         item for item in raw_list if _detail_code(item) == resolved_code
                     ]
                 else:
-                    suggestions = detail_unique
+                    suggestions = detail_unique or [
+                        code for code in CUSTOMER_INDEX.codes_with_prefix(expected)
+                        if code != expected
+                    ]
 
             if exact_list:
                 resolved_code = resolved_code or expected
+            if len(phone_codes) > 1:
+                suggestions = phone_codes
 
+            CUSTOMER_INDEX.observe_records(raw_list)
             data_obj = dict(followup_data.get("data") or {})
             data_obj["recordList"] = exact_list  # 即使為空也覆蓋，避免混入近似代碼
             followup_data = dict(followup_data)
@@ -296,6 +594,11 @@ def api_customer_followups(customer_code: str) -> Any:
                 "suggestedCodes": suggestions,
             })
         else:
+            if expected and search_mode == "code":
+                suggestions = [
+                    code for code in CUSTOMER_INDEX.codes_with_prefix(expected)
+                    if code != expected
+                ]
             detail_examples = [
                 {
                     "customer": key[0],
@@ -316,24 +619,70 @@ def api_customer_followups(customer_code: str) -> Any:
                 "resolvedCode": resolved_code,
                 "suggestedCodes": suggestions,
             })
+    except AdmissionRejected:
+        raise
     except Exception as _exc:  # pragma: no cover - defensive
         app.logger.debug("[Filter] skip exact filter due to: %s", _exc)
         filter_info["error"] = str(_exc)
 
+    yield "resolved", {
+        "customerCode": customer_code,
+        "resolvedCustomerCode": resolved_code,
+        "suggestedCodes": suggestions,
+        "searchMode": search_mode,
+        "partial": bool(skipped),
+        "skippedStages": list(skipped),
+    }
+
+    if search_mode == "phone" and not phone_codes and (resolved_code or suggestions):
+        _tag_cached_phone_search(identifier, [resolved_code or "", *suggestions])
+    if search_mode == "phone" and not phone_codes and suggestions and deadline.allows(_stage_reserve()):
+        # 慢路徑解析出的客戶編碼：批次讀取地址，讓下次同一電話直接命中本地索引
+        try:
+            PHONE_INDEX.refresh(suggestions, CRM_CLIENT)
+        except AdmissionRejected as exc:
+            _shed_stage(skipped, "phoneIndex", exc)
+        except Exception as exc:  # pragma: no cover - runtime diagnostics
+            app.logger.debug("[PhoneIndex] refresh failed for %s: %s", suggestions, exc)
+    PHONE_INDEX.save()
+
     target_customer_code = resolved_code or customer_code
 
     task_records: List[Dict[str, Any]] = []
     task_page_size = getattr(config, "DEFAULT_TASK_PAGE_SIZE", config.DEFAULT_PAGE_SIZE)
-    if getattr(config, "TASK_LIST_PATH", ""):
+    if getattr(config, "TASK_LIST_PATH", "") and _optional_stage("tasks", skipped):
         try:
-            tasks_response = CRM_CLIENT.get_tasks(target_customer_code, page=1, page_size=task_page_size)
-            task_records = (
-                tasks_response.get("data", {}).get("recordList", []) or []
-            )
+            task_records = _replica_or_live_tasks(target_customer_code, task_page_size)
+        except deadline.DeadlineExceeded:
+            _skip_stage(skipped, "tasks")
+        except AdmissionRejected as exc:
+            _shed_stage(skipped, "tasks", exc)
         except Exception as exc:  # pragma: no cover - runtime debug only
             app.logger.warning("[Task] lookup failed for %s: %s", customer_code, exc)
 
     offset_days = getattr(config, "MAINTENANCE_NEXT_DATE_OFFSET_DAYS", 0)
+    summary = _extract_maintenance_summary(target_customer_code, followup_data, task_records)
+    if summary:
+        if resolved_code and summary.get("customerCode") != resolved_code:
+            summary["customerCode"] = resolved_code
+        if offset_days:
+            shifted_summary_next = _shift_date_string(summary.get("nextServiceDate"), offset_days)
+            if shifted_summary_next:
+                summary["nextServiceDate"] = shifted_summary_next
+
+    if resolved_code:
+        CUSTOMER_INDEX.add(resolved_code, summary.get("customerName") if summary else None)
+    CUSTOMER_INDEX.save()
+    CACHE_WARMER.record_lookup(resolved_code or identifier)
+
+    yield "summary", {
+        "summary": summary,
+        "tasks": task_records,
+        "partial": bool(skipped),
+        "skippedStages": list(skipped),
+    }
+
+    upcoming_date = summary.get("nextServiceDate") if summary else None
     records: List[Dict[str, Any]] = []
     for item in followup_data.get("data", {}).get("recordList", []):
         owner = str(item.get("ower_name") or "")
@@ -341,72 +690,64 @@ def api_customer_followups(customer_code: str) -> Any:
             continue
 
         followup_id = str(item.get(config.FOLLOWUP_ID_FIELD, ""))
-        service_date = _extract_nested(item, getattr(config, "FOLLOWUP_SERVICE_DATE_FIELD", ""))
-        next_date = _extract_nested(item, getattr(config, "FOLLOWUP_NEXT_SERVICE_DATE_FIELD", ""))
-        if not service_date:
-            service_date = item.get("followTime") or item.get("followUpTime")
-        if not next_date:
-            next_date = item.get("nextFollowUpTime") or None
-
-        service_date_obj = _parse_follow_date(service_date)
-        if not service_date_obj:
-            service_date_obj = _parse_follow_date(item.get("followTime") or item.get("followUpTime"))
-        next_date_obj = _parse_follow_date(next_date)
-        if offset_days and next_date_obj:
-            next_date_obj = next_date_obj + timedelta(days=offset_days)
+        service_date, next_date = _followup_service_dates(item, offset_days)
 
         photo_ids = _collect_photo_ids(item)
-        app.logger.debug("[Followup] %s photo candidates: %s", followup_id, photo_ids)
+        if structured_log.debug_on():
+            app.logger.debug("[Followup] %s photo candidates: %s", followup_id, photo_ids)
         files: List[Dict[str, Any]] = []
-        if photo_ids:
+        files_pending = False
+        if photo_ids and not _optional_stage("attachments", skipped):
+            files_pending = True
+        elif photo_ids:
             try:
                 files_response = CRM_CLIENT.query_followup_files(photo_ids)
+            except deadline.DeadlineExceeded:
+                _skip_stage(skipped, "attachments")
+                files_pending = True
+                files_response = {"data": {}}
+            except AdmissionRejected as exc:
+                _shed_stage(skipped, "attachments", exc)
+                files_pending = True
+                files_response = {"data": {}}
             except RuntimeError as exc:
                 app.logger.warning(
                     "[Followup] %s photo lookup failed: %s", followup_id, exc
                 )
                 files_response = {"data": {}}
             files = _extract_query_files(files_response, photo_ids)
-            app.logger.debug("[Followup] %s fetched %s files", followup_id, len(files))
+            if structured_log.debug_on():
+                app.logger.debug("[Followup] %s fetched %s files", followup_id, len(files))
 
         photos, documents = _split_files(files)
-        if not photos:
+        if not photos and not files_pending:
             continue
 
-        records.append({
+        record = {
             "followupId": followup_id,
-            "serviceDate": _date_to_iso(service_date_obj) or service_date,
-            "nextServiceDate": _date_to_iso(next_date_obj) or next_date,
+            "serviceDate": service_date,
+            "nextServiceDate": next_date,
             "raw": item,
             "files": files,
             "photos": photos,
             "documents": documents,
-        })
-
-    records_with_photos = [rec for rec in records if rec["photos"]]
-    if records_with_photos:
-        records = [records_with_photos[0]]
-
-    summary = _extract_maintenance_summary(target_customer_code, followup_data, task_records)
-    if summary:
-        if resolved_code and summary.get("customerCode") != resolved_code:
-            summary["customerCode"] = resolved_code
-        if offset_days:
-            shifted_summary_next = _shift_date_string(summary.get("nextServiceDate"), offset_days)
-            if shifted_summary_next:
-                summary["nextServiceDate"] = shifted_summary_next
-
-    upcoming_date = summary.get("nextServiceDate") if summary else None
-    if upcoming_date:
-        for record in records:
+        }
+        if files_pending:
+            # 照片查詢因逾時略過；保留紀錄讓前端顯示日期並標示照片未載入
+            record["filesPending"] = True
+        if upcoming_date:
             if not record.get("nextServiceDate"):
                 record["nextServiceDate"] = upcoming_date
             elif offset_days:
                 shifted_record_next = _shift_date_string(record.get("nextServiceDate"), offset_days)
                 if shifted_record_next:
                     record["nextServiceDate"] = shifted_record_next
+        records.append(record)
+        yield "record", record
+        # 只回傳第一筆有照片（或照片未載入）的紀錄，其後的附件查詢不必再打
+        break
 
-    return jsonify({
+    payload = {
         "code": "OK",
         "customerCode": customer_code,
         "resolvedCustomerCode": resolved_code,
@@ -416,7 +757,339 @@ def api_customer_followups(customer_code: str) -> Any:
         "tasks": task_records,
         "summary": summary,
         "filterInfo": filter_info,
-    })
+        "partial": bool(skipped),
+        "skippedStages": skipped,
+    }
+    has_dates = bool(summary) and any(
+        summary.get(key) for key in ("latestServiceDate", "nextServiceDate", "previousServiceDate")
+    )
+    # 有略過（逾時或被限流）的階段時，查無結果不代表客戶不存在，不可寫入負快取
+    if page == 1 and not (records or resolved_code or has_dates or task_records or skipped):
+        NEGATIVE_CACHE.put(identifier, payload)
+    yield "done", payload
+
+
+def _followup_service_dates(item: Dict[str, Any], offset_days: int) -> Tuple[Any, Any]:
+    """跟進紀錄的本次 / 下次保養日期（可解析時為 ISO 字串，否則保留原值）。"""
+    service_date = extract_nested(item, getattr(config, "FOLLOWUP_SERVICE_DATE_FIELD", ""))
+    next_date = extract_nested(item, getattr(config, "FOLLOWUP_NEXT_SERVICE_DATE_FIELD", ""))
+    if not service_date:
+        service_date = item.get("followTime") or item.get("followUpTime")
+    if not next_date:
+        next_date = item.get("nextFollowUpTime") or None
+
+    service_date_obj = _parse_follow_date(service_date)
+    if not service_date_obj:
+        service_date_obj = _parse_follow_date(item.get("followTime") or item.get("followUpTime"))
+    next_date_obj = _parse_follow_date(next_date)
+    if offset_days and next_date_obj:
+        next_date_obj = next_date_obj + timedelta(days=offset_days)
+    return _date_to_iso(service_date_obj) or service_date, _date_to_iso(next_date_obj) or next_date
+
+
+def _is_code_like(text: str) -> bool:
+    return any(ch.isalpha() for ch in text)
+
+
+def _matches_code(item: Dict[str, Any], expected_code: str) -> bool:
+    """紀錄本身的欄位（不查客戶詳情）是否指向 expected_code。"""
+    # Common flat fields
+    for key in ("customer_code", "customerCode"):
+        val = str(item.get(key) or "").strip().upper()
+        if val and val == expected_code:
+            return True
+    # Some payloads put the code in 'customer' (while IDs are usually numeric)
+    cust = item.get("customer")
+    if isinstance(cust, str):
+        val = cust.strip().upper()
+        if val and _is_code_like(val) and val == expected_code:
+            return True
+    # Nested structure fallback (rare)
+    nested = extract_nested(item, "customer.code")
+    if isinstance(nested, str) and nested.strip().upper() == expected_code:
+        return True
+    # Sometimes code is embedded in name like "C4021偉業行貿易公司..."
+    for key in ("customer_name", "customer.name", "customerName"):
+        name_val = item.get(key) if "." not in key else extract_nested(item, key)
+        if isinstance(name_val, str) and name_val:
+            m = CODE_TOKEN_RE.search(name_val.upper())
+            if m and m.group(0) == expected_code:
+                return True
+    return False
+
+
+def _rejected_lookup(customer_code: str, identifier: str) -> Optional[Dict[str, Any]]:
+    """本地即可判定查無資料的識別碼：短期負向快取，或已知客戶編碼過濾器確定不存在。"""
+    expected = identifier.upper()
+    is_phone = _looks_like_phone(identifier)
+    cached = NEGATIVE_CACHE.get(identifier)
+    if cached is not None:
+        payload = dict(cached, customerCode=customer_code)
+        payload["filterInfo"] = dict(cached.get("filterInfo") or {}, source="negativeCache")
+        if not payload.get("suggestedCodes") and not is_phone:
+            payload["suggestedCodes"] = CUSTOMER_INDEX.near_codes(expected)
+        return payload
+    if not expected or is_phone or not KNOWN_CODES.definitely_unknown(expected):
+        return None
+    if CUSTOMER_INDEX.codes_with_prefix(expected, 1):
+        # 可能是較長編碼的前綴，交給一般流程解析
+        return None
+    suggestions = CUSTOMER_INDEX.near_codes(expected)
+    return {
+        "code": "OK",
+        "customerCode": customer_code,
+        "resolvedCustomerCode": None,
+        "suggestedCodes": suggestions,
+        "records": [],
+        "raw": {"data": {"recordList": []}},
+        "tasks": [],
+        "summary": None,
+        "filterInfo": {
+            "expected": expected,
+            "searchMode": "code",
+            "source": "knownCodeFilter",
+            "rawCount": 0,
+            "kept": 0,
+            "suggestedCodes": suggestions,
+        },
+        "partial": False,
+        "skippedStages": [],
+    }
+
+
+def _stage_reserve() -> float:
+    return float(getattr(config, "DEADLINE_STAGE_RESERVE_SECONDS", 3))
+
+
+def _skip_stage(skipped: List[str], stage: str) -> None:
+    if stage not in skipped:
+        skipped.append(stage)
+
+
+def _shed_stage(skipped: List[str], stage: str, exc: AdmissionRejected) -> None:
+    """閘道忙碌時被限流的階段：與逾時相同，記為略過，回應標示 partial。"""
+    app.logger.info("[Admission] shed %s: %s", stage, exc)
+    _skip_stage(skipped, stage)
+
+
+def _tag_cached_phone_search(phone: str, codes: List[str]) -> None:
+    """電話模糊查詢的快取頁以電話為鍵：補上解析出的客戶編碼標籤，該客戶存檔時一併失效。"""
+    store = CRM_CLIENT.response_cache
+    if store is None or not store.enabled():
+        return
+    try:
+        store.add_tags([phone], codes, paths=[config.FOLLOWUP_LIST_PATH])
+    except Exception as exc:  # pragma: no cover - the page still expires by TTL
+        app.logger.debug("[L2Cache] tagging %s failed: %s", phone, exc)
+
+
+def _refresh_stale_phone_codes(codes: List[str], skipped: List[str]) -> None:
+    """把電話索引中查無紀錄的客戶標為過期並重讀地址；時間不足時留待下次查詢重讀。"""
+    PHONE_INDEX.expire(codes)
+    if not _optional_stage("phoneIndex", skipped):
+        return
+    try:
+        PHONE_INDEX.refresh(codes, CRM_CLIENT)
+    except AdmissionRejected as exc:
+        _shed_stage(skipped, "phoneIndex", exc)
+    except Exception as exc:  # pragma: no cover - runtime diagnostics
+        app.logger.debug("[PhoneIndex] refresh failed for %s: %s", codes, exc)
+
+
+def _optional_stage(stage: str, skipped: List[str]) -> bool:
+    """可選階段是否執行；請求剩餘時間不足預留值時略過並記錄。"""
+    if deadline.allows(_stage_reserve()):
+        return True
+    if stage not in skipped:
+        app.logger.info("[Deadline] skip %s (%.2fs left)", stage, deadline.remaining() or 0.0)
+    _skip_stage(skipped, stage)
+    return False
+
+
+@app.route("/api/customers/<customer_code>/photos.zip")
+def api_customer_photos_zip(customer_code: str) -> Any:
+    """以 ZIP 串流匯出客戶所有保養紀錄的照片（每筆紀錄一個資料夾，依 followTime 命名）。"""
+    code = str(customer_code or "").strip().upper()
+    if not code:
+        return jsonify({"message": "請輸入客戶編碼"}), 400
+    page_size = getattr(config, "PHOTO_EXPORT_PAGE_SIZE", 100)
+    try:
+        followups = _fetch_all_pages(
+            lambda page, size: _replica_or_live_followups(code, page, size),
+            page_size,
+            getattr(config, "PHOTO_EXPORT_MAX_PAGES", 50),
+        )
+    except AdmissionRejected:
+        raise
+    except Exception as exc:  # pragma: no cover - runtime logging
+        app.logger.warning("[Export] followup lookup failed for %s: %s", code, exc)
+        return jsonify({"message": "查詢跟進紀錄失敗，請稍後再試。"}), 502
+
+    with_photos: List[Tuple[Dict[str, Any], List[str]]] = []
+    for item in followups:
+        if "維修幫" not in str(item.get("ower_name") or ""):
+            continue
+        photo_ids = _collect_photo_ids(item)
+        if photo_ids:
+            with_photos.append((item, photo_ids))
+    if not with_photos:
+        return jsonify({"message": f"{code} 沒有可匯出的保養照片。"}), 404
+
+    archive = photo_export.stream_zip(
+        _photo_export_entries(with_photos),
+        workers=getattr(config, "PHOTO_EXPORT_WORKERS", 4),
+        timeout=getattr(config, "PHOTO_EXPORT_DOWNLOAD_TIMEOUT_SECONDS", 30),
+    )
+    filename = f"{code}-photos-{date.today():%Y%m%d}.zip"
+    return Response(
+        stream_with_context(archive),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def _photo_export_entries(
+    records: List[Tuple[Dict[str, Any], List[str]]]
+) -> Iterator[photo_export.ExportEntry]:
+    """逐批查詢附件（每批最多 PHOTO_EXPORT_QUERY_BATCH_SIZE 個 ID），產生 ZIP 項目。"""
+    batch_size = max(1, getattr(config, "PHOTO_EXPORT_QUERY_BATCH_SIZE", 50))
+    names = photo_export.ArchiveNames()
+    batch: List[Tuple[Dict[str, Any], List[str]]] = []
+    pending_ids = 0
+    for position, (item, photo_ids) in enumerate(records):
+        batch.append((item, photo_ids))
+        pending_ids += len(photo_ids)
+        if pending_ids < batch_size and position + 1 < len(records):
+            continue
+        all_ids = [photo_id for _, ids in batch for photo_id in ids]
+        lookup_error: Optional[str] = None
+        try:
+            response = CRM_CLIENT.query_followup_files(all_ids)
+        except RuntimeError as exc:  # 含 AdmissionRejected：照片無法取得時須列入 _errors.txt
+            app.logger.warning("[Export] attachment lookup failed for %s ids: %s", len(all_ids), exc)
+            lookup_error = f"attachment lookup failed: {exc}"
+            response = {"data": {}}
+        for record, ids in batch:
+            photos, _ = _split_files(_extract_query_files(response, ids))
+            follow_time = record.get("followTime") or record.get("followUpTime")
+            folder = names.folder(follow_time, str(record.get(config.FOLLOWUP_ID_FIELD, "")))
+            modified = None
+            parsed = _parse_follow_date(follow_time)
+            if parsed:
+                try:
+                    modified = datetime.fromisoformat(str(follow_time).replace("/", "-"))
+                except ValueError:
+                    modified = datetime(parsed.year, parsed.month, parsed.day)
+            if lookup_error:
+                yield photo_export.ExportEntry(
+                    arcname=f"{folder}/", url="", modified=modified,
+                    error=f"{lookup_error} ({len(ids)} photos: {', '.join(ids)})",
+                )
+                continue
+            for index, photo in enumerate(photos, start=1):
+                if not photo.get("fileUrl"):
+                    continue
+                yield photo_export.ExportEntry(
+                    arcname=names.file(folder, photo.get("fileName"), f"photo_{index}.jpg"),
+                    url=str(photo["fileUrl"]),
+                    modified=modified,
+                )
+        batch = []
+        pending_ids = 0
+
+
+EXPORT_JOB_ID_RE = re.compile(r"^[0-9a-f]{12}$")
+
+
+@app.route("/api/exports", methods=["POST"])
+def api_create_export() -> Any:
+    """建立背景匯出工作（CSV / XLSX），回傳 jobId 供查詢進度與下載。"""
+    payload = request.get_json(silent=True) or {}
+    for key in ("startDate", "endDate"):
+        value = payload.get(key)
+        if value and not _parse_follow_date(value):
+            return jsonify({"message": f"{key} 日期格式錯誤（YYYY-MM-DD）"}), 400
+    try:
+        state = EXPORT_JOBS.create(payload)
+    except ExportError as exc:
+        return jsonify({"message": str(exc)}), 400
+    return jsonify(summarize_export(state)), 202
+
+
+@app.route("/api/exports/<job_id>")
+def api_export_status(job_id: str) -> Any:
+    state = EXPORT_JOBS.status(job_id) if EXPORT_JOB_ID_RE.match(job_id) else None
+    if state is None:
+        return jsonify({"message": "找不到匯出工作"}), 404
+    return jsonify(summarize_export(state))
+
+
+@app.route("/api/exports/<job_id>/resume", methods=["POST"])
+def api_resume_export(job_id: str) -> Any:
+    """從最後一個檢查點繼續中斷或失敗的匯出。"""
+    state = EXPORT_JOBS.resume(job_id) if EXPORT_JOB_ID_RE.match(job_id) else None
+    if state is None:
+        return jsonify({"message": "找不到匯出工作"}), 404
+    return jsonify(summarize_export(state)), 202
+
+
+@app.route("/api/exports/<job_id>/download")
+def api_download_export(job_id: str) -> Any:
+    path = EXPORT_JOBS.output_path(job_id) if EXPORT_JOB_ID_RE.match(job_id) else None
+    if path is None or not path.exists():
+        return jsonify({"message": "匯出尚未完成"}), 404
+    return send_file(
+        path,
+        as_attachment=True,
+        download_name=f"followups-{date.today():%Y%m%d}-{job_id}{path.suffix}",
+    )
+
+
+def _mapped_customer_code(item: Dict[str, Any]) -> str:
+    """紀錄的客戶編碼；只帶客戶 id 的紀錄經副本的 id 對照表換成編碼（查不到為 ""）。"""
+    code = record_customer_code(item)
+    if not code and item.get("customer"):
+        code = REPLICA.code_for_customer_id(item.get("customer"))
+    return code
+
+
+def _export_followup_row(item: Dict[str, Any], params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """匯出列：與查詢 API 相同的日期正規化（含 MAINTENANCE_NEXT_DATE_OFFSET_DAYS）。"""
+    owner = str(item.get("ower_name") or "")
+    if params.get("maintenanceOnly") and "維修幫" not in owner:
+        return None
+    service_date, next_date = _followup_service_dates(
+        item, getattr(config, "MAINTENANCE_NEXT_DATE_OFFSET_DAYS", 0)
+    )
+    return {
+        "type": "followup",
+        "id": item.get(config.FOLLOWUP_ID_FIELD, ""),
+        "customerCode": _mapped_customer_code(item),
+        "customerName": item.get("customer_name") or extract_nested(item, "customer.name") or "",
+        "owner": owner,
+        "serviceDate": service_date or "",
+        "nextServiceDate": next_date or "",
+        "photoCount": len(_collect_photo_ids(item)),
+        "content": item.get("content") or item.get("followContent") or "",
+    }
+
+
+def _export_task_row(task: Dict[str, Any], params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    start = _task_start_date(task)
+    return {
+        "type": "task",
+        "id": task.get("id", ""),
+        "customerCode": _mapped_customer_code(task),
+        "customerName": task.get("customer_name") or extract_nested(task, "customer.name") or "",
+        "owner": str(task.get("ower_name") or ""),
+        "serviceDate": "",
+        "nextServiceDate": _date_to_iso(start) or "",
+        "photoCount": "",
+        "content": task.get("name") or task.get("content") or "",
+    }
 
 
 @app.route("/api/members/profile", methods=["POST"])
@@ -427,9 +1100,15 @@ def api_members_profile() -> Any:
         return jsonify({"message": "請輸入客戶編碼或電話"}), 400
 
     try:
-        profile = _build_member_profile(identifier)
+        with deadline.budget(getattr(config, "REQUEST_DEADLINE_SECONDS", 20)):
+            profile = _build_member_profile(identifier)
     except LookupError as exc:
         return jsonify({"message": str(exc)}), 404
+    except deadline.DeadlineExceeded as exc:
+        app.logger.warning("[Deadline] member profile for %s: %s", identifier, exc)
+        return jsonify({"message": "查詢逾時，請稍後再試。"}), 504
+    except AdmissionRejected:
+        raise
     except Exception as exc:  # pragma: no cover - runtime logging
         app.logger.exception("Failed to build member profile")
         return jsonify({"message": "查詢時發生錯誤，請稍後再試。"}), 500
@@ -437,6 +1116,317 @@ def api_members_profile() -> Any:
     return jsonify({"code": "OK", "profile": profile})
 
 
+@app.route("/api/maintenance/due")
+def api_maintenance_due() -> Any:
+    """未來 N 天到期保養的客戶清單（依負責人分組、可排序分頁）。"""
+    days = _int_arg("days", 14, minimum=0, maximum=366)
+    page = _int_arg("page", 1, minimum=1)
+    page_size = _int_arg("pageSize", 50, minimum=1, maximum=500)
+    sort_key = request.args.get("sort", "nextServiceDate")
+    if sort_key not in {"nextServiceDate", "latestServiceDate", "customerCode", "customerName"}:
+        sort_key = "nextServiceDate"
+    descending = request.args.get("order", "asc").lower() == "desc"
+    include_overdue = request.args.get("includeOverdue", "1") not in {"0", "false", "False"}
+    owner_filter = str(request.args.get("owner", "")).strip()
+
+    try:
+        followup_records, task_records = _load_fleet_records()
+    except AdmissionRejected:
+        raise
+    except Exception as exc:  # pragma: no cover - runtime logging
+        app.logger.exception("Failed to load fleet records")
+        return jsonify({"code": 500, "message": f"讀取保養資料失敗: {exc}"}), 500
+
+    today = date.today()
+    horizon = today + timedelta(days=days)
+    due: List[Dict[str, Any]] = []
+    for summary in _bulk_maintenance_summaries(followup_records, task_records).values():
+        next_date = _parse_follow_date(summary.get("nextServiceDate"))
+        if not next_date or next_date > horizon:
+            continue
+        if not include_overdue and next_date < today:
+            continue
+        if owner_filter and owner_filter not in (summary.get("owner") or ""):
+            continue
+        entry = dict(summary)
+        entry["daysUntilDue"] = (next_date - today).days
+        due.append(entry)
+
+    due.sort(key=lambda entry: entry.get(sort_key) or "", reverse=descending)
+    due.sort(key=lambda entry: entry.get("owner") or "")  # stable: keeps sort order per owner
+
+    start = (page - 1) * page_size
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in due[start:start + page_size]:
+        groups.setdefault(entry.get("owner") or "", []).append(entry)
+    owner_counts = Counter(entry.get("owner") or "" for entry in due)
+
+    return jsonify({
+        "code": "OK",
+        "days": days,
+        "total": len(due),
+        "page": page,
+        "pageSize": page_size,
+        "owners": [{"owner": owner or None, "count": count} for owner, count in sorted(owner_counts.items())],
+        "groups": [{"owner": owner or None, "customers": items} for owner, items in groups.items()],
+    })
+
+
+@app.route("/api/routes/day")
+def api_day_route() -> Any:
+    """技術員單日路線：當天任務依時間排序，地址以 codeList 批次查詢，附每位客戶的保養摘要。
+
+    摘要只讀當天客戶的跟進與任務（見 _customer_records），不必翻遍全部客戶。
+    """
+    day = _parse_follow_date(request.args.get("date") or date.today().isoformat())
+    if not day:
+        return jsonify({"message": "date 格式錯誤（YYYY-MM-DD）"}), 400
+    owner = str(request.args.get("owner") or getattr(config, "MAINTENANCE_TASK_OWNER_KEYWORD", "") or "").strip()
+    if not getattr(config, "TASK_LIST_PATH", ""):
+        return jsonify({"message": "TASK_LIST_PATH 未設定，無法排程路線"}), 400
+
+    try:
+        day_tasks = _day_route_tasks(day, owner)
+    except AdmissionRejected:
+        raise
+    except Exception as exc:  # pragma: no cover - runtime logging
+        app.logger.warning("[Route] task lookup failed for %s: %s", day, exc)
+        return jsonify({"message": "查詢任務失敗，請稍後再試。"}), 502
+
+    codes = list(dict.fromkeys(code for code, _ in day_tasks if code))
+    skipped: List[str] = []
+    addresses = _addresses_by_code(codes, skipped)
+
+    summaries: Dict[str, Dict[str, Optional[str]]] = {}
+    if codes:
+        try:
+            summaries = _bulk_maintenance_summaries(*_customer_records(codes))
+        except AdmissionRejected as exc:
+            _shed_stage(skipped, "summaries", exc)
+        except Exception as exc:  # pragma: no cover - runtime logging
+            app.logger.warning("[Route] maintenance summaries unavailable: %s", exc)
+
+    stops: List[Dict[str, Any]] = []
+    for position, (code, task) in enumerate(day_tasks, start=1):
+        address_text, contact_name, contact_phone = _address_contact(addresses.get(code))
+        summary = summaries.get(code) or {}
+        stops.append({
+            "stop": position,
+            "time": str(task.get("startDate") or task.get("planDate") or "") or None,
+            "customerCode": code or None,
+            "customerName": (
+                summary.get("customerName")
+                or task.get("customer_name")
+                or extract_nested(task, "customer.name")
+            ),
+            "taskOwner": task.get("ower_name"),
+            "address": address_text,
+            "contact": {"name": contact_name, "phone": contact_phone},
+            "summary": summary or None,
+            "task": task,
+        })
+
+    return jsonify({
+        "code": "OK",
+        "date": day.isoformat(),
+        "owner": owner or None,
+        "stopCount": len(stops),
+        "stops": stops,
+        "partial": bool(skipped),
+        "skippedStages": skipped,
+    })
+
+
+def _day_route_tasks(day: date, owner: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """當天（依 _task_start_date）且負責人含 owner 的任務，依開始時間排序，附客戶編碼。"""
+    records = REPLICA.all_records("tasks")
+    if records is None:
+        date_field = getattr(config, "ROUTE_TASK_DATE_FIELD", "startDate")
+        day_filter = [{
+            "field": date_field,
+            "op": "between",
+            "value1": f"{day.isoformat()} 00:00:00",
+            "value2": f"{day.isoformat()} 23:59:59",
+        }]
+        records = _fetch_all_pages(
+            lambda page, size: CRM_CLIENT.get_tasks("", page=page, page_size=size, filters=day_filter),
+            getattr(config, "MAINTENANCE_DASHBOARD_PAGE_SIZE", 200),
+            getattr(config, "MAINTENANCE_DASHBOARD_MAX_PAGES", 50),
+        )
+    selected: List[Tuple[str, Dict[str, Any]]] = []
+    for task in records:
+        if _task_start_date(task) != day:
+            continue
+        if owner and owner not in str(task.get("ower_name") or ""):
+            continue
+        selected.append((_mapped_customer_code(task), task))
+    selected.sort(key=lambda entry: (
+        str(entry[1].get("startDate") or entry[1].get("planDate") or entry[1].get("endDate") or ""),
+        entry[0],
+    ))
+    return selected
+
+
+def _customer_records(codes: List[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """只取這些客戶的跟進紀錄與任務：副本新鮮時逐一讀本地，其餘以客戶編碼 in 條件分批查詢。"""
+    with_tasks = bool(getattr(config, "TASK_LIST_PATH", ""))
+    followups: List[Dict[str, Any]] = []
+    tasks: List[Dict[str, Any]] = []
+    live: List[str] = []
+    for code in codes:
+        replicated = REPLICA.customer_records("followups", code)
+        replicated_tasks = REPLICA.customer_records("tasks", code) if with_tasks else []
+        if replicated is None or replicated_tasks is None:
+            live.append(code)
+            continue
+        followups.extend(_with_customer_code(replicated, code))
+        tasks.extend(_with_customer_code(replicated_tasks, code))
+
+    field = getattr(config, "ROUTE_CUSTOMER_CODE_FIELD", "customer.code")
+    batch_size = max(int(getattr(config, "ROUTE_SUMMARY_BATCH_SIZE", 50)), 1)
+    page_size = getattr(config, "MAINTENANCE_DASHBOARD_PAGE_SIZE", 200)
+    max_pages = getattr(config, "MAINTENANCE_DASHBOARD_MAX_PAGES", 50)
+    for start in range(0, len(live), batch_size):
+        batch = live[start:start + batch_size]
+        code_filter = [{"field": field, "op": "in", "value1": batch}]
+        # 只有一個客戶的批次：沒有編碼（只帶客戶 id）的紀錄也屬於它
+        default_code = batch[0] if len(batch) == 1 else ""
+        followups.extend(_with_customer_code(_fetch_all_pages(
+            lambda page, size: CRM_CLIENT.get_followups("", page=page, page_size=size, filters=code_filter),
+            page_size,
+            max_pages,
+        ), default_code))
+        if with_tasks:
+            tasks.extend(_with_customer_code(_fetch_all_pages(
+                lambda page, size: CRM_CLIENT.get_tasks("", page=page, page_size=size, filters=code_filter),
+                page_size,
+                max_pages,
+            ), default_code))
+    return followups, tasks
+
+
+def _with_customer_code(records: List[Dict[str, Any]], code: str) -> List[Dict[str, Any]]:
+    """紀錄本身無法判定客戶時補上 code（副本或單一客戶查詢已知其歸屬）。"""
+    if not code:
+        return records
+    return [item if _mapped_customer_code(item) else dict(item, customer_code=code) for item in records]
+
+
+def _addresses_by_code(
+    codes: List[str], skipped: Optional[List[str]] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """以 codeList 批次讀取地址（每批 PHONE_INDEX_BATCH_SIZE 個客戶），依客戶編碼分組；被限流的批次記入 skipped。"""
+    batch_size = max(int(getattr(config, "PHONE_INDEX_BATCH_SIZE", 50)), 1)
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for start in range(0, len(codes), batch_size):
+        batch = codes[start:start + batch_size]
+        try:
+            response = CRM_CLIENT.get_addresses_by_codes(batch)
+        except AdmissionRejected as exc:
+            if skipped is None:
+                raise
+            _shed_stage(skipped, "addresses", exc)
+            continue
+        except Exception as exc:  # pragma: no cover - runtime logging
+            app.logger.warning("[Route] address lookup failed for %s codes: %s", len(batch), exc)
+            continue
+        entries = response.get("data") or []
+        if isinstance(entries, dict):
+            entries = entries.get("recordList") or entries.get("list") or []
+        PHONE_INDEX.observe_addresses(entries, batch)
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            owner_code = next(
+                (str(entry[key]).strip().upper() for key in OWNER_CODE_FIELDS if entry.get(key)),
+                batch[0] if len(batch) == 1 else "",
+            )
+            if owner_code:
+                grouped.setdefault(owner_code, []).append(entry)
+    if codes:
+        PHONE_INDEX.save()
+    return grouped
+
+
+@app.route("/api/warmup/report")
+def api_warmup_report() -> Any:
+    """預熱執行紀錄與每日命中率。"""
+    return jsonify({"code": "OK", **CACHE_WARMER.report()})
+
+
+@app.route("/api/customers/suggest")
+def api_customer_suggest() -> Any:
+    """客戶編碼／名稱自動完成，只查本地索引，不呼叫 CRM。"""
+    query = str(request.args.get("q", "")).strip()
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        limit = 10
+    limit = min(max(limit, 1), 50)
+    return jsonify({
+        "code": "OK",
+        "query": query,
+        "suggestions": CUSTOMER_INDEX.suggest(query, limit),
+    })
+
+
+def _looks_like_phone(text: str) -> bool:
+    digits = [ch for ch in text if ch.isdigit()]
+    if len(digits) < 6:
+        return False
+    non_digits = [ch for ch in text if not (ch.isdigit() or ch in {"+", "-", " ", "#"})]
+    return len(non_digits) <= 3
+
+
+def _replica_or_live_followups(
+    customer_code: str, page: int, page_size: int, **search_kwargs: Any
+) -> Dict[str, Any]:
+    """先讀本地副本（新鮮度內），否則呼叫 CRM 並把結果回寫副本。"""
+    replicated = REPLICA.get_followups(customer_code, page, page_size)
+    if replicated is not None:
+        return replicated
+    response = CRM_CLIENT.get_followups(customer_code, page=page, page_size=page_size, **search_kwargs)
+    records = response.get("data", {}).get("recordList", []) or []
+    operator = search_kwargs.get("search_operator") or config.FOLLOWUP_CUSTOMER_OPERATOR
+    REPLICA.store_customer_page(
+        "followups",
+        customer_code,
+        records,
+        complete=page == 1 and len(records) < page_size,
+        exact=operator == "eq",
+    )
+    return response
+
+
+def _replica_or_live_tasks(customer_code: str, page_size: int) -> List[Dict[str, Any]]:
+    replicated = REPLICA.get_tasks(customer_code, page_size)
+    if replicated is not None:
+        return replicated
+    response = CRM_CLIENT.get_tasks(customer_code, page=1, page_size=page_size)
+    records = response.get("data", {}).get("recordList", []) or []
+    REPLICA.store_customer_page(
+        "tasks",
+        customer_code,
+        records,
+        complete=len(records) < page_size,
+        exact=getattr(config, "TASK_CUSTOMER_OPERATOR", "like") == "eq",
+    )
+    return records
+
+
+def _int_arg(name: str, default: int, *, minimum: Optional[int] = None,
+             maximum: Optional[int] = None) -> int:
+    try:
+        value = int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
 def _extract_files(response: Dict[str, Any]) -> List[Dict[str, Any]]:
     files: List[Dict[str, Any]] = []
     data = response.get("data")
@@ -580,26 +1570,17 @@ def _guess_extension(entry: Dict[str, Any]) -> str:
     return ""
 
 
-def _extract_nested(source: Dict[str, Any], path: str) -> Any:
-    if not path:
-        return None
-    current: Any = source
-    for part in path.split('.'):
-        if not isinstance(current, dict):
-            return None
-        current = current.get(part)
-        if current is None:
-            return None
-    return current
+def _detail_customer_name(detail_data: Dict[str, Any]) -> Optional[str]:
+    name = detail_data.get("name")
+    if isinstance(name, dict):
+        name = name.get("zh_CN")
+    return name or detail_data.get("enterpriseName") or None
 
 
 DATE_PATTERN = re.compile(
     r"(?P<year>19\d{2}|20\d{2})[年\-/.](?P<month>\d{1,2})[月\-/.](?P<day>\d{1,2})"
 )
 
-# 標準化用友客戶代碼的偵測（本專案中常見如 C3770、C402 等）
-CODE_TOKEN_RE = re.compile(r"\bC\d{2,}\b", re.IGNORECASE)
-
 
 def _shift_date_string(value: Optional[str], days: int) -> Optional[str]:
     if not value or not days:
@@ -635,6 +1616,41 @@ def _date_to_iso(value: Optional[date]) -> Optional[str]:
     return value.isoformat() if isinstance(value, date) else None
 
 
+def _task_start_date(task: Dict[str, Any]) -> Optional[date]:
+    return (
+        _parse_follow_date(task.get("startDate"))
+        or _parse_follow_date(task.get("planDate"))
+        or _parse_follow_date(task.get("endDate"))
+    )
+
+
+def _extract_upcoming_task_date(
+    task_records: List[Dict[str, Any]],
+    *,
+    reference_date: date,
+    owner_keyword: Optional[str],
+    max_gap_days: Optional[int] = None,
+) -> Optional[str]:
+    """沒有保養紀錄時，以最早的未來任務（優先負責人任務）作為下次保養日期。"""
+    owner_dates: List[date] = []
+    general_dates: List[date] = []
+    for task in task_records:
+        start = _task_start_date(task)
+        if not start or start < reference_date:
+            continue
+        if max_gap_days is not None and (start - reference_date).days > max_gap_days:
+            continue
+        if owner_keyword and owner_keyword in str(task.get("ower_name") or ""):
+            owner_dates.append(start)
+        else:
+            general_dates.append(start)
+    if owner_dates:
+        return min(owner_dates).isoformat()
+    if general_dates:
+        return min(general_dates).isoformat()
+    return None
+
+
 def _select_task_base_date(
     task_records: List[Dict[str, Any]],
     owner_keyword: Optional[str],
@@ -653,9 +1669,7 @@ def _select_task_base_date(
     general_past: List[date] = []
 
     for task in task_records:
-        start = _parse_follow_date(task.get("startDate")) or _parse_follow_date(task.get("planDate"))
-        if not start:
-            start = _parse_follow_date(task.get("endDate"))
+        start = _task_start_date(task)
         if not start:
             continue
 
@@ -761,8 +1775,113 @@ def _extract_maintenance_summary(
     }
 
 
+def _bulk_maintenance_summaries(
+    followup_records: List[Dict[str, Any]],
+    task_records: List[Dict[str, Any]],
+    *,
+    today: Optional[date] = None,
+) -> Dict[str, Dict[str, Optional[str]]]:
+    """Same result as ``_extract_maintenance_summary`` (plus offset) for every customer at once."""
+    from server.maintenance_schedule import compute_schedules
+
+    owner_keyword = getattr(config, "MAINTENANCE_TASK_OWNER_KEYWORD", None)
+    visits: List[Tuple[str, date]] = []
+    visit_items: List[Dict[str, Any]] = []
+    for item in followup_records:
+        if "維修幫" not in str(item.get("ower_name") or ""):
+            continue
+        code = _mapped_customer_code(item)
+        parsed = _parse_follow_date(item.get("followTime"))
+        if code and parsed:
+            visits.append((code, parsed))
+            visit_items.append(item)
+
+    tasks: List[Tuple[str, date, bool]] = []
+    for task in task_records:
+        code = _mapped_customer_code(task)
+        start = _task_start_date(task)
+        if code and start:
+            is_owner = bool(owner_keyword and owner_keyword in str(task.get("ower_name") or ""))
+            tasks.append((code, start, is_owner))
+
+    schedules = compute_schedules(
+        visits,
+        tasks,
+        today=today,
+        max_gap_days=getattr(config, "MAINTENANCE_TASK_MAX_GAP_DAYS", None),
+    )
+    offset_days = getattr(config, "MAINTENANCE_NEXT_DATE_OFFSET_DAYS", 0)
+    summaries: Dict[str, Dict[str, Optional[str]]] = {}
+    for schedule in schedules:
+        latest_item = visit_items[schedule.latest_index] if schedule.latest_index is not None else {}
+        next_iso = _date_to_iso(schedule.next)
+        if offset_days:
+            next_iso = _shift_date_string(next_iso, offset_days)
+        summaries[schedule.customer_code] = {
+            "customerCode": schedule.customer_code,
+            "customerName": str(latest_item.get("customer_name") or "") or None,
+            "latestServiceDate": _date_to_iso(schedule.latest),
+            "previousServiceDate": _date_to_iso(schedule.previous),
+            "nextServiceDate": next_iso,
+            "owner": str(latest_item.get("ower_name") or "") or None,
+        }
+    return summaries
+
+
+_FLEET_LOCK = threading.Lock()
+_FLEET_CACHE: Dict[str, Dict[str, Any]] = {}
+
+
+def _fleet_cache() -> Dict[str, Any]:
+    return _FLEET_CACHE.setdefault(tenants.current().name, {"loadedAt": 0.0, "followups": [], "tasks": []})
+
+
+def _fetch_all_pages(fetch_page: Any, page_size: int, max_pages: int) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    for page in range(1, max_pages + 1):
+        response = fetch_page(page, page_size)
+        batch = response.get("data", {}).get("recordList", []) or []
+        records.extend(batch)
+        if len(batch) < page_size:
+            break
+    return records
+
+
+def _load_fleet_records() -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """All followups and tasks for the dashboard: the replica when fresh, else re-paged per TTL."""
+    ttl = getattr(config, "MAINTENANCE_DASHBOARD_TTL_SECONDS", 600)
+    page_size = getattr(config, "MAINTENANCE_DASHBOARD_PAGE_SIZE", 200)
+    max_pages = getattr(config, "MAINTENANCE_DASHBOARD_MAX_PAGES", 50)
+    replicated_followups = REPLICA.all_records("followups")
+    if replicated_followups is not None:
+        replicated_tasks = REPLICA.all_records("tasks") if getattr(config, "TASK_LIST_PATH", "") else []
+        if replicated_tasks is not None:
+            return replicated_followups, replicated_tasks
+    with _FLEET_LOCK:
+        cache = _fleet_cache()
+        if time.time() - cache["loadedAt"] < ttl:
+            return cache["followups"], cache["tasks"]
+        followups = _fetch_all_pages(
+            lambda page, size: CRM_CLIENT.get_followups("", page=page, page_size=size),
+            page_size,
+            max_pages,
+        )
+        tasks: List[Dict[str, Any]] = []
+        if getattr(config, "TASK_LIST_PATH", ""):
+            tasks = _fetch_all_pages(
+                lambda page, size: CRM_CLIENT.get_tasks("", page=page, page_size=size),
+                page_size,
+                max_pages,
+            )
+        cache.update({"loadedAt": time.time(), "followups": followups, "tasks": tasks})
+        return followups, tasks
+
+
 def _build_member_profile(identifier: str) -> Dict[str, Any]:
-    followup_resp = CRM_CLIENT.get_followups(identifier, page=1, page_size=config.DEFAULT_PAGE_SIZE)
+    if _looks_like_phone(identifier):
+        followup_resp = CRM_CLIENT.get_followups(identifier, page=1, page_size=config.DEFAULT_PAGE_SIZE)
+    else:
+        followup_resp = _replica_or_live_followups(identifier, 1, config.DEFAULT_PAGE_SIZE)
     record_list: List[Dict[str, Any]] = (
         followup_resp.get("data", {}).get("recordList", []) or []
     )
@@ -776,7 +1895,7 @@ def _build_member_profile(identifier: str) -> Dict[str, Any]:
 
     if not candidate_records:
         return {
-            "customerCode": customer_code,
+            "customerCode": identifier,
             "customerName": None,
             "latestServiceDate": None,
             "previousServiceDate": None,
@@ -805,31 +1924,20 @@ def _build_member_profile(identifier: str) -> Dict[str, Any]:
         detail_resp = CRM_CLIENT.get_customer_detail(customer_id, org_id)
         detail_data = detail_resp.get("data") or {}
         addresses = detail_data.get("merchantAddressInfos") or []
+        PHONE_INDEX.observe_detail(detail_data)
+        if detail_data.get("code"):
+            CUSTOMER_INDEX.add(detail_data["code"], _detail_customer_name(detail_data))
+            CUSTOMER_INDEX.save()
+            REPLICA.remember_customer_id(customer_id, detail_data["code"])
 
         if (not addresses) and detail_data.get("code"):
             addr_resp = CRM_CLIENT.get_addresses_by_codes([detail_data["code"]])
             addresses = addr_resp.get("data") or []
+            if isinstance(addresses, list):
+                PHONE_INDEX.observe_addresses(addresses, [detail_data["code"]])
+        PHONE_INDEX.save()
 
-    selected_address = None
-    if isinstance(addresses, list) and addresses:
-        for item in addresses:
-            if item.get("isDefault"):
-                selected_address = item
-                break
-        if not selected_address:
-            selected_address = addresses[0]
-
-    address_text = None
-    contact_name = None
-    contact_phone = None
-    if isinstance(selected_address, dict):
-        address_text = (
-            selected_address.get("mergerName")
-            or selected_address.get("address")
-            or selected_address.get("addressInfo")
-        )
-        contact_name = selected_address.get("receiver")
-        contact_phone = selected_address.get("mobile") or selected_address.get("telePhone")
+    address_text, contact_name, contact_phone = _address_contact(addresses)
 
     profile = {
         "keyword": identifier,
@@ -852,6 +1960,82 @@ def _build_member_profile(identifier: str) -> Dict[str, Any]:
     return profile
 
 
+def _address_contact(addresses: Any) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """預設地址（無則第一筆）的 (地址, 聯絡人, 電話)。"""
+    selected_address = None
+    if isinstance(addresses, list) and addresses:
+        for item in addresses:
+            if isinstance(item, dict) and item.get("isDefault"):
+                selected_address = item
+                break
+        if not selected_address:
+            selected_address = addresses[0]
+
+    if not isinstance(selected_address, dict):
+        return None, None, None
+    address_text = (
+        selected_address.get("mergerName")
+        or selected_address.get("address")
+        or selected_address.get("addressInfo")
+    )
+    contact_phone = selected_address.get("mobile") or selected_address.get("telePhone")
+    return address_text, selected_address.get("receiver"), contact_phone
+
+
+# 每個租戶的實例建立時各自接線（服務都是 tenants.PerTenant）
+CACHE_WARMER.setup_each(lambda warmer: warmer.configure(
+    CRM_CLIENT,
+    [
+        lambda code: _lookup_customer_followups(code, 1, config.DEFAULT_PAGE_SIZE),
+        _build_member_profile,
+    ],
+))
+CRM_CLIENT.setup_each(PROFILER.configure)
+CRM_CLIENT.setup_each(ADMISSION.configure)
+CRM_EVENTS.setup_each(lambda events: events.add_listener(
+    lambda kind, codes: _fleet_cache().update(loadedAt=0.0) if kind in ("followups", "tasks") else None
+))
+EXPORT_JOBS.configure(
+    CRM_CLIENT,
+    {"followups": _export_followup_row, "tasks": _export_task_row},
+)
+
+
+def _start_background_work() -> None:
+    REPLICA.start_background_sync(CRM_CLIENT)
+    CACHE_WARMER.start_scheduler()
+
+
+def _each_tenant(steps: List[Tuple[str, Any]]) -> List[Tuple[str, Any]]:
+    """Warm-up steps repeated for every tenant, each run under its own tenant."""
+    expanded = []
+    for tenant in tenants.all_tenants():
+        for name, step in steps:
+            label = name if tenant.is_default else f"{tenant.name}:{name}"
+            expanded.append((label, tenants.bind(step, tenant)))
+    return expanded
+
+
+# Steps go through lambdas: a bound method of a PerTenant service would belong to one tenant only.
+WARMUP.configure(
+    _each_tenant([
+        ("l2Cache", lambda: L2_CACHE.open()),
+        ("replica", lambda: REPLICA.open()),
+        ("attachmentCache", lambda: ATTACHMENT_CACHE.open()),
+        ("knownCodes", lambda: KNOWN_CODES.load()),
+        ("gateway", lambda: CRM_CLIENT.warm_up(int(getattr(config, "GATEWAY_WARM_CONNECTIONS", 2)))),
+        ("backgroundThreads", _start_background_work),
+    ]),
+    shared=[
+        *_each_tenant([
+            ("customerIndex", lambda: CUSTOMER_INDEX.load()),
+            ("phoneIndex", lambda: PHONE_INDEX.load()),
+        ]),
+        ("staticAssets", STATIC_ASSETS.load),
+    ],
+)
+
+
 if __name__ == "__main__":  # pragma: no cover
     host = os.getenv("HOST", "0.0.0.0")
     try:
@@ -859,4 +2043,5 @@ if __name__ == "__main__":  # pragma: no cover
     except ValueError:
         port = 5000
     debug = os.getenv("FLASK_DEBUG", "1") not in {"0", "false", "False"}
+    WARMUP.start()
     app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,249 @@
+"""Followup attachment cache: metadata kept for good, signed URLs until they expire.
+
+The attachment query answers, per followup id, a list of files with their
+metadata (``fileId``, ``fileName``, ``fileSize``, ``fileType``) and a
+short-lived ``signedUrl``. Those two parts age very differently. The metadata
+of a followup's attachments does not change, so it is stored by business id
+with no expiry. Each signed URL is kept until shortly before the expiry it
+carries (``Expires=``, ``X-Amz-Date`` + ``X-Amz-Expires``, ``x-oss-date`` +
+``x-oss-expires`` or ``se=``), minus ``ATTACHMENT_URL_REFRESH_MARGIN_SECONDS``.
+URLs without a readable expiry are kept for ``ATTACHMENT_URL_DEFAULT_TTL_SECONDS``.
+
+A lookup therefore calls the gateway only for ids it has never seen or whose
+URLs are about to expire, in one batched request, and answers the rest from
+the local database. Empty answers are not stored, since photos can still be
+uploaded to a new followup. Like the L2 cache, the database is SQLite (WAL)
+in the local data directory and is shared by all workers on the host.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+
+DB_NAME = "attachments.sqlite3"
+URL_FIELD = "signedUrl"
+_PRUNE_EVERY = 50
+_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attachments (
+    business_id TEXT PRIMARY KEY,
+    files TEXT NOT NULL,
+    signed INTEGER NOT NULL,
+    stored_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS signed_urls (
+    business_id TEXT PRIMARY KEY,
+    urls TEXT NOT NULL,
+    valid_until REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_signed_urls_valid ON signed_urls (valid_until);
+"""
+
+# (business ids to fetch) -> raw query response
+Fetch = Callable[[List[str]], Dict[str, Any]]
+
+
+def _parse_amz_date(value: str) -> Optional[float]:
+    try:
+        return datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """Epoch seconds at which a signed URL stops working, when the URL says so."""
+    try:
+        query = {key.lower(): value for key, value in parse_qsl(urlsplit(url).query)}
+    except ValueError:
+        return None
+    try:
+        if "expires" in query:  # OSS V1 / CloudFront: absolute epoch
+            return float(query["expires"])
+        for prefix in ("x-amz-", "x-oss-"):  # S3 / OSS V4: signing time + lifetime
+            if prefix + "date" in query and prefix + "expires" in query:
+                signed_at = _parse_amz_date(query[prefix + "date"])
+                if signed_at is not None:
+                    return signed_at + float(query[prefix + "expires"])
+        if "se" in query:  # Azure SAS: ISO 8601
+            return datetime.fromisoformat(query["se"].replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+    return None
+
+
+class AttachmentCache:
+    def __init__(self, db_name: str = DB_NAME) -> None:
+        self._db_name = db_name
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.fetched = 0
+
+    def enabled(self) -> bool:
+        return bool(getattr(config, "ATTACHMENT_CACHE_ENABLED", True))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(local_store.data_path(self._db_name)), timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(_SCHEMA)
+                    self._schema_ready = True
+        return conn
+
+    def _after_fork(self) -> None:
+        # SQLite connections must not be used across a fork.
+        self._local = threading.local()
+
+    def open(self) -> None:
+        """Open this thread's connection (and the schema) ahead of the first lookup."""
+        if self.enabled():
+            self._connect()
+
+    # ----------------------------------------------------------------- reads
+    def _select(self, sql: str, ids: List[str], *extra: Any) -> List[tuple]:
+        conn = self._connect()
+        rows: List[tuple] = []
+        for start in range(0, len(ids), _CHUNK):
+            chunk = ids[start:start + _CHUNK]
+            rows.extend(conn.execute(sql.format(marks=",".join("?" * len(chunk))), (*chunk, *extra)))
+        return rows
+
+    def get(self, business_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Cached files of ``business_ids`` whose signed URLs are still valid; other ids are left out."""
+        files = {
+            business_id: (json.loads(encoded), bool(signed))
+            for business_id, encoded, signed in self._select(
+                "SELECT business_id, files, signed FROM attachments WHERE business_id IN ({marks})",
+                business_ids,
+            )
+        }
+        signed_ids = [business_id for business_id, (_, signed) in files.items() if signed]
+        urls = {
+            business_id: json.loads(encoded)
+            for business_id, encoded in self._select(
+                "SELECT business_id, urls FROM signed_urls WHERE business_id IN ({marks}) AND valid_until > ?",
+                signed_ids, time.time(),
+            )
+        } if signed_ids else {}
+
+        found: Dict[str, List[Dict[str, Any]]] = {}
+        for business_id, (entries, signed) in files.items():
+            if not signed:
+                found[business_id] = entries
+                continue
+            entry_urls = urls.get(business_id)
+            if entry_urls is None or len(entry_urls) != len(entries):
+                continue
+            found[business_id] = [
+                dict(entry, **{URL_FIELD: url}) if url else entry
+                for entry, url in zip(entries, entry_urls)
+            ]
+        return found
+
+    # ---------------------------------------------------------------- writes
+    @staticmethod
+    def _valid_until(urls: Iterable[Optional[str]], fetched_at: float) -> float:
+        default_ttl = float(getattr(config, "ATTACHMENT_URL_DEFAULT_TTL_SECONDS", 600))
+        margin = float(getattr(config, "ATTACHMENT_URL_REFRESH_MARGIN_SECONDS", 120))
+        expiries = [url_expiry(url) or fetched_at + default_ttl for url in urls if url]
+        return min(expiries) - margin
+
+    def put(self, data: Dict[str, List[Dict[str, Any]]]) -> None:
+        now = time.time()
+        file_rows: List[tuple] = []
+        url_rows: List[tuple] = []
+        for business_id, entries in data.items():
+            entries = [entry for entry in entries if isinstance(entry, dict)]
+            if not entries:
+                continue
+            urls = [entry.get(URL_FIELD) or None for entry in entries]
+            metadata = [{k: v for k, v in entry.items() if k != URL_FIELD} for entry in entries]
+            signed = any(urls)
+            file_rows.append((business_id, json.dumps(metadata, ensure_ascii=False), int(signed), now))
+            if signed:
+                valid_until = self._valid_until(urls, now)
+                if valid_until > now:
+                    url_rows.append((business_id, json.dumps(urls, ensure_ascii=False), valid_until))
+        if not file_rows:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO attachments (business_id, files, signed, stored_at) VALUES (?, ?, ?, ?)",
+                file_rows,
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO signed_urls (business_id, urls, valid_until) VALUES (?, ?, ?)",
+                url_rows,
+            )
+        self._puts += 1
+        if self._puts % _PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self) -> None:
+        """Drop expired signed URLs; the metadata stays."""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM signed_urls WHERE valid_until <= ?", (time.time(),))
+
+    def clear(self) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM attachments")
+            conn.execute("DELETE FROM signed_urls")
+
+    # ---------------------------------------------------------------- lookup
+    def lookup(self, business_ids: Iterable[Any], fetch: Fetch) -> Dict[str, Any]:
+        """Query response for ``business_ids``; only unknown or expiring ids are passed to ``fetch``."""
+        ids = list(dict.fromkeys(str(business_id) for business_id in business_ids if business_id))
+        try:
+            found = self.get(ids)
+        except Exception:  # pragma: no cover - a broken cache must not break lookups
+            found = {}
+        missing = [business_id for business_id in ids if business_id not in found]
+        self.hits += len(ids) - len(missing)
+        if not missing:
+            return {"code": "200", "data": found}
+
+        response = fetch(missing)
+        self.fetched += len(missing)
+        data = response.get("data")
+        if not isinstance(data, dict):
+            # 非預期格式（例如列表）無法按 id 合併：不快取，需要時整批重查
+            return fetch(ids) if found else response
+        fresh = {
+            business_id: value for business_id, value in data.items()
+            if business_id in missing and isinstance(value, list)
+        }
+        try:
+            self.put(fresh)
+        except Exception:  # pragma: no cover - e.g. database locked
+            pass
+        return {**response, "data": {**found, **fresh}}
+
+
+ATTACHMENT_CACHE = tenants.PerTenant(AttachmentCache)
+os.register_at_fork(after_in_child=ATTACHMENT_CACHE._after_fork)
@@ -0,0 +1,268 @@
+"""Off-peak cache warming for the customers technicians visit tomorrow.
+
+Tomorrow's stops come from tasks owned by ``MAINTENANCE_TASK_OWNER_KEYWORD``
+(``startDate`` / ``planDate``). During the ``WARMUP_WINDOW_HOURS`` window one
+worker replays the normal lookups for those customers, which fills every local
+store the lookups write through (replica, phone and customer indexes, and any
+response caches behind ``CRMClient``), while staying inside
+``WARMUP_UPSTREAM_BUDGET`` gateway calls. Lookups served the next day are
+counted against the warmed set so the hit rate can be reported.
+"""
+from __future__ import annotations
+
+import fcntl
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+from server.record_utils import record_customer_code
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "warmup_state.json"
+_STATS_FLUSH_SECONDS = 30
+
+
+class BudgetExhausted(RuntimeError):
+    pass
+
+
+class CacheWarmer:
+    def __init__(self) -> None:
+        self._lookups: List[Callable[[str], Any]] = []
+        self._client: Any = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._warmed_day: Optional[str] = None
+        self._warmed: Set[str] = set()
+        self._state_loaded_at = 0.0
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self._flushed_at = time.time()
+
+    def configure(self, client: Any, lookups: Sequence[Callable[[str], Any]]) -> None:
+        """Set the CRM client and the per-customer lookups replayed while warming."""
+        self._client = client
+        self._lookups = list(lookups)
+        client.add_call_listener(self._on_upstream_call)
+
+    # --------------------------------------------------------------- budgeting
+    def _on_upstream_call(self, path: str, elapsed: float, error: Optional[BaseException]) -> None:
+        if getattr(self._local, "active", False):
+            self._local.calls += 1
+
+    def _check_budget(self, budget: int) -> None:
+        if self._local.calls >= budget:
+            raise BudgetExhausted(f"upstream budget of {budget} calls used")
+
+    # --------------------------------------------------------------- selection
+    def upcoming_customers(self, target_day: date) -> List[str]:
+        """Customer codes with a maintenance task starting on ``target_day``, in task order."""
+        from server.replica import REPLICA
+
+        day_iso = target_day.isoformat()
+        tasks = REPLICA.tasks_between(day_iso, (target_day + timedelta(days=1)).isoformat())
+        if tasks is None:
+            tasks = self._fetch_tasks(target_day)
+
+        owner_keyword = getattr(config, "MAINTENANCE_TASK_OWNER_KEYWORD", None)
+        codes: List[str] = []
+        for task in tasks:
+            if owner_keyword and owner_keyword not in str(task.get("ower_name") or ""):
+                continue
+            start = str(task.get("startDate") or task.get("planDate") or "")
+            if not start.startswith(day_iso):
+                continue
+            code = record_customer_code(task)
+            if code and code not in codes:
+                codes.append(code)
+        return codes
+
+    def _fetch_tasks(self, target_day: date) -> List[Dict[str, Any]]:
+        if not getattr(config, "TASK_LIST_PATH", ""):
+            return []
+        day_iso = target_day.isoformat()
+        filters = [{
+            "field": getattr(config, "WARMUP_TASK_DATE_FIELD", "startDate"),
+            "op": "between",
+            "value1": f"{day_iso} 00:00:00",
+            "value2": f"{day_iso} 23:59:59",
+        }]
+        page_size = getattr(config, "DEFAULT_TASK_PAGE_SIZE", 50)
+        tasks: List[Dict[str, Any]] = []
+        for page in range(1, getattr(config, "WARMUP_MAX_TASK_PAGES", 10) + 1):
+            response = self._client.get_tasks("", page=page, page_size=page_size, filters=filters)
+            batch = response.get("data", {}).get("recordList", []) or []
+            tasks.extend(batch)
+            if len(batch) < page_size:
+                break
+        return tasks
+
+    # ----------------------------------------------------------------- warming
+    def warm(self, target_day: Optional[date] = None) -> Dict[str, Any]:
+        """Warm caches for ``target_day`` (default tomorrow) within the upstream budget."""
+        target_day = target_day or date.today() + timedelta(days=1)
+        budget = int(getattr(config, "WARMUP_UPSTREAM_BUDGET", 300))
+        pause = float(getattr(config, "WARMUP_PAUSE_SECONDS", 0.5))
+        self._local.active = True
+        self._local.calls = 0
+        codes: List[str] = []
+        warmed: List[str] = []
+        failed: List[str] = []
+        stopped_reason: Optional[str] = None
+        started = time.time()
+        try:
+            codes = self.upcoming_customers(target_day)
+            for code in codes:
+                try:
+                    self._check_budget(budget)
+                    for lookup in self._lookups:
+                        lookup(code)
+                        self._check_budget(budget)
+                    warmed.append(code)
+                except BudgetExhausted as exc:
+                    stopped_reason = str(exc)
+                    break
+                except Exception as exc:  # pragma: no cover - runtime diagnostics
+                    logger.warning("[Warmup] %s failed: %s", code, exc)
+                    failed.append(code)
+                time.sleep(pause)
+        finally:
+            self._local.active = False
+
+        run = {
+            "day": target_day.isoformat(),
+            "planned": len(codes),
+            "warmed": warmed,
+            "failed": failed,
+            "upstreamCalls": self._local.calls,
+            "budget": budget,
+            "stoppedReason": stopped_reason,
+            "startedAt": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+            "durationSeconds": round(time.time() - started, 2),
+        }
+        with self._state_file() as state:
+            state.setdefault("runs", {})[run["day"]] = run
+            # Keep one week of history.
+            for day in sorted(state["runs"])[:-7]:
+                state["runs"].pop(day, None)
+        logger.info("[Warmup] %s warmed %s/%s customers with %s calls",
+                    run["day"], len(warmed), run["planned"], run["upstreamCalls"])
+        return run
+
+    # --------------------------------------------------------------- hit rates
+    def record_lookup(self, customer_code: Optional[str]) -> None:
+        """Count a user lookup as a warm hit or miss for today's warmed set."""
+        code = str(customer_code or "").strip().upper()
+        if not code or getattr(self._local, "active", False):
+            return
+        today = date.today().isoformat()
+        self._refresh_warmed(today)
+        with self._lock:
+            stats = self._pending.setdefault(today, {"hits": 0, "misses": 0})
+            stats["hits" if code in self._warmed else "misses"] += 1
+            due = time.time() - self._flushed_at >= _STATS_FLUSH_SECONDS
+        if due:
+            self.flush_stats()
+
+    def _refresh_warmed(self, today: str) -> None:
+        if self._warmed_day == today and time.time() - self._state_loaded_at < _STATS_FLUSH_SECONDS:
+            return
+        state = local_store.load_json(STATE_NAME, {}) or {}
+        run = (state.get("runs") or {}).get(today) or {}
+        with self._lock:
+            self._warmed_day = today
+            self._warmed = set(run.get("warmed") or [])
+            self._state_loaded_at = time.time()
+
+    def flush_stats(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.time()
+        if not pending:
+            return
+        with self._state_file() as state:
+            for day, delta in pending.items():
+                stats = state.setdefault("stats", {}).setdefault(day, {"hits": 0, "misses": 0})
+                stats["hits"] += delta["hits"]
+                stats["misses"] += delta["misses"]
+            for day in sorted(state["stats"])[:-14]:
+                state["stats"].pop(day, None)
+
+    def report(self) -> Dict[str, Any]:
+        self.flush_stats()
+        state = local_store.load_json(STATE_NAME, {}) or {}
+        days = []
+        for day, stats in sorted((state.get("stats") or {}).items(), reverse=True):
+            total = stats["hits"] + stats["misses"]
+            days.append({
+                "day": day,
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "hitRate": round(stats["hits"] / total, 3) if total else None,
+            })
+        return {"runs": state.get("runs") or {}, "hitRates": days}
+
+    @contextmanager
+    def _state_file(self) -> Iterator[Dict[str, Any]]:
+        """Read-modify-write the shared state file under an exclusive lock."""
+        lock_path = local_store.data_path(STATE_NAME + ".lock")
+        with open(lock_path, "w") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                state = local_store.load_json(STATE_NAME, {}) or {}
+                yield state
+                local_store.save_json(STATE_NAME, state)
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # --------------------------------------------------------------- scheduler
+    def _in_window(self, now: datetime) -> bool:
+        start_hour, end_hour = getattr(config, "WARMUP_WINDOW_HOURS", (2, 5))
+        return start_hour <= now.hour < end_hour
+
+    def start_scheduler(self) -> None:
+        """Check every few minutes; warm tomorrow once per night inside the window."""
+        if not getattr(config, "WARMUP_ENABLED", False) or self._thread is not None:
+            return
+
+        def _loop() -> None:
+            while True:
+                try:
+                    now = datetime.now()
+                    tomorrow = (now.date() + timedelta(days=1)).isoformat()
+                    if self._in_window(now):
+                        self._warm_once(tomorrow)
+                except Exception:  # pragma: no cover - keep the loop alive
+                    logger.exception("[Warmup] scheduler iteration failed")
+                time.sleep(getattr(config, "WARMUP_CHECK_INTERVAL_SECONDS", 300))
+
+        self._thread = threading.Thread(target=tenants.bind(_loop), name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def _warm_once(self, day_iso: str) -> None:
+        lock_path = local_store.data_path("warmup_run.lock")
+        with open(lock_path, "w") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # another worker is warming
+            try:
+                state = local_store.load_json(STATE_NAME, {}) or {}
+                if day_iso in (state.get("runs") or {}):
+                    return
+                self.warm(date.fromisoformat(day_iso))
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+CACHE_WARMER = tenants.PerTenant(CacheWarmer)
@@ -0,0 +1,75 @@
+"""Content-Encoding negotiation and compression for API responses.
+
+JSON API responses of at least ``COMPRESSION_MIN_BYTES`` are compressed
+with brotli when the client accepts it and the optional ``brotli`` package
+is installed, and with gzip otherwise. Streamed responses (SSE, ZIP
+exports) and file downloads are left alone. The same codecs are used by
+``server.static_assets`` to precompress static files at build time.
+"""
+from __future__ import annotations
+
+import gzip
+from functools import lru_cache
+from typing import Any, List, Optional
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+# Content-Encoding token -> file suffix of a precompressed sibling
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+@lru_cache(maxsize=None)
+def _brotli() -> Optional[Any]:
+    """The optional ``brotli`` module, imported on the first compressed response."""
+    try:
+        import brotli  # type: ignore
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return brotli
+
+
+def available_encodings() -> List[str]:
+    """Encodings this process can produce, in order of preference."""
+    return (["br"] if _brotli() is not None else []) + ["gzip"]
+
+
+def negotiate(accept_encodings: Any, offered: List[str]) -> Optional[str]:
+    """Pick the first of ``offered`` the client accepts (werkzeug ``request.accept_encodings``)."""
+    for encoding in offered:
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str, *, static: bool = False) -> bytes:
+    """Static files are built once, so they get the slowest, smallest settings."""
+    if encoding == "br":
+        quality = 11 if static else int(getattr(config, "COMPRESSION_BROTLI_QUALITY", 5))
+        return _brotli().compress(data, quality=quality)
+    level = 9 if static else int(getattr(config, "COMPRESSION_GZIP_LEVEL", 6))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response: Any, accept_encodings: Any) -> Any:
+    """``after_request`` hook body for ``/api/`` responses."""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or response.mimetype != "application/json"
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < int(getattr(config, "COMPRESSION_MIN_BYTES", 1024)):
+        return response
+    encoding = negotiate(accept_encodings, available_encodings())
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
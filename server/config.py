@@ -19,3 +19,154 @@ MAINTENANCE_NEXT_DATE_OFFSET_DAYS = 14
 MAINTENANCE_TASK_OWNER_KEYWORD = "客服003"
 # Optional constraint on how far future tasks can be. None means no limit.
 MAINTENANCE_TASK_MAX_GAP_DAYS = None
+
+# Local phone -> customer code index (server/phone_index.py)
+# Addresses for a code are re-read after this many seconds.
+PHONE_INDEX_REFRESH_SECONDS = 6 * 3600
+# codeList batch size for CUSTOMER_ADDRESS_LIST_PATH refreshes
+PHONE_INDEX_BATCH_SIZE = 50
+# Workers share the index snapshots; each re-reads them after another worker's save,
+# checking at most this often (seconds). Also used by the customer index.
+LOCAL_INDEX_RELOAD_SECONDS = 10
+
+# Customer code/name autocomplete index (server/customer_index.py)
+CUSTOMER_INDEX_SAVE_INTERVAL_SECONDS = 30
+
+# Fleet-wide "maintenance due" dashboard (/api/maintenance/due)
+MAINTENANCE_DASHBOARD_TTL_SECONDS = 600
+MAINTENANCE_DASHBOARD_PAGE_SIZE = 200
+MAINTENANCE_DASHBOARD_MAX_PAGES = 50
+
+# Local SQLite replica of followups and tasks (server/replica.py)
+REPLICA_ENABLED = False
+REPLICA_SYNC_INTERVAL_SECONDS = 120
+# Reads fall back to live CRM calls once the replica is older than this.
+REPLICA_MAX_STALENESS_SECONDS = 300
+REPLICA_FULL_SYNC_INTERVAL_SECONDS = 24 * 3600
+REPLICA_WATERMARK_FIELD = "pubts"
+REPLICA_PAGE_SIZE = 200
+REPLICA_MAX_PAGES = 500
+
+# Off-peak cache warming for tomorrow's maintenance visits (server/cache_warmer.py)
+WARMUP_ENABLED = False
+WARMUP_WINDOW_HOURS = (2, 5)  # local hours [start, end)
+WARMUP_UPSTREAM_BUDGET = 300  # gateway calls per nightly run
+WARMUP_PAUSE_SECONDS = 0.5
+WARMUP_CHECK_INTERVAL_SECONDS = 300
+WARMUP_TASK_DATE_FIELD = "startDate"
+WARMUP_MAX_TASK_PAGES = 10
+
+# Shared on-disk L2 cache for read-only CRM calls (server/l2_cache.py)
+L2_CACHE_ENABLED = True
+# Per API path TTL in seconds; paths not listed use the defaults in l2_cache.py.
+L2_CACHE_TTLS = {}
+L2_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Per-request deadline (server/deadline.py); keep it below the gunicorn worker timeout (30s).
+REQUEST_DEADLINE_SECONDS = 20
+# Optional lookup stages (detail fallback, tasks, attachments) are skipped
+# once less than this many seconds of the budget remain.
+DEADLINE_STAGE_RESERVE_SECONDS = 3
+
+# Local rejection of unknown identifiers (server/known_codes.py)
+# Identifiers whose lookup found nothing are answered locally for this long.
+NEGATIVE_CACHE_TTL_SECONDS = 60
+NEGATIVE_CACHE_MAX_ENTRIES = 1000
+# Bloom filter of replica customer codes; only used while the replica has a fresh full sync.
+KNOWN_CODES_REBUILD_SECONDS = 300
+KNOWN_CODES_FALSE_POSITIVE_RATE = 0.01
+
+# Opt-in request profiling (server/profiler.py); disabled while the token is empty.
+# Prefer setting MAQUA_PROFILER_TOKEN in the environment over committing a token here.
+PROFILER_TOKEN = ""
+PROFILER_MAX_PER_MINUTE = 6
+PROFILER_SAMPLE_INTERVAL_MS = 5
+PROFILER_MAX_PROFILES = 40
+
+# Streaming ZIP export of a customer's maintenance photos (server/photo_export.py)
+PHOTO_EXPORT_PAGE_SIZE = 100
+PHOTO_EXPORT_MAX_PAGES = 50
+PHOTO_EXPORT_QUERY_BATCH_SIZE = 50  # attachment ids per query_followup_files call
+PHOTO_EXPORT_WORKERS = 4  # concurrent photo downloads
+PHOTO_EXPORT_DOWNLOAD_TIMEOUT_SECONDS = 30
+
+# Background CSV / XLSX export of followup history (server/export_jobs.py)
+EXPORT_PAGE_SIZE = 200
+EXPORT_MAX_PAGES = 2000
+EXPORT_CONCURRENCY = 3  # pages in flight per job
+EXPORT_MAX_CALLS_PER_SECOND = 2  # gateway calls per job, shared by its page fetchers
+EXPORT_FOLLOWUP_DATE_FIELD = "followTime"
+EXPORT_TASK_DATE_FIELD = "startDate"
+EXPORT_MAX_JOBS = 20  # older jobs and their files are deleted
+
+# Response compression (server/compression.py); brotli is used when the package is installed.
+COMPRESSION_MIN_BYTES = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+# Output of `python -m server.static_assets` (hashed, precompressed copies), relative to the repo root.
+STATIC_BUILD_DIR = "build/static"
+# Responsive variants of assets/ images, written by the same build step when Pillow is installed.
+STATIC_IMAGE_WIDTHS = (480, 960, 1600)
+STATIC_IMAGE_MAX_PIXELS = 4_000_000  # larger originals get no full-size WebP / AVIF copy
+
+# Technician day route (/api/routes/day)
+ROUTE_TASK_DATE_FIELD = "startDate"  # simpleVOs field used to fetch one day of tasks
+# Summaries read only the day's customers: followups and tasks filtered by "<field> in [codes]".
+ROUTE_CUSTOMER_CODE_FIELD = "customer.code"
+ROUTE_SUMMARY_BATCH_SIZE = 50  # customer codes per "in" filter
+
+# CRM change events (server/crm_events.py, POST /api/crm/events); disabled while the secret is empty.
+# Prefer MAQUA_CRM_EVENT_SECRET in the environment. With events flowing, L2_CACHE_TTLS can be raised.
+CRM_EVENT_SECRET = ""
+CRM_EVENT_MAX_SKEW_SECONDS = 300
+
+# Admission control (server/admission.py): requests that need the gateway share these slots across workers.
+ADMISSION_ENABLED = True
+ADMISSION_MAX_UPSTREAM_REQUESTS = 4
+ADMISSION_SLOW_MAX_UPSTREAM_REQUESTS = 1  # while the gateway is slow
+ADMISSION_SLOW_GATEWAY_SECONDS = 3.0  # p90 gateway call time that counts as slow
+ADMISSION_LATENCY_WINDOW_SECONDS = 60
+ADMISSION_MAX_QUEUE_MS = 5000  # X-Request-Start age beyond which gateway work is refused; 0 disables
+
+# Gateway timeouts and hedging (server/hedging.py). Timeouts adapt to each path's recent p99;
+# list / query calls slower than their p95 get one duplicate, paid from a per-process budget.
+GATEWAY_TIMEOUT_SECONDS = 15  # also the timeout until a path has enough samples
+GATEWAY_TIMEOUT_MIN_SECONDS = 3
+GATEWAY_TIMEOUT_P99_MULTIPLIER = 3
+GATEWAY_LATENCY_SAMPLES = 200  # recent attempts kept per path
+GATEWAY_LATENCY_MIN_SAMPLES = 20
+HEDGE_ENABLED = True
+HEDGE_BUDGET_RATIO = 0.05  # at most ~5% extra calls on hedged paths
+HEDGE_BUDGET_BURST = 5
+HEDGE_MAX_THREADS = 8
+
+# Worker warm-up (server/warmup.py, gunicorn.conf.py); /healthz/ready answers 503 until it finishes.
+WORKER_WARMUP_TIMEOUT_SECONDS = 20  # keep below the gunicorn worker timeout (30s)
+GATEWAY_WARM_CONNECTIONS = 2
+GATEWAY_POOL_SIZE = 10  # pooled gateway connections per worker
+TOKEN_SHARED = True  # workers on the host share one token file in the data directory
+
+# Mock CRM data (server/mock_data.py, only imported when enabled) instead of the real gateway.
+USE_MOCK_DATA = False
+
+# Logging (server/structured_log.py): JSON lines on stderr, written by a background thread.
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "json"  # or "text"
+LOG_DEBUG_SAMPLE_RATE = 0.01  # share of /api/ requests that log their DEBUG records
+LOG_DEBUG_TOKEN = ""  # X-Debug-Log value that turns on DEBUG for one request; prefer MAQUA_LOG_DEBUG_TOKEN
+LOG_QUEUE_SIZE = 10000  # records beyond this are dropped rather than blocking requests
+
+# Followup attachment cache (server/attachment_cache.py): metadata is kept for good, signed URLs
+# until this many seconds before the expiry in the URL (or the default TTL when it has none).
+ATTACHMENT_CACHE_ENABLED = True
+ATTACHMENT_URL_REFRESH_MARGIN_SECONDS = 120
+ATTACHMENT_URL_DEFAULT_TTL_SECONDS = 600
+
+# Extra tenants served by the same workers (server/tenants.py); the settings above are the "default"
+# tenant. Requests are routed by Host header or by a TENANT_PATH_PREFIX/<name>/ path prefix. An entry
+# overrides APP_KEY, APP_SECRET, TENANT_ID, GATEWAY_URL, TOKEN_URL, CRM_EVENT_SECRET and the
+# ADMISSION_*_UPSTREAM_REQUESTS limits; credentials are never inherited from the default tenant.
+# Prefer MAQUA_TENANT_<NAME>_APP_SECRET in the environment over committing a secret here.
+# Example: {"brand2": {"hosts": ["brand2.example.com"], "APP_KEY": "...", "TENANT_ID": "..."}}
+TENANTS = {}
+TENANT_PATH_PREFIX = "/t"
@@ -2,36 +2,150 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, Iterable, List, Optional
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 try:
     import server.config as config  # type: ignore
 except ImportError:  # pragma: no cover
     import server.config_example as config
 
+from server import deadline, tenants
+from server.admission import ADMISSION
+from server.attachment_cache import ATTACHMENT_CACHE
+from server.hedging import GATEWAY_LATENCY
+from server.l2_cache import L2_CACHE, L2Cache, customer_id_tag, request_tags, response_tags
 from server.token_service import TOKEN_SERVICE
 
-# 導入模擬數據模塊
-try:
-    from . import mock_data
-except ImportError:
-    import mock_data
+logger = logging.getLogger(__name__)
+
+
+def _mock_data() -> Optional[Any]:
+    """模擬數據模塊：只有 USE_MOCK_DATA 開啟時才載入（冷啟動不需要它）。"""
+    if not getattr(config, "USE_MOCK_DATA", False):
+        return None
+    from server import mock_data
+
+    return mock_data
+
+
+# (path, elapsed seconds, error or None) for every gateway call
+CallListener = Callable[[str, float, Optional[BaseException]], None]
 
 
 class CRMClient:
-    def __init__(self) -> None:
-        self.gateway_url = config.GATEWAY_URL.rstrip("/")
+    def __init__(self, response_cache: Optional[L2Cache] = None) -> None:
+        self.gateway_url = tenants.setting("GATEWAY_URL").rstrip("/")
+        self._call_listeners: List[CallListener] = []
+        self.response_cache = response_cache
+        self._session = self._new_session()
+
+    @staticmethod
+    def _new_session() -> requests.Session:
+        # 共用連線池：TLS 連線在呼叫之間重用（對沖請求也需要額外連線）
+        session = requests.Session()
+        pool_size = max(1, int(getattr(config, "GATEWAY_POOL_SIZE", 10)))
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        return session
+
+    def _after_fork(self) -> None:
+        # Pooled sockets opened before a fork must not be shared with the parent.
+        self._session = self._new_session()
+
+    def warm_up(self, connections: int) -> Dict[str, Any]:
+        """Fetch the token and fill the connection pool before the first real call."""
+        if _mock_data() is not None:
+            return {"mock": True}
+        TOKEN_SERVICE.get_token()
+        return {"token": True, "connections": self.warm_connections(connections)}
+
+    def warm_connections(self, count: int) -> int:
+        """Open up to ``count`` pooled gateway connections in parallel; returns how many answered."""
+        if count <= 0:
+            return 0
+
+        def _open(_: int) -> bool:
+            try:
+                self._session.head(self.gateway_url + "/", timeout=deadline.timeout_for(5), allow_redirects=False)
+            except requests.RequestException:
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="gateway-warm") as pool:
+            return sum(pool.map(_open, range(count)))
+
+    def add_call_listener(self, listener: CallListener) -> None:
+        """Register a callback invoked after every upstream call (success or failure)."""
+        self._call_listeners.append(listener)
+
+    def _notify(self, path: str, started: float, error: Optional[BaseException]) -> None:
+        elapsed = time.monotonic() - started
+        for listener in self._call_listeners:
+            try:
+                listener(path, elapsed, error)
+            except Exception:  # pragma: no cover - listeners must not break calls
+                pass
 
     def _request(self, method: str, path: str, *, params: Optional[Dict[str, Any]] = None,
-                 json_body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                 json_body: Optional[Dict[str, Any]] = None, idempotent: bool = True) -> Dict[str, Any]:
+        ADMISSION.before_upstream(path)
+        started = time.monotonic()
+        try:
+            data = GATEWAY_LATENCY.call(
+                path,
+                lambda timeout: self._send(method, path, params=params, json_body=json_body, timeout=timeout),
+                idempotent=idempotent,
+            )
+        except BaseException as exc:
+            self._notify(path, started, exc)
+            raise
+        self._notify(path, started, None)
+        return data
+
+    def _cached_request(self, method: str, path: str, *, params: Optional[Dict[str, Any]] = None,
+                        json_body: Optional[Dict[str, Any]] = None, cache: bool = True) -> Dict[str, Any]:
+        """Read-only call served from the shared L2 cache when possible."""
+        store = self.response_cache
+        if not cache or store is None or not store.enabled():
+            return self._request(method, path, params=params, json_body=json_body)
+        key = store.make_key(method, path, params, json_body)
+        try:
+            cached = store.get(key)
+        except Exception:  # pragma: no cover - a broken cache must not break lookups
+            cached = None
+        if cached is not None:
+            return cached
+        data = self._request(method, path, params=params, json_body=json_body)
+        try:
+            store.put(key, path, data, request_tags(json_body, params) | response_tags(data))
+        except Exception:  # pragma: no cover - e.g. database locked
+            pass
+        return data
+
+    def _send(self, method: str, path: str, *, params: Optional[Dict[str, Any]] = None,
+              json_body: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
         url = self.gateway_url + path
         token = TOKEN_SERVICE.get_token()
         req_params = {"access_token": token}
         if params:
             req_params.update(params)
-        resp = requests.request(method, url, params=req_params, json=json_body, timeout=15)
+        try:
+            resp = self._session.request(
+                method, url, params=req_params, json=json_body,
+                timeout=timeout if timeout is not None else deadline.timeout_for(15),
+            )
+        except requests.Timeout as exc:
+            current = deadline.current()
+            if current is not None and current.remaining() < deadline.MIN_CALL_SECONDS:
+                raise deadline.DeadlineExceeded(f"request deadline exceeded calling {path}") from exc
+            raise
         try:
             resp.raise_for_status()
         except requests.HTTPError as exc:
@@ -57,20 +171,24 @@ class CRMClient:
         *,
         search_field: Optional[str] = None,
         search_operator: Optional[str] = None,
+        filters: Optional[List[Dict[str, Any]]] = None,
+        cache: bool = True,
     ) -> Dict[str, Any]:
-        """獲取跟進記錄列表"""
+        """獲取跟進記錄列表；filters 為額外的 simpleVOs 條件（例如同步水位）。"""
         
         # 檢查是否使用模擬數據
-        if getattr(mock_data, "USE_MOCK_DATA", False):
-            print("使用模擬數據返回跟進記錄")
+        mock_data = _mock_data()
+        if mock_data is not None:
+            logger.debug("使用模擬數據返回跟進記錄")
             return mock_data.generate_mock_followup_data(customer_code, page, page_size)
         
         # 原有的真實API調用邏輯
-        payload = {
+        payload: Dict[str, Any] = {
             "pageIndex": page,
             "pageSize": page_size,
         }
-        
+        extra_filters = list(filters or [])
+
         # 如果指定了客戶代碼，添加查詢條件
         if customer_code:
             primary_field = search_field or config.FOLLOWUP_CUSTOMER_FIELD
@@ -90,9 +208,11 @@ class CRMClient:
                         "op": operator,
                         "value1": customer_code,
                     }
-                ]
+                ] + extra_filters
 
-                response = self._request("POST", config.FOLLOWUP_LIST_PATH, json_body=payload_attempt)
+                response = self._cached_request(
+                    "POST", config.FOLLOWUP_LIST_PATH, json_body=payload_attempt, cache=cache
+                )
                 last_response = response
                 record_list = response.get("data", {}).get("recordList", [])
                 if record_list:
@@ -102,37 +222,51 @@ class CRMClient:
             if last_response:
                 last_response.setdefault("_meta", {})["searchField"] = field_candidates[-1]
                 return last_response
-            return self._request("POST", config.FOLLOWUP_LIST_PATH, json_body=payload)
+            return self._cached_request("POST", config.FOLLOWUP_LIST_PATH, json_body=payload, cache=cache)
 
-        return self._request("POST", config.FOLLOWUP_LIST_PATH, json_body=payload)
+        if extra_filters:
+            payload["simpleVOs"] = extra_filters
+        return self._cached_request("POST", config.FOLLOWUP_LIST_PATH, json_body=payload, cache=cache)
 
     def get_followup_files(self, followup_id: str) -> Dict[str, Any]:
         """獲取跟進記錄的附件信息"""
         
         # 檢查是否使用模擬數據
-        if getattr(mock_data, "USE_MOCK_DATA", False):
-            print("使用模擬數據返回跟進記錄附件")
+        mock_data = _mock_data()
+        if mock_data is not None:
+            logger.debug("使用模擬數據返回跟進記錄附件")
             return mock_data.generate_mock_followup_files(followup_id)
         
         # 原有的真實API調用邏輯
         payload = {"businessIds": [followup_id]}
         return self._request("POST", config.FOLLOWUP_FILES_PATH, json_body=payload)
 
-    def query_followup_files(self, business_ids: Iterable[str]) -> Dict[str, Any]:
-        """批次查詢跟進記錄附件信息"""
+    def query_followup_files(self, business_ids: Iterable[str], *, cache: bool = True) -> Dict[str, Any]:
+        """批次查詢跟進記錄附件信息；已快取且簽名 URL 未過期的 id 不再呼叫閘道（見 attachment_cache.py）"""
 
         # 檢查是否使用模擬數據
-        if getattr(mock_data, "USE_MOCK_DATA", False):
-            print("使用模擬數據返回跟進記錄附件查詢結果")
+        mock_data = _mock_data()
+        if mock_data is not None:
+            logger.debug("使用模擬數據返回跟進記錄附件查詢結果")
             first_id = next(iter(business_ids), "")
             return mock_data.generate_mock_query_files_response(first_id)
 
-        # 根據用戶提供的API文檔格式
-        payload = {"businessIds": list(business_ids)}
-        return self._request("POST", config.FOLLOWUP_QUERY_FILES_PATH, json_body=payload)
+        def _fetch(ids: List[str]) -> Dict[str, Any]:
+            # 根據用戶提供的API文檔格式
+            return self._request("POST", config.FOLLOWUP_QUERY_FILES_PATH, json_body={"businessIds": ids})
+
+        if not cache or not ATTACHMENT_CACHE.enabled():
+            return _fetch(list(business_ids))
+        return ATTACHMENT_CACHE.lookup(business_ids, _fetch)
 
     def get_tasks(
-        self, customer_code: str = "", page: int = 1, page_size: int = 20
+        self,
+        customer_code: str = "",
+        page: int = 1,
+        page_size: int = 20,
+        *,
+        filters: Optional[List[Dict[str, Any]]] = None,
+        cache: bool = True,
     ) -> Dict[str, Any]:
         """查詢任務（排程），用於推算下次保養日期。"""
 
@@ -156,15 +290,18 @@ class CRMClient:
             if operator == "between":
                 filter_payload.setdefault("value2", customer_code)
             payload["simpleVOs"] = [filter_payload]
+        if filters:
+            payload["simpleVOs"] = list(payload.get("simpleVOs", [])) + list(filters)
 
-        return self._request("POST", task_path, json_body=payload)
+        return self._cached_request("POST", task_path, json_body=payload, cache=cache)
 
     def save_followup(self, followup_data: Dict[str, Any]) -> Dict[str, Any]:
         """保存跟進記錄"""
 
         # 檢查是否使用模擬數據
-        if getattr(mock_data, "USE_MOCK_DATA", False):
-            print("使用模擬數據保存跟進記錄")
+        mock_data = _mock_data()
+        if mock_data is not None:
+            logger.debug("使用模擬數據保存跟進記錄")
             return mock_data.generate_mock_save_response(followup_data)
 
         # 構建請求體，根據API文檔格式
@@ -173,11 +310,35 @@ class CRMClient:
             "systemSource": "followupOpenAPIAdd"
         }
 
-        return self._request("POST", config.FOLLOWUP_SAVE_PATH, payload)
+        # 寫入不套用依延遲調整的逾時：逾時後使用者重送會建立重複紀錄
+        result = self._request("POST", config.FOLLOWUP_SAVE_PATH, json_body=payload, idempotent=False)
+        self._invalidate_saved_customer(followup_data, result)
+        return result
+
+    def _invalidate_saved_customer(self, followup_data: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Write-through: drop cached list/task pages of the customer just saved (by code or CRM id)."""
+        if self.response_cache is None:
+            return
+        saved = result.get("data") if isinstance(result, dict) else None
+        tags = set()
+        for source in (followup_data, saved if isinstance(saved, dict) else {}):
+            for key in ("customer_code", "customerCode"):
+                if source.get(key):
+                    tags.add(str(source[key]))
+            # 只帶客戶 id 的存檔：以 id 標籤找到該客戶的列表頁（code 是跟進紀錄本身的編碼）
+            if isinstance(source.get("customer"), (str, int)) and str(source["customer"]).strip():
+                tags.add(customer_id_tag(source["customer"]))
+        paths = [config.FOLLOWUP_LIST_PATH]
+        if getattr(config, "TASK_LIST_PATH", ""):
+            paths.append(config.TASK_LIST_PATH)
+        try:
+            self.response_cache.invalidate(tags, paths=paths)
+        except Exception:  # pragma: no cover - stale entries still expire by TTL
+            pass
 
     def get_customer_detail(self, customer_id: str, org_id: str) -> Dict[str, Any]:
         params = {"id": customer_id, "orgId": org_id}
-        return self._request("GET", config.CUSTOMER_DETAIL_PATH, params=params)
+        return self._cached_request("GET", config.CUSTOMER_DETAIL_PATH, params=params)
 
     def get_addresses_by_codes(self, codes: Iterable[str]) -> Dict[str, Any]:
         codes_list = list(codes)
@@ -186,7 +347,7 @@ class CRMClient:
             "pageIndex": 1,
             "pageSize": max(len(codes_list), 1),
         }
-        return self._request("POST", config.CUSTOMER_ADDRESS_LIST_PATH, json_body=payload)
+        return self._cached_request("POST", config.CUSTOMER_ADDRESS_LIST_PATH, json_body=payload)
 
     def get_file_download_url(self, file_id: str) -> str:
         # Some APIs return preview URL directly. If not, use this endpoint.
@@ -202,4 +363,6 @@ class CRMClient:
         return file_url
 
 
-CRM_CLIENT = CRMClient()
+# 每個租戶一個客戶端：各自的閘道位址與連線池
+CRM_CLIENT = tenants.PerTenant(lambda: CRMClient(response_cache=L2_CACHE))
+os.register_at_fork(after_in_child=CRM_CLIENT._after_fork)
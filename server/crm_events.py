@@ -0,0 +1,328 @@
+"""Push-based cache invalidation from CRM change events.
+
+``POST /api/crm/events`` receives YonBIP event-subscription pushes, sent
+unencrypted: one envelope or a list of them. Each envelope has a ``type``
+or ``eventType``, an ``id`` and a ``content`` (a JSON object or string)
+holding the changed record(s). Requests are authenticated with an
+HMAC-SHA256 of ``"<X-Event-Timestamp>.<raw body>"`` under
+``CRM_EVENT_SECRET`` (or ``MAQUA_CRM_EVENT_SECRET``), sent as
+``X-Event-Signature``. Without a secret the endpoint is disabled. Each
+tenant (server/tenants.py) has its own secret, journal and listeners, and
+its events only touch its own stores.
+
+For every event, only the customers involved are touched:
+
+* shared stores, updated once by the worker that receives the event: L2
+  cache entries for their followup / task / address / detail queries, and
+  the replica rows (upserted when the event carries the full record,
+  deleted on delete events, otherwise marked stale for that customer);
+* per-worker state, updated by every worker through a small journal in the
+  data dir: negative cache entries, the known-code Bloom filter, the
+  autocomplete index, phone index freshness, and registered listeners (the
+  fleet dashboard cache).
+
+``python -m server.crm_events followup C3770`` posts a signed stand-in
+event to a local server for testing.
+"""
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+from server.record_utils import record_customer_code
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = "crm_events.json"
+JOURNAL_MAX_ENTRIES = 500
+KIND_KEYWORDS = (("FOLLOW", "followups"), ("TASK", "tasks"), ("MERCHANT", "customers"), ("CUSTOMER", "customers"))
+DELETE_KEYWORDS = ("DELETE", "REMOVE", "DEL")
+# Fields an event record needs before it can replace the replica row outright.
+_FULL_RECORD_FIELDS = {"followups": ("followTime",), "tasks": ("startDate", "planDate", "endDate")}
+
+Listener = Callable[[str, Set[str]], None]
+
+
+class EventError(ValueError):
+    pass
+
+
+def _secret() -> str:
+    if not tenants.current().is_default:
+        return tenants.setting("CRM_EVENT_SECRET", "") or ""
+    return os.getenv("MAQUA_CRM_EVENT_SECRET") or getattr(config, "CRM_EVENT_SECRET", "") or ""
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+
+def _parse_kind(event_type: str) -> Tuple[Optional[str], bool]:
+    upper = event_type.upper()
+    kind = next((name for keyword, name in KIND_KEYWORDS if keyword in upper), None)
+    return kind, any(keyword in upper for keyword in DELETE_KEYWORDS)
+
+
+def _content_records(content: Any) -> List[Dict[str, Any]]:
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except ValueError:
+            return []
+    if isinstance(content, list):
+        return [item for item in content if isinstance(item, dict)]
+    if not isinstance(content, dict):
+        return []
+    for key in ("data", "records", "recordList"):
+        nested = content.get(key)
+        if isinstance(nested, (list, dict)):
+            return _content_records(nested)
+    if isinstance(content.get("ids"), list):
+        return [{"id": record_id} for record_id in content["ids"]]
+    return [content]
+
+
+class CrmEvents:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._listeners: List[Listener] = []
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._applied_seq = 0
+        self._journal_mtime: Optional[float] = None
+
+    def enabled(self) -> bool:
+        return bool(_secret())
+
+    def add_listener(self, listener: Listener) -> None:
+        """``listener(kind, codes)`` runs in every worker after an event for ``codes``."""
+        self._listeners.append(listener)
+
+    # ----------------------------------------------------------- receiving
+    def verify(self, body: bytes, timestamp: str, signature: str) -> bool:
+        secret = _secret()
+        if not secret or not timestamp or not signature:
+            return False
+        try:
+            skew = abs(time.time() - float(timestamp))
+        except ValueError:
+            return False
+        if skew > getattr(config, "CRM_EVENT_MAX_SKEW_SECONDS", 300):
+            return False
+        return hmac.compare_digest(sign(secret, timestamp, body), signature.strip())
+
+    def handle(self, payload: Any) -> List[Dict[str, Any]]:
+        """Apply one envelope or a list of them; returns what was done per event."""
+        envelopes = payload if isinstance(payload, list) else [payload]
+        self.catch_up()  # settle this worker's position in the journal before adding to it
+        results = []
+        for envelope in envelopes:
+            if not isinstance(envelope, dict):
+                raise EventError("event must be a JSON object")
+            results.append(self._handle_one(envelope))
+        return results
+
+    def _handle_one(self, envelope: Dict[str, Any]) -> Dict[str, Any]:
+        event_type = str(envelope.get("eventType") or envelope.get("type") or "")
+        kind, deleted = _parse_kind(event_type)
+        if kind is None:
+            return {"type": event_type, "ignored": "unknown event type"}
+        event_id = str(envelope.get("id") or envelope.get("eventId") or "")
+        with self._lock:
+            if event_id and event_id in self._seen:
+                return {"type": event_type, "ignored": "duplicate"}
+            if event_id:
+                self._seen[event_id] = None
+                while len(self._seen) > JOURNAL_MAX_ENTRIES:
+                    self._seen.popitem(last=False)
+
+        records = _content_records(envelope.get("content"))
+        codes, names, phones = self._customers(kind, records)
+        for code in envelope.get("customerCodes") or []:
+            codes.add(str(code).strip().upper())
+        self._apply_shared(kind, deleted, records, codes)
+        self._journal({"kind": kind, "deleted": deleted, "codes": sorted(codes),
+                       "names": names, "phones": sorted(phones)})
+        self.catch_up()
+        return {"type": event_type, "kind": kind, "deleted": deleted,
+                "records": len(records), "customerCodes": sorted(codes)}
+
+    @staticmethod
+    def _customers(kind: str, records: List[Dict[str, Any]]) -> Tuple[Set[str], Dict[str, str], Set[str]]:
+        from server.phone_index import PHONE_FIELDS
+        from server.replica import REPLICA
+
+        codes: Set[str] = set()
+        names: Dict[str, str] = {}
+        phones: Set[str] = set()
+        for record in records:
+            if kind == "customers":
+                code = str(record.get("code") or "").strip().upper()
+                if code and record.get("id"):
+                    REPLICA.remember_customer_id(record["id"], code)
+                name = record.get("name")
+                name = name.get("zh_CN") if isinstance(name, dict) else name
+                for address in record.get("merchantAddressInfos") or []:
+                    if isinstance(address, dict):
+                        phones.update(str(address[field]) for field in PHONE_FIELDS if address.get(field))
+            else:
+                code = record_customer_code(record)
+                if not code and record.get("customer"):
+                    code = REPLICA.code_for_customer_id(record["customer"])
+                name = record.get("customer_name")
+            if code:
+                codes.add(code)
+                if name:
+                    names[code] = str(name)
+        return codes, names, phones
+
+    def _apply_shared(self, kind: str, deleted: bool, records: List[Dict[str, Any]], codes: Set[str]) -> None:
+        from server.l2_cache import L2_CACHE, customer_id_tag
+        from server.replica import REPLICA
+
+        if kind == "customers":
+            tags = set(codes) | {customer_id_tag(record["id"]) for record in records if record.get("id")}
+            paths = [config.CUSTOMER_DETAIL_PATH, config.CUSTOMER_ADDRESS_LIST_PATH]
+            if L2_CACHE.enabled():
+                L2_CACHE.invalidate(tags, paths=paths, include_unfiltered=False)
+            return
+
+        paths = [config.FOLLOWUP_LIST_PATH]
+        if getattr(config, "TASK_LIST_PATH", ""):
+            paths.append(config.TASK_LIST_PATH)
+        if L2_CACHE.enabled():
+            # Unfiltered list pages (fleet dashboard, exports) may contain the record too.
+            tags = set(codes) | {
+                customer_id_tag(record["customer"]) for record in records
+                if isinstance(record.get("customer"), (str, int)) and str(record["customer"]).strip()
+            }
+            L2_CACHE.invalidate(tags, paths=paths)
+        if not REPLICA.enabled():
+            return
+        if deleted:
+            REPLICA.delete(kind, (record.get(config.FOLLOWUP_ID_FIELD) or record.get("id") for record in records))
+            return
+        required = _FULL_RECORD_FIELDS[kind]
+        full = [
+            record for record in records
+            if (record.get(config.FOLLOWUP_ID_FIELD) or record.get("id"))
+            and any(record.get(field) for field in required)
+        ]
+        if full:
+            default_code = next(iter(codes)) if len(codes) == 1 else ""
+            REPLICA.upsert(kind, full, default_code=default_code)
+        if len(full) < len(records):
+            for code in codes:
+                REPLICA.invalidate_customer(code)
+
+    # ----------------------------------------------------------- per worker
+    def _journal(self, entry: Dict[str, Any]) -> None:
+        """Append under an exclusive lock so concurrent receivers get distinct sequence numbers."""
+        with open(local_store.data_path(f"{JOURNAL_NAME}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                journal = local_store.load_json(JOURNAL_NAME, {}) or {}
+                entries = journal.get("entries") or []
+                seq = int(journal.get("seq") or 0) + 1
+                entries.append({**entry, "seq": seq, "at": time.time()})
+                local_store.save_json(JOURNAL_NAME, {"seq": seq, "entries": entries[-JOURNAL_MAX_ENTRIES:]})
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def catch_up(self) -> int:
+        """Apply journal entries this worker has not seen yet; cheap (one ``stat``) when idle."""
+        try:
+            mtime = local_store.data_path(JOURNAL_NAME).stat().st_mtime
+        except OSError:
+            self._journal_mtime = 0.0  # no journal yet: every future entry is new to this worker
+            return 0
+        if mtime == self._journal_mtime:
+            return 0
+        with self._lock:
+            if mtime == self._journal_mtime:
+                return 0
+            journal = local_store.load_json(JOURNAL_NAME, {}) or {}
+            entries = [entry for entry in journal.get("entries") or [] if entry.get("seq", 0) > self._applied_seq]
+            if self._journal_mtime is None:
+                # First look in this process: its caches were built after these events.
+                entries = []
+            self._journal_mtime = mtime
+            self._applied_seq = max([self._applied_seq, int(journal.get("seq") or 0)])
+        for entry in entries:
+            try:
+                self._apply_local(entry)
+            except Exception:  # pragma: no cover - one bad entry must not block the rest
+                logger.exception("[Events] failed to apply journal entry %s", entry.get("seq"))
+        return len(entries)
+
+    def _apply_local(self, entry: Dict[str, Any]) -> None:
+        from server.customer_index import CUSTOMER_INDEX
+        from server.known_codes import KNOWN_CODES, NEGATIVE_CACHE
+        from server.phone_index import PHONE_INDEX
+
+        kind = entry.get("kind") or ""
+        codes = set(entry.get("codes") or [])
+        NEGATIVE_CACHE.discard([*codes, *(entry.get("phones") or [])])
+        if not entry.get("deleted"):
+            for code in codes:
+                KNOWN_CODES.add(code)
+                CUSTOMER_INDEX.add(code, (entry.get("names") or {}).get(code))
+        if kind == "customers":
+            PHONE_INDEX.expire(codes)
+        for listener in self._listeners:
+            listener(kind, codes)
+
+
+CRM_EVENTS = tenants.PerTenant(CrmEvents)
+
+
+def _send_stand_in(kind: str, code: str, url: str, record_id: str, delete: bool) -> None:  # pragma: no cover
+    import requests
+
+    secret = _secret()
+    if not secret:
+        raise SystemExit("set CRM_EVENT_SECRET or MAQUA_CRM_EVENT_SECRET first")
+    event_type = {"followup": "CRM_FOLLOWUP", "task": "CRM_TASK", "customer": "MERCHANT"}[kind]
+    record: Dict[str, Any] = {"code": code} if kind == "customer" else {"customer_code": code}
+    if record_id:
+        record["id"] = record_id
+    envelope = {
+        "id": f"stand-in-{time.time_ns()}",
+        "type": f"{event_type}_{'DELETE' if delete else 'UPDATE'}",
+        "timestamp": int(time.time() * 1000),
+        "content": json.dumps({"data": [record]}, ensure_ascii=False),
+    }
+    body = json.dumps(envelope, ensure_ascii=False).encode("utf-8")
+    timestamp = str(int(time.time()))
+    resp = requests.post(url, data=body, timeout=10, headers={
+        "Content-Type": "application/json",
+        "X-Event-Timestamp": timestamp,
+        "X-Event-Signature": sign(secret, timestamp, body),
+    })
+    print(resp.status_code, resp.text)
+
+
+if __name__ == "__main__":  # pragma: no cover - local stand-in for the CRM push
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Post a signed stand-in CRM change event")
+    parser.add_argument("kind", choices=("followup", "task", "customer"))
+    parser.add_argument("code", help="customer code the change concerns")
+    parser.add_argument("--id", default="", help="record id (needed for --delete)")
+    parser.add_argument("--delete", action="store_true")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/api/crm/events")
+    args = parser.parse_args()
+    _send_stand_in(args.kind, args.code.strip().upper(), args.url, args.id, args.delete)
@@ -0,0 +1,222 @@
+"""In-memory prefix index of known customer codes and names for autocomplete.
+
+The snapshot is shared by every worker on the host. A save merges under a
+file lock: codes and names other workers saved are taken over, except for
+codes this worker changed since its last save, and the merged index is
+written. Between saves each worker picks up the other workers' entries when
+the snapshot changes, checked at most every ``LOCAL_INDEX_RELOAD_SECONDS``.
+"""
+from __future__ import annotations
+
+import bisect
+import difflib
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+
+SNAPSHOT_NAME = "customer_index.json"
+# Sorts after every other character, closing a prefix range in bisect lookups.
+_PREFIX_END = "\U0010ffff"
+
+
+class CustomerIndex:
+    """Sorted code and name lists answering prefix queries with ``bisect``."""
+
+    def __init__(self, snapshot_name: str = SNAPSHOT_NAME) -> None:
+        self._lock = threading.RLock()
+        self._snapshot_name = snapshot_name
+        self._names: Dict[str, str] = {}
+        self._codes: List[str] = []
+        self._name_keys: List[Tuple[str, str]] = []
+        # codes added or renamed here since the last save; they win over the snapshot when merging
+        self._pending: Set[str] = set()
+        self._loaded = False
+        self._saved_at = 0.0
+        self._snapshot_mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def load(self) -> None:
+        if self._loaded:
+            self._reload_if_changed()
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._snapshot_mtime = local_store.snapshot_mtime(self._snapshot_name)
+            self._adopt(local_store.load_json(self._snapshot_name, {}) or {})
+            self._checked_at = time.time()
+            self._loaded = True
+
+    def _reload_if_changed(self) -> None:
+        now = time.time()
+        if now - self._checked_at < float(getattr(config, "LOCAL_INDEX_RELOAD_SECONDS", 10)):
+            return
+        self._checked_at = now
+        mtime = local_store.snapshot_mtime(self._snapshot_name)
+        if mtime == self._snapshot_mtime:
+            return
+        snapshot = local_store.load_json(self._snapshot_name, {}) or {}
+        with self._lock:
+            self._adopt(snapshot)
+            self._snapshot_mtime = mtime
+
+    def _adopt(self, snapshot: Dict[str, Any]) -> None:
+        """Take over codes and names from the snapshot, except codes changed here."""
+        changed = False
+        for code, name in (snapshot.get("customers") or {}).items():
+            name = name or ""
+            if code in self._pending:
+                continue
+            old_name = self._names.get(code)
+            if old_name is None or (name and name != old_name):
+                self._names[code] = name
+                changed = True
+        if changed:
+            self._codes = sorted(self._names)
+            self._name_keys = sorted(
+                (name.casefold(), code) for code, name in self._names.items() if name
+            )
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self._names)
+
+    def __contains__(self, code: object) -> bool:
+        self.load()
+        return str(code or "").strip().upper() in self._names
+
+    def add(self, code: Any, name: Any = None) -> bool:
+        """Insert or update one customer; returns True when the index changed."""
+        normalized = str(code or "").strip().upper()
+        if not normalized:
+            return False
+        new_name = str(name or "").strip()
+        self.load()
+        with self._lock:
+            old_name = self._names.get(normalized)
+            if old_name is None:
+                bisect.insort(self._codes, normalized)
+            elif not new_name or old_name == new_name:
+                return False
+            elif old_name:
+                self._remove_name_key(old_name, normalized)
+            self._names[normalized] = new_name or (old_name or "")
+            if new_name:
+                bisect.insort(self._name_keys, (new_name.casefold(), normalized))
+            self._pending.add(normalized)
+            return True
+
+    def _remove_name_key(self, name: str, code: str) -> None:
+        key = (name.casefold(), code)
+        pos = bisect.bisect_left(self._name_keys, key)
+        if pos < len(self._name_keys) and self._name_keys[pos] == key:
+            del self._name_keys[pos]
+
+    def observe_records(self, records: Iterable[Dict[str, Any]]) -> int:
+        """Learn code/name pairs from followup or task records."""
+        added = 0
+        for item in records or []:
+            if not isinstance(item, dict):
+                continue
+            code = item.get("customer_code") or item.get("customerCode")
+            if not code and isinstance(item.get("customer"), dict):
+                code = item["customer"].get("code")
+            if code and self.add(code, item.get("customer_name") or item.get("customerName")):
+                added += 1
+        return added
+
+    def suggest(self, query: str, limit: int = 10) -> List[Dict[str, Optional[str]]]:
+        """Return customers whose code or name starts with ``query``; codes first."""
+        text = str(query or "").strip()
+        if not text:
+            return []
+        self.load()
+        limit = max(1, limit)
+        results: List[Dict[str, Optional[str]]] = []
+        seen = set()
+        with self._lock:
+            code_prefix = text.upper()
+            start = bisect.bisect_left(self._codes, code_prefix)
+            end = bisect.bisect_left(self._codes, code_prefix + _PREFIX_END, lo=start)
+            for code in self._codes[start:min(end, start + limit)]:
+                seen.add(code)
+                results.append({"code": code, "name": self._names.get(code) or None})
+
+            if len(results) < limit:
+                name_prefix = text.casefold()
+                start = bisect.bisect_left(self._name_keys, (name_prefix,))
+                end = bisect.bisect_left(self._name_keys, (name_prefix + _PREFIX_END,), lo=start)
+                for name_key, code in self._name_keys[start:end]:
+                    if code in seen:
+                        continue
+                    seen.add(code)
+                    results.append({"code": code, "name": self._names.get(code) or None})
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def codes_with_prefix(self, prefix: str, limit: int = 20) -> List[str]:
+        code_prefix = str(prefix or "").strip().upper()
+        if not code_prefix:
+            return []
+        self.load()
+        with self._lock:
+            start = bisect.bisect_left(self._codes, code_prefix)
+            end = bisect.bisect_left(self._codes, code_prefix + _PREFIX_END, lo=start)
+            return self._codes[start:min(end, start + limit)]
+
+    def add_codes(self, codes: Iterable[Any]) -> int:
+        """Bulk-insert codes without names (e.g. from the replica); returns how many were new."""
+        self.load()
+        with self._lock:
+            new_codes = {str(code or "").strip().upper() for code in codes} - set(self._names)
+            new_codes.discard("")
+            if not new_codes:
+                return 0
+            for code in new_codes:
+                self._names[code] = ""
+            self._codes = sorted(self._names)
+            self._pending.update(new_codes)
+            return len(new_codes)
+
+    def near_codes(self, code: str, limit: int = 5) -> List[str]:
+        """Known codes extending ``code`` or sharing most of its prefix (typo suggestions)."""
+        expected = str(code or "").strip().upper()
+        if not expected:
+            return []
+        extensions = [known for known in self.codes_with_prefix(expected, limit) if known != expected]
+        pool: Set[str] = set()
+        for cut in range(1, min(3, len(expected) - 1) + 1):
+            pool.update(self.codes_with_prefix(expected[:-cut], 200))
+        pool.difference_update(extensions)
+        pool.discard(expected)
+        close = difflib.get_close_matches(expected, sorted(pool), n=limit, cutoff=0.75)
+        return (extensions + close)[:limit]
+
+    def save(self, *, force: bool = False) -> None:
+        """Merge into the shared snapshot (under a file lock), at most once per ``CUSTOMER_INDEX_SAVE_INTERVAL_SECONDS``."""
+        interval = getattr(config, "CUSTOMER_INDEX_SAVE_INTERVAL_SECONDS", 30)
+        with self._lock:
+            if not self._pending:
+                return
+            if not force and time.time() - self._saved_at < interval:
+                return
+            self._saved_at = time.time()
+        with local_store.locked(self._snapshot_name):
+            snapshot = local_store.load_json(self._snapshot_name, {}) or {}
+            with self._lock:
+                self._adopt(snapshot)
+                self._pending.clear()
+                payload = {"customers": dict(self._names)}
+            local_store.save_json(self._snapshot_name, payload)
+            self._snapshot_mtime = local_store.snapshot_mtime(self._snapshot_name)
+
+
+CUSTOMER_INDEX = tenants.PerTenant(CustomerIndex)
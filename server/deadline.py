@@ -0,0 +1,77 @@
+"""Per-request deadline budgets shared by the CRM client and the lookup pipeline.
+
+A request handler opens ``budget(seconds)``; every upstream call made inside it
+uses ``timeout_for(default)`` so its socket timeout never outlives the request,
+and raises ``DeadlineExceeded`` instead of starting a call that cannot finish.
+Pipeline stages ask ``allows(reserve)`` before doing optional work.
+"""
+from __future__ import annotations
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Below this many seconds an upstream call is not worth starting.
+MIN_CALL_SECONDS = 0.5
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float) -> None:
+        self.seconds = float(seconds)
+        self.expires_at = time.monotonic() + self.seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def budget(seconds: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """Run the block under a deadline; nested budgets never extend the outer one."""
+    outer = _current.get()
+    if seconds is None or seconds <= 0:
+        yield outer
+        return
+    deadline = Deadline(seconds)
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def remaining() -> Optional[float]:
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def allows(reserve: float) -> bool:
+    """True when there is no deadline or more than ``reserve`` seconds are left."""
+    left = remaining()
+    return left is None or left > reserve
+
+
+def timeout_for(default: float) -> float:
+    """Socket timeout for one upstream call: ``default`` capped by the time left."""
+    left = remaining()
+    if left is None:
+        return default
+    if left < MIN_CALL_SECONDS:
+        raise DeadlineExceeded("request deadline exceeded before upstream call")
+    return min(default, left)
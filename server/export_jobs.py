@@ -0,0 +1,312 @@
+"""Background CSV / XLSX exports of followup and task history.
+
+A job pages through the followup list (and optionally tasks) for a date
+range. Several pages are in flight at once (``EXPORT_CONCURRENCY``), but
+gateway calls never exceed ``EXPORT_MAX_CALLS_PER_SECOND``. Every record is
+mapped to a row by the mappers ``server.app`` registers, which reuse the
+lookup pipeline's normalization. Rows are appended to a CSV file as each page
+arrives, so memory stays flat whatever the export size. After every page the
+job saves a checkpoint (next page, rows written, CSV byte offset), and an
+interrupted or failed job resumes from it. XLSX output is converted from the
+finished CSV with openpyxl's write-only workbook.
+
+Job state and output live in ``<data dir>/exports``, so any worker can
+report progress or serve the download.
+"""
+from __future__ import annotations
+
+import csv
+import fcntl
+import importlib.util
+import logging
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR_NAME = "exports"
+KINDS = ("followups", "tasks")
+FORMATS = ("csv", "xlsx")
+COLUMNS = [
+    "type",
+    "id",
+    "customerCode",
+    "customerName",
+    "owner",
+    "serviceDate",
+    "nextServiceDate",
+    "photoCount",
+    "content",
+]
+
+# (record, job params) -> row dict keyed by COLUMNS, or None to skip the record
+RowMapper = Callable[[Dict[str, Any], Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+class ExportError(ValueError):
+    pass
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / per_second`` apart across threads."""
+
+    def __init__(self, per_second: float) -> None:
+        self._interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ExportJobs:
+    def __init__(self) -> None:
+        self._client: Any = None
+        self._mappers: Dict[str, RowMapper] = {}
+
+    def configure(self, client: Any, mappers: Dict[str, RowMapper]) -> None:
+        self._client = client
+        self._mappers = dict(mappers)
+
+    # ------------------------------------------------------------------ files
+    @staticmethod
+    def _dir() -> Path:
+        directory = local_store.data_path(EXPORT_DIR_NAME)
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return local_store.load_json(f"{EXPORT_DIR_NAME}/{job_id}.json")
+
+    def _save(self, state: Dict[str, Any]) -> None:
+        state["updatedAt"] = datetime.now().isoformat(timespec="seconds")
+        local_store.save_json(f"{EXPORT_DIR_NAME}/{state['id']}.json", state)
+
+    def output_path(self, job_id: str) -> Optional[Path]:
+        state = self._load(job_id)
+        if not state or state.get("status") != "done":
+            return None
+        return self._dir() / f"{job_id}.{state['format']}"
+
+    def _prune(self) -> None:
+        keep = int(getattr(config, "EXPORT_MAX_JOBS", 20))
+        states = sorted(self._dir().glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for state_path in states[:-keep]:
+            for path in self._dir().glob(f"{state_path.stem}.*"):
+                path.unlink(missing_ok=True)
+
+    # ------------------------------------------------------------------- jobs
+    def create(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        fmt = str(params.get("format") or "csv").lower()
+        if fmt not in FORMATS:
+            raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+        if fmt == "xlsx" and importlib.util.find_spec("openpyxl") is None:
+            raise ExportError("XLSX export needs openpyxl (pip install openpyxl)")
+        kinds = ["followups"]
+        if params.get("includeTasks") and getattr(config, "TASK_LIST_PATH", ""):
+            kinds.append("tasks")
+        state = {
+            "id": secrets.token_hex(6),
+            "status": "queued",
+            "format": fmt,
+            "params": {
+                "startDate": params.get("startDate") or None,
+                "endDate": params.get("endDate") or None,
+                "maintenanceOnly": bool(params.get("maintenanceOnly", True)),
+            },
+            "kinds": kinds,
+            "cursor": {"kind": kinds[0], "page": 1},
+            "progress": {kind: {"pages": 0, "records": 0, "total": None} for kind in kinds},
+            "rows": 0,
+            "bytes": 0,
+            "error": None,
+            "createdAt": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._dir()
+        self._save(state)
+        self._prune()
+        self._start(state["id"])
+        return state
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._load(job_id)
+
+    def resume(self, job_id: str) -> Optional[Dict[str, Any]]:
+        state = self._load(job_id)
+        if state is None or state.get("status") == "done":
+            return state
+        self._start(job_id)
+        return state
+
+    def _start(self, job_id: str) -> None:
+        thread = threading.Thread(target=tenants.bind(self._run), args=(job_id,), name=f"export-{job_id}", daemon=True)
+        thread.start()
+
+    def _run(self, job_id: str) -> None:
+        lock_path = self._dir() / f"{job_id}.lock"
+        with open(lock_path, "w") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # already running in this or another worker
+            try:
+                state = self._load(job_id)
+                if not state or state.get("status") == "done":
+                    return
+                state.update({"status": "running", "error": None})
+                self._save(state)
+                try:
+                    self._export(state)
+                    if state["format"] == "xlsx":
+                        state["status"] = "converting"
+                        self._save(state)
+                        self._convert_to_xlsx(job_id)
+                    state["status"] = "done"
+                    state["finishedAt"] = datetime.now().isoformat(timespec="seconds")
+                except Exception as exc:
+                    logger.exception("[Export] job %s failed", job_id)
+                    state.update({"status": "failed", "error": str(exc)})
+                self._save(state)
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # ----------------------------------------------------------------- paging
+    def _filters(self, kind: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        start, end = params.get("startDate"), params.get("endDate")
+        if not start and not end:
+            return []
+        field = (
+            getattr(config, "EXPORT_FOLLOWUP_DATE_FIELD", "followTime")
+            if kind == "followups"
+            else getattr(config, "EXPORT_TASK_DATE_FIELD", "startDate")
+        )
+        return [{
+            "field": field,
+            "op": "between",
+            "value1": f"{start or '1970-01-01'} 00:00:00",
+            "value2": f"{end or '2999-12-31'} 23:59:59",
+        }]
+
+    def _fetch_page(self, limiter: RateLimiter, kind: str, page: int, page_size: int,
+                    filters: List[Dict[str, Any]]) -> Dict[str, Any]:
+        limiter.wait()
+        fetch = self._client.get_followups if kind == "followups" else self._client.get_tasks
+        return fetch("", page=page, page_size=page_size, filters=filters, cache=False)
+
+    def _export(self, state: Dict[str, Any]) -> None:
+        csv_path = self._dir() / f"{state['id']}.csv"
+        with open(csv_path, "a+b") as raw:
+            raw.truncate(state["bytes"])  # drop rows written after the last checkpoint
+
+        page_size = int(getattr(config, "EXPORT_PAGE_SIZE", 200))
+        max_pages = int(getattr(config, "EXPORT_MAX_PAGES", 2000))
+        concurrency = max(1, int(getattr(config, "EXPORT_CONCURRENCY", 3)))
+        limiter = RateLimiter(float(getattr(config, "EXPORT_MAX_CALLS_PER_SECOND", 2)))
+
+        # utf-8-sig: Excel needs the BOM to read CJK text; it is only written at offset 0.
+        with open(csv_path, "a", newline="", encoding="utf-8-sig") as fh, \
+                ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="export-page") as pool:
+            writer = csv.DictWriter(fh, fieldnames=COLUMNS, extrasaction="ignore")
+            if state["bytes"] == 0:
+                writer.writeheader()
+            kinds = state["kinds"]
+            for kind in kinds[kinds.index(state["cursor"]["kind"]):]:
+                mapper = self._mappers[kind]
+                filters = self._filters(kind, state["params"])
+                page = state["cursor"]["page"] if state["cursor"]["kind"] == kind else 1
+                in_flight: Dict[int, "Future[Dict[str, Any]]"] = {}
+                next_page = page
+                while page <= max_pages:
+                    while len(in_flight) < concurrency and next_page <= max_pages:
+                        in_flight[next_page] = pool.submit(
+                            tenants.bind(self._fetch_page), limiter, kind, next_page, page_size, filters
+                        )
+                        next_page += 1
+                    response = in_flight.pop(page).result()
+                    data = response.get("data") or {}
+                    batch = data.get("recordList", []) or []
+                    written = 0
+                    for record in batch:
+                        row = mapper(record, state["params"])
+                        if row is not None:
+                            writer.writerow(row)
+                            written += 1
+                    fh.flush()
+
+                    progress = state["progress"][kind]
+                    progress["pages"] += 1
+                    progress["records"] += len(batch)
+                    progress["total"] = data.get("recordCount") or data.get("totalCount") or progress["total"]
+                    state["rows"] += written
+                    state["bytes"] = fh.buffer.tell()
+                    page += 1
+                    last_page = len(batch) < page_size
+                    state["cursor"] = {"kind": kind, "page": page}
+                    if last_page:
+                        for future in in_flight.values():
+                            future.cancel()
+                        following = kinds.index(kind) + 1
+                        if following < len(kinds):
+                            state["cursor"] = {"kind": kinds[following], "page": 1}
+                    self._save(state)
+                    if last_page:
+                        break
+
+    def _convert_to_xlsx(self, job_id: str) -> None:
+        from openpyxl import Workbook
+
+        csv_path = self._dir() / f"{job_id}.csv"
+        xlsx_path = self._dir() / f"{job_id}.xlsx"
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("export")
+        with open(csv_path, newline="", encoding="utf-8-sig") as fh:
+            for row in csv.reader(fh):
+                sheet.append(row)
+        workbook.save(str(xlsx_path))
+        csv_path.unlink(missing_ok=True)
+
+
+def summarize(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a job (no internal cursor or byte offsets)."""
+    progress = state.get("progress") or {}
+    percent: Optional[float] = None
+    totals: List[Tuple[int, int]] = [
+        (item.get("records") or 0, item.get("total") or 0) for item in progress.values()
+    ]
+    if totals and all(total for _, total in totals):
+        percent = round(100 * sum(done for done, _ in totals) / sum(total for _, total in totals), 1)
+    if state.get("status") == "done":
+        percent = 100.0
+    return {
+        "jobId": state.get("id"),
+        "status": state.get("status"),
+        "format": state.get("format"),
+        "params": state.get("params"),
+        "rows": state.get("rows"),
+        "progress": progress,
+        "percent": percent,
+        "error": state.get("error"),
+        "createdAt": state.get("createdAt"),
+        "updatedAt": state.get("updatedAt"),
+        "finishedAt": state.get("finishedAt"),
+    }
+
+
+EXPORT_JOBS = ExportJobs()
@@ -0,0 +1,219 @@
+"""Adaptive gateway timeouts and hedged requests for idempotent queries.
+
+Every gateway attempt feeds a rolling per-path latency window (the last
+``GATEWAY_LATENCY_SAMPLES`` attempts; a timed-out attempt counts as its
+timeout). Once a path has ``GATEWAY_LATENCY_MIN_SAMPLES`` samples, its socket
+timeout is ``p99 * GATEWAY_TIMEOUT_P99_MULTIPLIER``, kept between
+``GATEWAY_TIMEOUT_MIN_SECONDS`` and ``GATEWAY_TIMEOUT_SECONDS`` (and always
+capped by the request deadline). Before that it stays at
+``GATEWAY_TIMEOUT_SECONDS``. Writes (``idempotent=False``) always keep
+``GATEWAY_TIMEOUT_SECONDS``: a slow save that times out may still have been
+stored, and the user's retry would store it twice.
+
+For the list / query paths in ``hedged_paths()``, a call that has not
+answered after the path's p95 gets a duplicate. The first successful answer
+wins, and the slower attempt finishes in the background and is discarded.
+Duplicates are paid from a per-process budget: every hedgeable call earns
+``HEDGE_BUDGET_RATIO`` of a token (up to ``HEDGE_BUDGET_BURST``), and a
+duplicate costs one. So hedging adds at most that fraction of extra gateway
+load, even when the whole gateway is slow.
+
+Only a call that can actually be hedged leaves the caller's thread. Before
+it starts, it reserves a token and two of the ``HEDGE_MAX_THREADS`` pool
+threads (primary and duplicate). Without both, the call runs inline and is
+not hedged. If the primary answers before the p95, the token and the
+duplicate's thread go back. A losing attempt keeps its thread until it ends
+(at most its socket timeout), and that thread stays counted, so slow
+attempts can never queue callers behind the pool.
+
+Latency windows and hedge budgets are kept per tenant (server/tenants.py):
+tenants may sit behind different gateways, and one tenant's hedges must not
+spend another's budget.
+"""
+from __future__ import annotations
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Optional, Set, Tuple, TypeVar
+
+import requests
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import deadline, tenants
+
+T = TypeVar("T")
+
+# (socket timeout seconds) -> response data
+Attempt = Callable[[float], T]
+
+
+def hedged_paths() -> Set[str]:
+    paths = {
+        config.FOLLOWUP_LIST_PATH,
+        getattr(config, "TASK_LIST_PATH", ""),
+        getattr(config, "FOLLOWUP_QUERY_FILES_PATH", ""),
+    }
+    paths.discard("")
+    return paths
+
+
+def quantile(values: Deque[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class GatewayLatency:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._windows: Dict[Tuple[str, str], Deque[float]] = {}
+        self._tokens: Dict[str, float] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        # pool threads reserved by hedged calls, including losing attempts still running
+        self._busy = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def _after_fork(self) -> None:
+        # The parent's executor threads do not exist in the child.
+        self._lock = threading.Lock()
+        self._pool = None
+        self._busy = 0
+
+    # ------------------------------------------------------------- samples
+    def record(self, path: str, seconds: float) -> None:
+        size = max(1, int(getattr(config, "GATEWAY_LATENCY_SAMPLES", 200)))
+        key = (tenants.current().name, path)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window.maxlen != size:
+                window = self._windows[key] = deque(window or (), maxlen=size)
+            window.append(seconds)
+
+    def _quantile(self, path: str, q: float) -> Optional[float]:
+        with self._lock:
+            window = self._windows.get((tenants.current().name, path))
+            if not window or len(window) < int(getattr(config, "GATEWAY_LATENCY_MIN_SAMPLES", 20)):
+                return None
+            return quantile(window, q)
+
+    def timeout(self, path: str) -> float:
+        """Socket timeout for the next attempt on ``path`` (before the deadline cap)."""
+        ceiling = float(getattr(config, "GATEWAY_TIMEOUT_SECONDS", 15))
+        p99 = self._quantile(path, 0.99)
+        if p99 is None:
+            return ceiling
+        floor = float(getattr(config, "GATEWAY_TIMEOUT_MIN_SECONDS", 3))
+        return max(floor, min(ceiling, p99 * float(getattr(config, "GATEWAY_TIMEOUT_P99_MULTIPLIER", 3))))
+
+    def hedge_delay(self, path: str) -> Optional[float]:
+        if not getattr(config, "HEDGE_ENABLED", True) or path not in hedged_paths():
+            return None
+        return self._quantile(path, 0.95)
+
+    # -------------------------------------------------------------- budget
+    def _earn(self) -> None:
+        tenant = tenants.current().name
+        with self._lock:
+            self._tokens[tenant] = min(
+                float(getattr(config, "HEDGE_BUDGET_BURST", 5)),
+                self._tokens.get(tenant, 0.0) + float(getattr(config, "HEDGE_BUDGET_RATIO", 0.05)),
+            )
+
+    @staticmethod
+    def _max_threads() -> int:
+        return max(2, int(getattr(config, "HEDGE_MAX_THREADS", 8)))
+
+    def _reserve(self) -> bool:
+        """Take a hedge token and two pool threads, or nothing (the call then runs inline)."""
+        tenant = tenants.current().name
+        with self._lock:
+            if self._tokens.get(tenant, 0.0) < 1 or self._busy + 2 > self._max_threads():
+                return False
+            self._tokens[tenant] -= 1
+            self._busy += 2
+            return True
+
+    def _unreserve(self) -> None:
+        """The primary answered in time: return the token and the duplicate's thread."""
+        tenant = tenants.current().name
+        with self._lock:
+            self._tokens[tenant] = min(
+                float(getattr(config, "HEDGE_BUDGET_BURST", 5)), self._tokens.get(tenant, 0.0) + 1
+            )
+            self._busy -= 1
+
+    def _release_thread(self, _future: "Future[T]") -> None:
+        with self._lock:
+            self._busy -= 1
+
+    # ---------------------------------------------------------------- calls
+    def _timed(self, path: str, attempt: Attempt[T], adaptive: bool = True) -> T:
+        ceiling = float(getattr(config, "GATEWAY_TIMEOUT_SECONDS", 15))
+        timeout = deadline.timeout_for(self.timeout(path) if adaptive else ceiling)
+        started = time.monotonic()
+        try:
+            data = attempt(timeout)
+        except requests.Timeout:
+            self.record(path, timeout)
+            raise
+        self.record(path, time.monotonic() - started)
+        return data
+
+    def _submit(self, path: str, attempt: Attempt[T]) -> "Future[T]":
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._max_threads(), thread_name_prefix="gateway-hedge")
+        # 每次嘗試各自複製 context，讓 deadline 在工作執行緒中仍然有效
+        future = self._pool.submit(contextvars.copy_context().run, self._timed, path, attempt)
+        future.add_done_callback(self._release_thread)
+        return future
+
+    def call(self, path: str, attempt: Attempt[T], *, idempotent: bool = True) -> T:
+        """Run ``attempt(timeout)``; hedge it after the path's p95 when the budget and pool allow.
+
+        Non-idempotent calls are never hedged and keep the fixed timeout.
+        """
+        if not idempotent:
+            return self._timed(path, attempt, adaptive=False)
+        delay = self.hedge_delay(path)
+        if delay is None:
+            return self._timed(path, attempt)
+        self._earn()
+        if not self._reserve():
+            return self._timed(path, attempt)
+        primary = self._submit(path, attempt)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            self._unreserve()
+            return primary.result()
+        with self._lock:
+            self.hedges_sent += 1
+        hedge = self._submit(path, attempt)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    data = future.result()
+                except Exception as exc:
+                    error = error or exc
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self.hedges_won += 1
+                return data
+        assert error is not None
+        raise error
+
+
+GATEWAY_LATENCY = GatewayLatency()
+os.register_at_fork(after_in_child=GATEWAY_LATENCY._after_fork)
@@ -0,0 +1,143 @@
+"""Local rejection of customer identifiers that cannot match anything.
+
+``KnownCodeFilter`` is a Bloom filter over every customer code in the replica.
+It is only trusted while the replica has a fresh full sync with no unresolved
+rows, so "not in the filter" means the CRM has no followups or tasks for that
+code. ``NegativeCache`` remembers identifiers whose full lookup came back
+empty for ``NEGATIVE_CACHE_TTL_SECONDS``, so a retried typo or an unknown phone
+number skips the upstream calls. Both are per worker process and per tenant; the short TTL
+bounds how long another worker can miss a save.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import tenants
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str) -> Iterable[int]:
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, value: str) -> None:
+        for pos in self._positions(value):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: object) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(str(value)))
+
+
+class KnownCodeFilter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._filter: Optional[BloomFilter] = None
+        self._checked_at = 0.0
+
+    def _refresh(self) -> None:
+        interval = getattr(config, "KNOWN_CODES_REBUILD_SECONDS", 300)
+        if time.time() - self._checked_at < interval:
+            return
+        with self._lock:
+            if time.time() - self._checked_at < interval:
+                return
+            self._checked_at = time.time()
+            from server.customer_index import CUSTOMER_INDEX
+            from server.replica import REPLICA
+
+            codes = REPLICA.authoritative_codes()
+            if codes is None:
+                self._filter = None
+                return
+            bloom = BloomFilter(
+                int(len(codes) * 1.2) + 100,
+                getattr(config, "KNOWN_CODES_FALSE_POSITIVE_RATE", 0.01),
+            )
+            for code in codes:
+                bloom.add(code.strip().upper())
+            self._filter = bloom
+            # Typo suggestions come from the autocomplete index; teach it every synced code.
+            CUSTOMER_INDEX.add_codes(codes)
+
+    def load(self) -> None:
+        self._refresh()
+
+    def add(self, code: Any) -> None:
+        """Keep a code created or saved locally ahead of the next rebuild."""
+        normalized = str(code or "").strip().upper()
+        bloom = self._filter
+        if normalized and bloom is not None:
+            bloom.add(normalized)
+
+    def definitely_unknown(self, code: Any) -> bool:
+        normalized = str(code or "").strip().upper()
+        if not normalized:
+            return False
+        self._refresh()
+        bloom = self._filter
+        return bloom is not None and normalized not in bloom
+
+
+class NegativeCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def _key(identifier: Any) -> str:
+        return str(identifier or "").strip().upper()
+
+    def get(self, identifier: Any) -> Optional[Dict[str, Any]]:
+        key = self._key(identifier)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            return dict(entry[1])
+
+    def put(self, identifier: Any, payload: Dict[str, Any]) -> None:
+        ttl = getattr(config, "NEGATIVE_CACHE_TTL_SECONDS", 60)
+        key = self._key(identifier)
+        if not key or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, dict(payload))
+            self._entries.move_to_end(key)
+            while len(self._entries) > getattr(config, "NEGATIVE_CACHE_MAX_ENTRIES", 1000):
+                self._entries.popitem(last=False)
+
+    def discard(self, identifiers: Iterable[Any]) -> None:
+        keys = {self._key(identifier) for identifier in identifiers}
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+KNOWN_CODES = tenants.PerTenant(KnownCodeFilter)
+NEGATIVE_CACHE = tenants.PerTenant(NegativeCache)
@@ -0,0 +1,285 @@
+"""Second-level response cache for read-only CRM calls, shared by all workers.
+
+Entries live in a SQLite database (WAL mode) under the local data directory,
+so every gunicorn worker on the host reads the same cache and it survives
+restarts and deploys. Keys are normalized request bodies, TTLs are per API
+path (``L2_CACHE_TTLS``), entries are tagged with the customer codes they
+concern and the codes and CRM ids of the customers in their records for
+write-through invalidation (a phone search page also gets the codes it
+resolves to), and the total size is capped with least-recently-used eviction.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+from server.record_utils import record_customer_code
+
+DB_NAME = "l2_cache.sqlite3"
+# Untagged entries (queries without a customer filter) use this tag.
+UNFILTERED_TAG = "*"
+_ACCESS_TOUCH_SECONDS = 60
+_EVICT_CHECK_EVERY = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_expires ON entries (expires_at);
+CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at);
+
+CREATE TABLE IF NOT EXISTS entry_tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (tag, key)
+);
+CREATE INDEX IF NOT EXISTS idx_entry_tags_key ON entry_tags (key);
+"""
+
+
+def _default_ttls() -> Dict[str, int]:
+    ttls = {
+        config.FOLLOWUP_LIST_PATH: 120,
+        config.CUSTOMER_DETAIL_PATH: 3600,
+        config.CUSTOMER_ADDRESS_LIST_PATH: 3600,
+    }
+    task_path = getattr(config, "TASK_LIST_PATH", "")
+    if task_path:
+        ttls[task_path] = 300
+    return ttls
+
+
+def customer_id_tag(customer_id: Any) -> str:
+    """Tag of a customer detail request, which is keyed by CRM id rather than code."""
+    return f"#{str(customer_id).strip().upper()}"
+
+
+def request_tags(json_body: Optional[Dict[str, Any]],
+                 params: Optional[Dict[str, Any]] = None) -> Set[str]:
+    """Customer codes a request is about (``simpleVOs`` customer filters, ``codeList``, detail ``id``)."""
+    tags: Set[str] = set()
+    if params and params.get("id"):
+        tags.add(customer_id_tag(params["id"]))
+    body = json_body or {}
+    for clause in body.get("simpleVOs") or []:
+        if isinstance(clause, dict) and "customer" in str(clause.get("field") or ""):
+            value = clause.get("value1")
+            # "in" filters carry a list of codes
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, (str, int)) and str(item).strip():
+                    tags.add(str(item).strip().upper())
+    for code in body.get("codeList") or []:
+        if code:
+            tags.add(str(code).strip().upper())
+    return tags or {UNFILTERED_TAG}
+
+
+def response_tags(data: Any) -> Set[str]:
+    """Codes and CRM ids of the customers in a list response.
+
+    A page found by another filter (e.g. a phone ``like`` query) or a save that
+    only knows the customer id still finds the page.
+    """
+    records = (data.get("data") or {}).get("recordList") if isinstance(data, dict) else None
+    if not isinstance(records, list):
+        return set()
+    tags: Set[str] = set()
+    for item in records:
+        if not isinstance(item, dict):
+            continue
+        code = record_customer_code(item)
+        if code:
+            tags.add(code)
+        if isinstance(item.get("customer"), (str, int)) and str(item["customer"]).strip():
+            tags.add(customer_id_tag(item["customer"]))
+    return tags
+
+
+class L2Cache:
+    def __init__(self, db_name: str = DB_NAME) -> None:
+        self._db_name = db_name
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._puts = 0
+
+    def enabled(self) -> bool:
+        return bool(getattr(config, "L2_CACHE_ENABLED", True))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(local_store.data_path(self._db_name)), timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(_SCHEMA)
+                    self._schema_ready = True
+        return conn
+
+    def _after_fork(self) -> None:
+        # SQLite connections must not be used across a fork.
+        self._local = threading.local()
+
+    def open(self) -> None:
+        """Open this thread's connection (and the schema) ahead of the first lookup."""
+        if self.enabled():
+            self._connect()
+
+    def ttl_for(self, path: str) -> int:
+        ttls = _default_ttls()
+        ttls.update(getattr(config, "L2_CACHE_TTLS", {}) or {})
+        return int(ttls.get(path, 0))
+
+    @staticmethod
+    def make_key(method: str, path: str, params: Optional[Dict[str, Any]],
+                 json_body: Optional[Dict[str, Any]]) -> str:
+        normalized = json.dumps(
+            {
+                "method": method.upper(),
+                "path": path,
+                "params": {k: v for k, v in (params or {}).items() if k != "access_token"},
+                "body": json_body or {},
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at <= now:
+            return None
+        if now - accessed_at > _ACCESS_TOUCH_SECONDS:
+            with conn:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def put(self, key: str, path: str, value: Dict[str, Any], tags: Iterable[str]) -> None:
+        ttl = self.ttl_for(path)
+        if ttl <= 0:
+            return
+        encoded = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, path, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, path, encoded, len(encoded), now + ttl, now),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO entry_tags (tag, key, path) VALUES (?, ?, ?)",
+                [(tag, key, path) for tag in tags],
+            )
+        self._puts += 1
+        if self._puts % _EVICT_CHECK_EVERY == 0:
+            self.evict()
+
+    def add_tags(self, existing: Iterable[str], customer_codes: Iterable[str], *,
+                 paths: Optional[List[str]] = None) -> int:
+        """Also tag entries carrying an ``existing`` tag with ``customer_codes`` (resolved after the call)."""
+        sources = {str(tag).strip().upper() for tag in existing if tag}
+        tags = {str(code).strip().upper() for code in customer_codes if code}
+        if not sources or not tags:
+            return 0
+        sql = f"SELECT DISTINCT key, path FROM entry_tags WHERE tag IN ({','.join('?' * len(sources))})"
+        params: List[Any] = list(sources)
+        if paths:
+            sql += f" AND path IN ({','.join('?' * len(paths))})"
+            params.extend(paths)
+        conn = self._connect()
+        with conn:
+            entries = conn.execute(sql, params).fetchall()
+            conn.executemany(
+                "INSERT OR IGNORE INTO entry_tags (tag, key, path) VALUES (?, ?, ?)",
+                [(tag, key, path) for key, path in entries for tag in tags],
+            )
+        return len(entries)
+
+    def invalidate(self, customer_codes: Iterable[str], *, paths: Optional[List[str]] = None,
+                   include_unfiltered: bool = True) -> int:
+        """Drop entries tagged with ``customer_codes`` (and untagged list queries) on ``paths``."""
+        tags = {str(code).strip().upper() for code in customer_codes if code}
+        if include_unfiltered:
+            tags.add(UNFILTERED_TAG)
+        if not tags:
+            return 0
+        conn = self._connect()
+        tag_marks = ",".join("?" * len(tags))
+        sql = f"SELECT DISTINCT key FROM entry_tags WHERE tag IN ({tag_marks})"
+        params: List[Any] = list(tags)
+        if paths:
+            sql += f" AND path IN ({','.join('?' * len(paths))})"
+            params.extend(paths)
+        with conn:
+            keys = [row[0] for row in conn.execute(sql, params)]
+            self._delete_keys(conn, keys)
+        return len(keys)
+
+    @staticmethod
+    def _delete_keys(conn: sqlite3.Connection, keys: List[str]) -> None:
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM entries WHERE key IN ({marks})", chunk)
+            conn.execute(f"DELETE FROM entry_tags WHERE key IN ({marks})", chunk)
+
+    def evict(self) -> None:
+        """Remove expired entries, then least-recently-used ones above ``L2_CACHE_MAX_BYTES``."""
+        max_bytes = int(getattr(config, "L2_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+        conn = self._connect()
+        with conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT key FROM entries WHERE expires_at <= ?", (time.time(),)
+            )]
+            self._delete_keys(conn, expired)
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= max_bytes:
+                return
+            target = int(max_bytes * 0.9)
+            victims: List[str] = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+                if total <= target:
+                    break
+                victims.append(key)
+                total -= size
+            self._delete_keys(conn, victims)
+
+    def clear(self) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM entry_tags")
+
+
+L2_CACHE = tenants.PerTenant(L2Cache)
+os.register_at_fork(after_in_child=L2_CACHE._after_fork)
@@ -0,0 +1,81 @@
+"""Small helpers for JSON snapshots stored next to the server."""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import tenants
+
+DEFAULT_DATA_DIR = Path(__file__).resolve().parent / "data"
+TENANT_DIR_NAME = "tenants"
+
+
+def data_dir() -> Path:
+    """返回本地資料目錄（索引快照、快取等），必要時自動建立；其他租戶各用一個子目錄。"""
+    configured = os.getenv("MAQUA_DATA_DIR") or getattr(config, "LOCAL_DATA_DIR", None)
+    path = Path(configured) if configured else DEFAULT_DATA_DIR
+    tenant = tenants.current()
+    if not tenant.is_default:
+        path = path / TENANT_DIR_NAME / tenant.name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def data_path(name: str) -> Path:
+    return data_dir() / name
+
+
+def load_json(name: str, default: Any = None) -> Any:
+    path = data_path(name)
+    try:
+        with path.open("r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError):
+        # A truncated or corrupt snapshot is rebuilt from live data.
+        return default
+
+
+def save_json(name: str, payload: Any) -> None:
+    """Atomically replace a snapshot so concurrent readers never see half a file."""
+    path = data_path(name)
+    fd, tmp_name = tempfile.mkstemp(prefix=path.name, suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(payload, fh, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def snapshot_mtime(name: str) -> Optional[float]:
+    try:
+        return data_path(name).stat().st_mtime
+    except OSError:
+        return None
+
+
+@contextmanager
+def locked(name: str) -> Iterator[None]:
+    """Exclusive lock shared by every worker on the host, for read-merge-write of one snapshot."""
+    with data_path(name + ".lock").open("a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
@@ -0,0 +1,153 @@
+"""Bulk maintenance scheduling for every customer at once.
+
+The rules mirror ``_extract_maintenance_summary`` / ``_select_task_base_date``
+in ``server.app`` (which stay the per-customer reference), but run as NumPy
+``datetime64`` arithmetic over all visits and tasks instead of a Python loop
+per customer.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# (customer_code, follow date) of a maintenance followup
+Visit = Tuple[str, date]
+# (customer_code, task base date, owner keyword matched)
+Task = Tuple[str, date, bool]
+
+# Days are shifted into a positive range so that (rank, day) pairs can be packed
+# into one int64 key and reduced with a single ``np.minimum.at``.
+_DAY_OFFSET = 1 << 20
+_DAY_SPAN = 1 << 21
+_RANK_SCALE = 1 << 22
+_NO_KEY = np.iinfo(np.int64).max
+
+
+@dataclass
+class CustomerSchedule:
+    customer_code: str
+    latest_index: Optional[int]
+    latest: Optional[date]
+    previous: Optional[date]
+    next: Optional[date]
+
+
+def _to_days(values: Sequence[date]) -> np.ndarray:
+    return np.array(values, dtype="datetime64[D]").astype(np.int64)
+
+
+def _from_day(value: int) -> date:
+    return np.datetime64(int(value), "D").astype(object)
+
+
+def compute_schedules(
+    visits: Sequence[Visit],
+    tasks: Sequence[Task],
+    *,
+    today: Optional[date] = None,
+    max_gap_days: Optional[int] = None,
+) -> List[CustomerSchedule]:
+    """Compute latest / previous / next maintenance dates per customer.
+
+    ``latest_index`` points into ``visits`` so callers can read the customer
+    name or owner of the record the dates were taken from.
+    """
+    today_day = int(_to_days([today or date.today()])[0])
+
+    visit_codes = [code for code, _ in visits]
+    task_codes = [code for code, _, _ in tasks]
+    universe, inverse = np.unique(np.array(visit_codes + task_codes, dtype=str), return_inverse=True)
+    size = len(universe)
+    visit_cust = inverse[:len(visit_codes)]
+    task_cust = inverse[len(visit_codes):]
+
+    latest_pos = np.full(size, -1, dtype=np.int64)
+    latest_day = np.zeros(size, dtype=np.int64)
+    previous_day = np.zeros(size, dtype=np.int64)
+    has_latest = np.zeros(size, dtype=bool)
+    has_previous = np.zeros(size, dtype=bool)
+
+    if len(visits):
+        visit_days = _to_days([day for _, day in visits])
+        order_index = np.arange(len(visits))
+        # customer asc, date desc, original order asc == list.sort(reverse=True) per customer
+        order = np.lexsort((order_index, -visit_days, visit_cust))
+        cust_sorted = visit_cust[order]
+        days_sorted = visit_days[order]
+        count = len(order)
+        starts = np.flatnonzero(np.r_[True, cust_sorted[1:] != cust_sorted[:-1]])
+        ends = np.r_[starts[1:], count]
+
+        positions = np.where(days_sorted <= today_day, np.arange(count), count)
+        first_past = np.minimum.reduceat(positions, starts)
+        chosen = np.where(first_past < ends, first_past, starts)
+        group_cust = cust_sorted[starts]
+
+        latest_pos[group_cust] = order[chosen]
+        latest_day[group_cust] = days_sorted[chosen]
+        has_latest[group_cust] = True
+        following = chosen + 1
+        prev_ok = following < ends
+        previous_day[group_cust[prev_ok]] = days_sorted[following[prev_ok]]
+        has_previous[group_cust[prev_ok]] = True
+
+    task_key = np.full(size, _NO_KEY, dtype=np.int64)
+    upcoming_key = np.full(size, _NO_KEY, dtype=np.int64)
+    if len(tasks):
+        task_days = _to_days([day for _, day, _ in tasks])
+        task_general = ~np.array([owner for _, _, owner in tasks], dtype=bool)
+
+        # Buckets of _select_task_base_date, owner-matched tasks first:
+        # future (after today) -> after latest visit -> past (latest past wins).
+        cust_latest = latest_day[task_cust]
+        future_today = task_days > today_day
+        future_latest = ~future_today & has_latest[task_cust] & (task_days > cust_latest)
+        rank = np.where(future_today, 0, np.where(future_latest, 2, 4)) + task_general
+        shifted = task_days + _DAY_OFFSET
+        packed = np.where(rank < 4, shifted, _DAY_SPAN - shifted)
+        np.minimum.at(task_key, task_cust, rank * _RANK_SCALE + packed)
+
+        # Customers without maintenance visits use the earliest upcoming task.
+        upcoming = task_days >= today_day
+        if max_gap_days is not None:
+            upcoming &= task_days - today_day <= int(max_gap_days)
+        np.minimum.at(
+            upcoming_key,
+            task_cust[upcoming],
+            task_general[upcoming] * _RANK_SCALE + shifted[upcoming],
+        )
+
+    schedules: List[CustomerSchedule] = []
+    for cust, code in enumerate(universe.tolist()):
+        if has_latest[cust]:
+            latest = _from_day(latest_day[cust])
+            previous = _from_day(previous_day[cust]) if has_previous[cust] else None
+            next_date: Optional[date] = None
+            key = int(task_key[cust])
+            if key != _NO_KEY:
+                bucket, value = divmod(key, _RANK_SCALE)
+                day = value if bucket < 4 else _DAY_SPAN - value
+                next_date = _from_day(day - _DAY_OFFSET)
+            schedules.append(CustomerSchedule(
+                customer_code=code,
+                latest_index=int(latest_pos[cust]),
+                latest=latest,
+                previous=previous,
+                next=next_date or previous or latest,
+            ))
+        else:
+            key = int(upcoming_key[cust])
+            next_date = None
+            if key != _NO_KEY:
+                next_date = _from_day(key % _RANK_SCALE - _DAY_OFFSET)
+            schedules.append(CustomerSchedule(
+                customer_code=code,
+                latest_index=None,
+                latest=None,
+                previous=None,
+                next=next_date,
+            ))
+    return schedules
@@ -215,5 +215,4 @@ def generate_mock_query_files_response(business_id: str) -> Dict[str, Any]:
         "data": files
     }
 
-# 模擬數據開關
-USE_MOCK_DATA = False  # 設置為True使用模擬數據，False使用真實API
+# 模擬數據開關：config.USE_MOCK_DATA（True 使用模擬數據；關閉時本模組不會被載入）
@@ -0,0 +1,236 @@
+"""Local index from normalized phone numbers to customer codes.
+
+The snapshot is shared by every worker on the host. Each code carries the
+time its phones were last read (``refreshedAt``) and, once a change event
+made them stale, the time of that event (``expiredAt``). A save merges under
+a file lock, keeping the newest of both per code, so phones learned or
+expired by other workers are never overwritten. Between saves each worker
+picks up the other workers' entries when the snapshot changes, checked at
+most every ``LOCAL_INDEX_RELOAD_SECONDS``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+
+SNAPSHOT_NAME = "phone_index.json"
+PHONE_FIELDS = ("mobile", "telePhone")
+OWNER_CODE_FIELDS = ("merchantCode", "merchant_code", "customerCode", "customer_code")
+
+
+def normalize_phone(value: Any) -> str:
+    """Reduce a phone number to its significant digits (country prefix removed)."""
+    if value in (None, ""):
+        return ""
+    digits = "".join(ch for ch in str(value) if ch.isdigit())
+    if digits.startswith("00"):
+        digits = digits[2:]
+    # 香港/澳門 8 碼、內地 11 碼手機，去除國碼後再比對
+    if len(digits) == 11 and digits[:3] in {"852", "853"}:
+        digits = digits[3:]
+    elif len(digits) == 13 and digits.startswith("86"):
+        digits = digits[2:]
+    if len(digits) < 6:
+        return ""
+    return digits
+
+
+class PhoneIndex:
+    """normalized phone -> customer codes, refreshed per code from address data."""
+
+    def __init__(self, snapshot_name: str = SNAPSHOT_NAME) -> None:
+        self._lock = threading.RLock()
+        self._snapshot_name = snapshot_name
+        self._phones: Dict[str, Set[str]] = {}
+        self._code_phones: Dict[str, Set[str]] = {}
+        self._refreshed_at: Dict[str, float] = {}
+        self._expired_at: Dict[str, float] = {}
+        self._dirty = False
+        self._loaded = False
+        self._snapshot_mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def load(self) -> None:
+        self._ensure_loaded()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            self._reload_if_changed()
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._snapshot_mtime = local_store.snapshot_mtime(self._snapshot_name)
+            self._adopt(local_store.load_json(self._snapshot_name, {}) or {})
+            self._checked_at = time.time()
+            self._loaded = True
+
+    def _reload_if_changed(self) -> None:
+        now = time.time()
+        if now - self._checked_at < float(getattr(config, "LOCAL_INDEX_RELOAD_SECONDS", 10)):
+            return
+        self._checked_at = now
+        mtime = local_store.snapshot_mtime(self._snapshot_name)
+        if mtime == self._snapshot_mtime:
+            return
+        snapshot = local_store.load_json(self._snapshot_name, {}) or {}
+        with self._lock:
+            self._adopt(snapshot)
+            self._snapshot_mtime = mtime
+
+    def _adopt(self, snapshot: Dict[str, Any]) -> None:
+        """Take over the snapshot's phones and expiries where they are newer than ours."""
+        for code, entry in (snapshot.get("codes") or {}).items():
+            expired_at = float(entry.get("expiredAt") or 0)
+            if expired_at > self._expired_at.get(code, 0):
+                self._expired_at[code] = expired_at
+            refreshed_at = float(entry.get("refreshedAt") or 0)
+            if code in self._code_phones and refreshed_at <= self._refreshed_at.get(code, 0):
+                continue
+            self._replace(code, set(entry.get("phones") or []))
+            self._refreshed_at[code] = refreshed_at
+
+    def _replace(self, code: str, phones: Set[str]) -> None:
+        for phone in self._code_phones.get(code, set()) - phones:
+            owners = self._phones.get(phone)
+            if owners:
+                owners.discard(code)
+                if not owners:
+                    del self._phones[phone]
+        for phone in phones:
+            self._phones.setdefault(phone, set()).add(code)
+        self._code_phones[code] = set(phones)
+
+    def lookup(self, phone: str) -> List[str]:
+        """Return the customer codes registered for ``phone`` (sorted, may be empty)."""
+        key = normalize_phone(phone)
+        if not key:
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            return sorted(self._phones.get(key, ()))
+
+    def observe_addresses(self, addresses: Iterable[Dict[str, Any]],
+                          requested_codes: Optional[Iterable[str]] = None) -> int:
+        """Record phones from ``get_addresses_by_codes`` / ``merchantAddressInfos`` entries.
+
+        A code is treated as fully refreshed (phones that no longer appear in its
+        addresses are dropped) when it is the only requested code or at least one
+        entry names it; in a multi-code batch, entries without an owner code
+        cannot be attributed, so the other codes keep their indexed phones.
+        """
+        self._ensure_loaded()
+        requested = [str(code).strip().upper() for code in (requested_codes or []) if code]
+        fallback_code = requested[0] if len(requested) == 1 else ""
+        collected: Dict[str, Set[str]] = {fallback_code: set()} if fallback_code else {}
+        for entry in addresses or []:
+            if not isinstance(entry, dict):
+                continue
+            code = ""
+            for key in OWNER_CODE_FIELDS:
+                if entry.get(key):
+                    code = str(entry[key]).strip().upper()
+                    break
+            code = code or fallback_code
+            if not code:
+                continue
+            phones = collected.setdefault(code, set())
+            for field in PHONE_FIELDS:
+                normalized = normalize_phone(entry.get(field))
+                if normalized:
+                    phones.add(normalized)
+
+        now = time.time()
+        with self._lock:
+            for code, phones in collected.items():
+                if self._code_phones.get(code) != phones:
+                    self._replace(code, phones)
+                self._refreshed_at[code] = now
+            if collected:
+                self._dirty = True
+        return len(collected)
+
+    def observe_detail(self, detail_data: Dict[str, Any]) -> None:
+        """Record phones from a ``get_customer_detail`` payload."""
+        code = str((detail_data or {}).get("code") or "").strip().upper()
+        if not code:
+            return
+        addresses = detail_data.get("merchantAddressInfos") or []
+        if isinstance(addresses, list) and addresses:
+            self.observe_addresses(addresses, [code])
+
+    def stale_codes(self, codes: Iterable[str]) -> List[str]:
+        self._ensure_loaded()
+        max_age = getattr(config, "PHONE_INDEX_REFRESH_SECONDS", 6 * 3600)
+        now = time.time()
+        stale: List[str] = []
+        with self._lock:
+            for code in codes:
+                normalized = str(code or "").strip().upper()
+                if not normalized or normalized in stale:
+                    continue
+                refreshed_at = self._refreshed_at.get(normalized, 0)
+                if now - refreshed_at > max_age or refreshed_at <= self._expired_at.get(normalized, 0):
+                    stale.append(normalized)
+        return stale
+
+    def expire(self, codes: Iterable[str]) -> None:
+        """Mark codes as stale so the next ``refresh`` re-reads their addresses."""
+        self._ensure_loaded()
+        now = time.time()
+        with self._lock:
+            for code in codes:
+                normalized = str(code or "").strip().upper()
+                if normalized in self._refreshed_at:
+                    self._expired_at[normalized] = now
+                    self._dirty = True
+
+    def _entry(self, code: str) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {
+            "phones": sorted(self._code_phones[code]),
+            "refreshedAt": self._refreshed_at.get(code, 0),
+        }
+        if code in self._expired_at:
+            entry["expiredAt"] = self._expired_at[code]
+        return entry
+
+    def refresh(self, codes: Iterable[str], client: Any) -> int:
+        """Re-read addresses for stale ``codes`` in ``codeList`` batches."""
+        stale = self.stale_codes(codes)
+        batch_size = max(int(getattr(config, "PHONE_INDEX_BATCH_SIZE", 50)), 1)
+        refreshed = 0
+        for start in range(0, len(stale), batch_size):
+            batch = stale[start:start + batch_size]
+            response = client.get_addresses_by_codes(batch)
+            addresses = response.get("data") or []
+            if isinstance(addresses, dict):
+                addresses = addresses.get("recordList") or addresses.get("list") or []
+            refreshed += self.observe_addresses(addresses, batch)
+        if refreshed:
+            self.save()
+        return refreshed
+
+    def save(self) -> None:
+        """Merge this worker's changes into the shared snapshot (under a file lock) and write it."""
+        with self._lock:
+            if not self._dirty:
+                return
+        with local_store.locked(self._snapshot_name):
+            snapshot = local_store.load_json(self._snapshot_name, {}) or {}
+            with self._lock:
+                self._adopt(snapshot)
+                self._dirty = False
+                payload = {"codes": {code: self._entry(code) for code in self._code_phones}}
+            local_store.save_json(self._snapshot_name, payload)
+            self._snapshot_mtime = local_store.snapshot_mtime(self._snapshot_name)
+
+
+PHONE_INDEX = tenants.PerTenant(PhoneIndex)
@@ -0,0 +1,178 @@
+"""Streaming ZIP archives of customer photos.
+
+``stream_zip`` takes a lazy iterable of ``ExportEntry`` (archive name plus
+signed URL) and yields the ZIP bytes while the archive is being built.
+Downloads run ``workers`` at a time, at most ``2 * workers`` ahead of the file
+being written. Each download is spooled to a temporary file (kept in memory
+only up to ``SPOOL_MAX_MEMORY``), so whole photos are never held in memory.
+Photos are stored uncompressed because JPEG/HEIC data does not shrink.
+Failed downloads, and entries whose photos could not be looked up
+(``ExportEntry.error``), are listed in ``_errors.txt`` at the end of the archive.
+
+Large exports outlive gunicorn's default 30s sync-worker timeout; serve them
+from ``--worker-class gthread`` workers or raise ``--timeout``.
+"""
+from __future__ import annotations
+
+import re
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import IO, Deque, Iterable, Iterator, List, Optional, Set, Tuple
+
+import requests
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_MEMORY = 1024 * 1024
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+@dataclass
+class ExportEntry:
+    arcname: str
+    url: str
+    modified: Optional[datetime] = None
+    # Set when the photos could not even be looked up; listed in _errors.txt instead of downloaded.
+    error: Optional[str] = None
+
+
+class ArchiveNames:
+    """Unique, filesystem-safe folder and file names inside one archive."""
+
+    def __init__(self) -> None:
+        self._folders: Set[str] = set()
+        self._files: Set[str] = set()
+
+    @staticmethod
+    def _clean(text: str) -> str:
+        return _UNSAFE_CHARS.sub("_", text).strip(" ._") or "_"
+
+    @staticmethod
+    def _unique(name: str, used: Set[str], split_ext: bool = False) -> str:
+        stem, ext = name, ""
+        if split_ext and "." in name:
+            stem, ext = name.rsplit(".", 1)
+            ext = "." + ext
+        candidate = name
+        counter = 2
+        while candidate.lower() in used:
+            candidate = f"{stem}_{counter}{ext}"
+            counter += 1
+        used.add(candidate.lower())
+        return candidate
+
+    def folder(self, follow_time: Optional[str], fallback: str) -> str:
+        """``2025-06-02 10:00:00`` -> ``2025-06-02_100000``."""
+        text = str(follow_time or "").strip().replace("T", " ")
+        name = text.replace(":", "").replace(" ", "_") if text else f"unknown_{fallback}"
+        return self._unique(self._clean(name), self._folders)
+
+    def file(self, folder: str, file_name: Optional[str], fallback: str) -> str:
+        name = self._clean(str(file_name)) if file_name else fallback
+        return self._unique(f"{folder}/{name}", self._files, split_ext=True)
+
+
+class _ZipSink:
+    """Write-only, non-seekable target for ``zipfile`` whose bytes are drained by the generator."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def buffered(self) -> int:
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _download(session: requests.Session, url: str, timeout: float) -> IO[bytes]:
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        with session.get(url, stream=True, timeout=timeout) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
+
+
+def _zip_info(entry: ExportEntry, size: int) -> zipfile.ZipInfo:
+    modified = entry.modified if entry.modified and entry.modified.year >= 1980 else datetime.now()
+    info = zipfile.ZipInfo(entry.arcname, date_time=modified.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = size
+    return info
+
+
+def stream_zip(entries: Iterable[ExportEntry], *, workers: int = 4, timeout: float = 30) -> Iterator[bytes]:
+    sink = _ZipSink()
+    failures: List[str] = []
+    source = iter(entries)
+    pending: Deque[Tuple[ExportEntry, "Future[IO[bytes]]"]] = deque()
+    workers = max(1, workers)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    with session, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="photo-export") as pool:
+        archive = zipfile.ZipFile(sink, "w")  # type: ignore[arg-type]
+        try:
+            def _fill() -> None:
+                while len(pending) < workers * 2:
+                    entry = next(source, None)
+                    if entry is None:
+                        return
+                    if entry.error:
+                        failed: "Future[IO[bytes]]" = Future()
+                        failed.set_exception(RuntimeError(entry.error))
+                        pending.append((entry, failed))
+                    else:
+                        pending.append((entry, pool.submit(_download, session, entry.url, timeout)))
+
+            _fill()
+            while pending:
+                entry, future = pending.popleft()
+                try:
+                    spool = future.result()
+                except Exception as exc:
+                    failures.append(f"{entry.arcname}\t{exc}")
+                else:
+                    with spool:
+                        size = spool.seek(0, 2)
+                        spool.seek(0)
+                        with archive.open(_zip_info(entry, size), "w") as dest:
+                            for chunk in iter(lambda: spool.read(CHUNK_SIZE), b""):
+                                dest.write(chunk)
+                                if sink.buffered() >= CHUNK_SIZE * 4:
+                                    yield sink.drain()
+                yield sink.drain()
+                _fill()
+            if failures:
+                archive.writestr("_errors.txt", "\n".join(failures) + "\n")
+        finally:
+            for _, future in pending:
+                future.cancel()
+            archive.close()
+    yield sink.drain()
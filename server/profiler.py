@@ -0,0 +1,209 @@
+"""Opt-in profiling of single API requests.
+
+A request to an ``/api/`` route is profiled when it sends ``X-Profile: 1`` (or
+``?_profile=1``) together with an ``X-Profile-Token`` header matching
+``PROFILER_TOKEN`` (or the ``MAQUA_PROFILER_TOKEN`` environment variable).
+Without a token the profiler is off. Profiles are rate limited per worker.
+
+``sample`` mode (the default) samples the request thread's stack every
+``PROFILER_SAMPLE_INTERVAL_MS`` and writes folded stacks (``.folded``), the
+input format of flamegraph.pl and speedscope. ``cprofile`` mode runs the
+deterministic ``cProfile`` and writes a ``.pstats`` file. Each profile also
+gets a ``.json`` sidecar with the upstream gateway calls made during the
+request, so Python time and gateway time can be told apart. Only the newest
+``PROFILER_MAX_PROFILES`` profiles are kept in ``<data dir>/profiles``.
+"""
+from __future__ import annotations
+
+import contextvars
+import cProfile
+import hmac
+import json
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store
+
+logger = logging.getLogger(__name__)
+
+MODES = ("sample", "cprofile")
+PROFILE_DIR_NAME = "profiles"
+
+
+def _frame_label(code: Any) -> str:
+    path = Path(code.co_filename)
+    return f"{code.co_name} ({path.parent.name}/{path.name}:{code.co_firstlineno})"
+
+
+class _StackSampler:
+    """Counts the folded call stacks of one thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.stacks: Counter = Counter()
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            labels: List[str] = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+
+
+class ProfileSession:
+    def __init__(self, mode: str, label: str) -> None:
+        self.id = secrets.token_hex(6)
+        self.mode = mode
+        self.label = label
+        self.calls: List[Dict[str, Any]] = []
+        self._started = time.monotonic()
+        self._started_at = datetime.now()
+        self._sampler: Optional[_StackSampler] = None
+        self._profile: Optional[cProfile.Profile] = None
+
+    def start(self) -> None:
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            interval = float(getattr(config, "PROFILER_SAMPLE_INTERVAL_MS", 5)) / 1000
+            self._sampler = _StackSampler(threading.get_ident(), interval)
+            self._sampler.start()
+
+    def record_call(self, path: str, elapsed: float, error: Optional[BaseException]) -> None:
+        self.calls.append({
+            "path": path,
+            "startMs": round((time.monotonic() - elapsed - self._started) * 1000, 1),
+            "elapsedMs": round(elapsed * 1000, 1),
+            "error": str(error) if error else None,
+        })
+
+    def finish(self, directory: Path, status: Optional[str]) -> Path:
+        duration = time.monotonic() - self._started
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+
+        stem = f"{self._started_at:%Y%m%d-%H%M%S}-{self.id}"
+        if self._profile is not None:
+            self._profile.dump_stats(str(directory / f"{stem}.pstats"))
+        if self._sampler is not None:
+            lines = [f"{stack} {count}" for stack, count in self._sampler.stacks.most_common()]
+            (directory / f"{stem}.folded").write_text("\n".join(lines) + "\n", "utf-8")
+
+        upstream = sum(call["elapsedMs"] for call in self.calls)
+        meta = {
+            "id": self.id,
+            "mode": self.mode,
+            "request": self.label,
+            "status": status,
+            "startedAt": self._started_at.isoformat(timespec="seconds"),
+            "durationMs": round(duration * 1000, 1),
+            "upstreamMs": round(upstream, 1),
+            "localMs": round(max(0.0, duration * 1000 - upstream), 1),
+            "upstreamCalls": self.calls,
+        }
+        meta_path = directory / f"{stem}.json"
+        meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), "utf-8")
+        return meta_path
+
+
+_current: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar(
+    "profile_session", default=None
+)
+
+
+class RequestProfiler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._recent: Deque[float] = deque()
+        self._active = 0
+
+    def configure(self, client: Any) -> None:
+        client.add_call_listener(self._on_upstream_call)
+
+    def _on_upstream_call(self, path: str, elapsed: float, error: Optional[BaseException]) -> None:
+        session = _current.get()
+        if session is not None:
+            session.record_call(path, elapsed, error)
+
+    @staticmethod
+    def _token() -> str:
+        return os.getenv("MAQUA_PROFILER_TOKEN") or getattr(config, "PROFILER_TOKEN", "") or ""
+
+    def begin(self, flag: str, token: str, label: str) -> Tuple[Optional[ProfileSession], str]:
+        """Start profiling the current request; returns ``(session, reason)``."""
+        expected = self._token()
+        if not expected or not hmac.compare_digest(expected.encode(), (token or "").encode()):
+            return None, "unauthorized"
+        mode = flag if flag in MODES else "sample"
+        per_minute = int(getattr(config, "PROFILER_MAX_PER_MINUTE", 6))
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if self._active or len(self._recent) >= per_minute:
+                return None, "rate-limited"
+            self._recent.append(now)
+            self._active += 1
+        session = ProfileSession(mode, label)
+        _current.set(session)
+        session.start()
+        return session, "started"
+
+    def end(self, session: ProfileSession, status: Optional[str] = None) -> Optional[Path]:
+        _current.set(None)
+        try:
+            directory = local_store.data_path(PROFILE_DIR_NAME)
+            directory.mkdir(parents=True, exist_ok=True)
+            path = session.finish(directory, status)
+            self._prune(directory)
+            logger.info("[Profiler] %s written to %s", session.label, path)
+            return path
+        except Exception:  # pragma: no cover - profiling must not break requests
+            logger.exception("[Profiler] failed to write profile %s", session.id)
+            return None
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    @staticmethod
+    def _prune(directory: Path) -> None:
+        keep = int(getattr(config, "PROFILER_MAX_PROFILES", 40))
+        stems: Dict[str, List[Path]] = {}
+        for path in directory.iterdir():
+            stems.setdefault(path.stem, []).append(path)
+        # Stems start with the timestamp, so name order is age order.
+        for stem in sorted(stems)[:-keep]:
+            for path in stems[stem]:
+                path.unlink(missing_ok=True)
+
+
+PROFILER = RequestProfiler()
@@ -0,0 +1,39 @@
+"""Record helpers shared by the Flask app and the local data stores."""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict
+
+# 標準化用友客戶代碼的偵測（本專案中常見如 C3770、C402 等）
+CODE_TOKEN_RE = re.compile(r"\bC\d{2,}\b", re.IGNORECASE)
+
+
+def extract_nested(source: Dict[str, Any], path: str) -> Any:
+    if not path:
+        return None
+    current: Any = source
+    for part in path.split('.'):
+        if not isinstance(current, dict):
+            return None
+        current = current.get(part)
+        if current is None:
+            return None
+    return current
+
+
+def record_customer_code(item: Dict[str, Any]) -> str:
+    """Best-effort customer code of a followup or task record ("" when unknown)."""
+    for key in ("customer_code", "customerCode"):
+        value = item.get(key)
+        if value:
+            return str(value).strip().upper()
+    nested = extract_nested(item, "customer.code")
+    if isinstance(nested, str) and nested.strip():
+        return nested.strip().upper()
+    for key in ("customer_name", "customerName"):
+        name_val = item.get(key)
+        if isinstance(name_val, str) and name_val:
+            match = CODE_TOKEN_RE.search(name_val.upper())
+            if match:
+                return match.group(0)
+    return ""
@@ -0,0 +1,489 @@
+"""Incremental local SQLite replica of CRM followups and tasks.
+
+A sync pulls records whose watermark field (``REPLICA_WATERMARK_FIELD``,
+``pubts`` by default) is at or after the last seen value, so each run only
+transfers what changed. Read paths ask the replica first and fall back to the
+live API whenever the data is older than ``REPLICA_MAX_STALENESS_SECONDS``,
+and a customer's reads also go live while rows stored without a customer
+code (an id not mapped yet) could belong to that customer.
+
+A periodic full pass (no watermark filter) also drops rows deleted upstream,
+but only when it reached the last page. A pass cut short by
+``REPLICA_MAX_PAGES`` deletes nothing and does not count as a full sync, so
+the next run tries again.
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import local_store, tenants
+from server.record_utils import record_customer_code
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = "replica.sqlite3"
+KINDS = ("followups", "tasks")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS followups (
+    id TEXT PRIMARY KEY,
+    customer_code TEXT NOT NULL,
+    customer_id TEXT,
+    owner TEXT,
+    follow_time TEXT,
+    watermark TEXT,
+    payload TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_followups_customer ON followups (customer_code, follow_time);
+CREATE INDEX IF NOT EXISTS idx_followups_customer_id ON followups (customer_id);
+CREATE INDEX IF NOT EXISTS idx_followups_owner ON followups (owner);
+CREATE INDEX IF NOT EXISTS idx_followups_follow_time ON followups (follow_time);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    customer_code TEXT NOT NULL,
+    customer_id TEXT,
+    owner TEXT,
+    start_date TEXT,
+    watermark TEXT,
+    payload TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_customer ON tasks (customer_code, start_date);
+CREATE INDEX IF NOT EXISTS idx_tasks_customer_id ON tasks (customer_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_owner ON tasks (owner);
+CREATE INDEX IF NOT EXISTS idx_tasks_start_date ON tasks (start_date);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    kind TEXT PRIMARY KEY,
+    watermark TEXT,
+    synced_at REAL,
+    full_synced_at REAL
+);
+
+-- customer id -> code, learned from customer detail lookups
+CREATE TABLE IF NOT EXISTS customer_ids (
+    customer_id TEXT PRIMARY KEY,
+    customer_code TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS customer_sync (
+    customer_code TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (customer_code, kind)
+);
+"""
+
+
+def _record_id(item: Dict[str, Any]) -> str:
+    return str(item.get(getattr(config, "FOLLOWUP_ID_FIELD", "id")) or item.get("id") or "")
+
+
+def _task_date(item: Dict[str, Any]) -> Optional[str]:
+    for key in ("startDate", "planDate", "endDate"):
+        value = item.get(key)
+        if value:
+            return str(value)
+    return None
+
+
+class FollowupReplica:
+    """SQLite store (WAL mode) shared by every worker on the host."""
+
+    def __init__(self, db_name: str = DB_NAME) -> None:
+        self._db_name = db_name
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._sync_thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------ storage
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(local_store.data_path(self._db_name)), timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(_SCHEMA)
+                    self._schema_ready = True
+        return conn
+
+    def _after_fork(self) -> None:
+        # SQLite connections must not be used across a fork.
+        self._local = threading.local()
+
+    def open(self) -> None:
+        """Open this thread's connection (and the schema) ahead of the first lookup."""
+        if self.enabled():
+            self._connect()
+
+    @contextmanager
+    def _sync_lock(self) -> Iterator[bool]:
+        """Cross-process lock so only one gunicorn worker syncs at a time."""
+        path = local_store.data_path(self._db_name + ".lock")
+        with open(path, "w") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def enabled(self) -> bool:
+        return bool(getattr(config, "REPLICA_ENABLED", False))
+
+    def upsert(self, kind: str, records: List[Dict[str, Any]], *, synced_at: Optional[float] = None,
+               default_code: str = "") -> int:
+        """Insert or replace records; returns how many had a usable id.
+
+        Records whose code cannot be derived are resolved through ``customer_ids``
+        (or ``default_code`` for exact-code queries) and otherwise kept with an
+        empty code until ``remember_customer_id`` learns it.
+        """
+        watermark_field = getattr(config, "REPLICA_WATERMARK_FIELD", "pubts")
+        now = synced_at or time.time()
+        conn = self._connect()
+        id_map: Dict[str, str] = {}
+        customer_ids = {str(item.get("customer")) for item in records
+                        if isinstance(item.get("customer"), (str, int)) and item.get("customer")}
+        if customer_ids:
+            placeholders = ",".join("?" * len(customer_ids))
+            id_map = dict(conn.execute(
+                f"SELECT customer_id, customer_code FROM customer_ids WHERE customer_id IN ({placeholders})",
+                tuple(customer_ids),
+            ).fetchall())
+        default_code = str(default_code or "").strip().upper()
+        rows = []
+        for item in records:
+            record_id = _record_id(item)
+            if not record_id:
+                continue
+            customer_id = str(item.get("customer") or "") or None
+            code = record_customer_code(item) or id_map.get(customer_id or "", "") or default_code
+            owner = str(item.get("ower_name") or "") or None
+            when = item.get("followTime") if kind == "followups" else _task_date(item)
+            watermark = item.get(watermark_field)
+            rows.append((record_id, code, customer_id, owner, str(when) if when else None,
+                         str(watermark) if watermark else None,
+                         json.dumps(item, ensure_ascii=False), now))
+        if not rows:
+            return 0
+        date_column = "follow_time" if kind == "followups" else "start_date"
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {kind} "
+                f"(id, customer_code, customer_id, owner, {date_column}, watermark, payload, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def delete(self, kind: str, record_ids: Iterable[Any]) -> int:
+        """Remove records deleted upstream (pushed change events)."""
+        ids = [str(record_id) for record_id in record_ids if record_id]
+        if not ids or not self.enabled():
+            return 0
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                f"DELETE FROM {kind} WHERE id IN ({','.join('?' * len(ids))})", ids
+            )
+        return cursor.rowcount
+
+    def remember_customer_id(self, customer_id: Any, customer_code: Any) -> None:
+        """Map a CRM customer id to its code and back-fill rows stored without one."""
+        cust_id = str(customer_id or "").strip()
+        code = str(customer_code or "").strip().upper()
+        if not cust_id or not code or not self.enabled():
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO customer_ids (customer_id, customer_code) VALUES (?, ?)",
+                (cust_id, code),
+            )
+            for kind in KINDS:
+                conn.execute(
+                    f"UPDATE {kind} SET customer_code = ? WHERE customer_id = ? AND customer_code = ''",
+                    (code, cust_id),
+                )
+
+    def _state(self, kind: str) -> Dict[str, Any]:
+        row = self._connect().execute(
+            "SELECT watermark, synced_at, full_synced_at FROM sync_state WHERE kind = ?", (kind,)
+        ).fetchone()
+        return dict(row) if row else {"watermark": None, "synced_at": None, "full_synced_at": None}
+
+    # -------------------------------------------------------------------- reads
+    def is_fresh(self, kind: str, customer_code: Optional[str] = None) -> bool:
+        """True when the whole table, or this customer's rows, were synced recently."""
+        if not self.enabled():
+            return False
+        max_age = getattr(config, "REPLICA_MAX_STALENESS_SECONDS", 300)
+        now = time.time()
+        customer_synced_at: Optional[float] = None
+        if customer_code:
+            row = self._connect().execute(
+                "SELECT synced_at FROM customer_sync WHERE customer_code = ? AND kind = ?",
+                (customer_code.strip().upper(), kind),
+            ).fetchone()
+            if row:
+                customer_synced_at = row["synced_at"]
+                if customer_synced_at < 0:  # invalidated by a local save
+                    return False
+        state = self._state(kind)
+        if state.get("full_synced_at") and state.get("synced_at") and now - state["synced_at"] <= max_age:
+            return True
+        return customer_synced_at is not None and now - customer_synced_at <= max_age
+
+    def _rows(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        return [json.loads(row["payload"]) for row in self._connect().execute(sql, params)]
+
+    def get_followups(self, customer_code: str, page: int = 1, page_size: int = 20) -> Optional[Dict[str, Any]]:
+        """Response-shaped followup page for ``customer_code``, or None when stale."""
+        code = str(customer_code or "").strip().upper()
+        if not code or not self.is_fresh("followups", code):
+            return None
+        offset = max(page - 1, 0) * page_size
+        records = self._rows(
+            "SELECT payload FROM followups WHERE customer_code = ? "
+            "ORDER BY follow_time DESC LIMIT ? OFFSET ?",
+            (code, page_size, offset),
+        )
+        if self._has_unresolved("followups", code):
+            # Some of the customer's rows may be stored under a not-yet-mapped customer id.
+            return None
+        return {
+            "code": "200",
+            "data": {"recordList": records},
+            "_meta": {"searchField": "customer.code", "source": "replica"},
+        }
+
+    def _has_unresolved(self, kind: str, customer_code: Optional[str] = None) -> bool:
+        """Whether rows without a code exist (that could belong to ``customer_code``).
+
+        Unresolved rows carry ids missing from ``customer_ids``, so once the
+        customer's own id is mapped only rows without any id could be its own.
+        """
+        if customer_code is None:
+            return self._connect().execute(
+                f"SELECT 1 FROM {kind} WHERE customer_code = '' LIMIT 1"
+            ).fetchone() is not None
+        return self._connect().execute(
+            f"SELECT 1 FROM {kind} WHERE customer_code = '' AND (customer_id IS NULL "
+            "OR NOT EXISTS (SELECT 1 FROM customer_ids WHERE customer_code = ?)) LIMIT 1",
+            (customer_code,),
+        ).fetchone() is not None
+
+    def get_tasks(self, customer_code: str, page_size: int = 50) -> Optional[List[Dict[str, Any]]]:
+        code = str(customer_code or "").strip().upper()
+        if not code or not self.is_fresh("tasks", code):
+            return None
+        records = self._rows(
+            "SELECT payload FROM tasks WHERE customer_code = ? ORDER BY start_date DESC LIMIT ?",
+            (code, page_size),
+        )
+        if self._has_unresolved("tasks", code):
+            return None
+        return records
+
+    def customer_records(self, kind: str, customer_code: str) -> Optional[List[Dict[str, Any]]]:
+        """Every replicated record of one customer, or None when stale or possibly incomplete."""
+        code = str(customer_code or "").strip().upper()
+        if not code or not self.is_fresh(kind, code) or self._has_unresolved(kind, code):
+            return None
+        return self._rows(f"SELECT payload FROM {kind} WHERE customer_code = ?", (code,))
+
+    def tasks_between(self, start_day: str, end_day: str) -> Optional[List[Dict[str, Any]]]:
+        """Tasks whose base date falls in [start_day, end_day) (ISO dates), None when stale."""
+        if not self.is_fresh("tasks"):
+            return None
+        return self._rows(
+            "SELECT payload FROM tasks WHERE start_date >= ? AND start_date < ? ORDER BY start_date",
+            (start_day, end_day),
+        )
+
+    def all_records(self, kind: str) -> Optional[List[Dict[str, Any]]]:
+        """Every replicated record of ``kind`` (None unless a full sync is fresh)."""
+        if not self.is_fresh(kind):
+            return None
+        return self._rows(f"SELECT payload FROM {kind}", ())
+
+    def code_for_customer_id(self, customer_id: Any) -> str:
+        cust_id = str(customer_id or "").strip()
+        if not cust_id or not self.enabled():
+            return ""
+        row = self._connect().execute(
+            "SELECT customer_code FROM customer_ids WHERE customer_id = ?", (cust_id,)
+        ).fetchone()
+        return row[0] if row else ""
+
+    def known_codes(self) -> List[str]:
+        if not self.enabled():
+            return []
+        rows = self._connect().execute(
+            "SELECT customer_code FROM followups UNION SELECT customer_code FROM tasks"
+        )
+        return [row[0] for row in rows if row[0]]
+
+    def authoritative_codes(self) -> Optional[List[str]]:
+        """Every code with followups or tasks, or None unless a fresh full sync covers them all."""
+        kinds = [kind for kind in KINDS if kind != "tasks" or getattr(config, "TASK_LIST_PATH", "")]
+        if not all(self.is_fresh(kind) for kind in kinds):
+            return None
+        # Rows without a resolved code could belong to any customer.
+        if any(self._has_unresolved(kind) for kind in kinds):
+            return None
+        return self.known_codes()
+
+    # -------------------------------------------------------------- write-through
+    def store_customer_page(self, kind: str, customer_code: str, records: List[Dict[str, Any]],
+                            *, complete: bool, exact: bool = False) -> None:
+        """Keep live results; a complete result also marks the customer as fresh.
+
+        ``exact`` means the query matched the code with ``eq``, so every record
+        belongs to ``customer_code`` even when the payload omits it.
+        """
+        if not self.enabled():
+            return
+        code = str(customer_code or "").strip().upper()
+        self.upsert(kind, records, default_code=code if exact else "")
+        if exact and code:
+            # 精確查詢的結果都屬於此客戶：記下其客戶 id，同步拉到的只帶 id 的紀錄也能歸屬
+            for customer_id in {str(item.get("customer")) for item in records
+                                if isinstance(item.get("customer"), (str, int)) and item.get("customer")}:
+                self.remember_customer_id(customer_id, code)
+        if complete and code:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO customer_sync (customer_code, kind, synced_at) VALUES (?, ?, ?)",
+                    (code, kind, time.time()),
+                )
+
+    def invalidate_customer(self, customer_code: str) -> None:
+        """Force the next read for this customer to go live (and refresh the replica)."""
+        code = str(customer_code or "").strip().upper()
+        if not code or not self.enabled():
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO customer_sync (customer_code, kind, synced_at) VALUES (?, ?, -1)",
+                [(code, kind) for kind in KINDS],
+            )
+
+    # --------------------------------------------------------------------- sync
+    def sync_once(self, client: Any) -> Dict[str, Any]:
+        """Pull changes for followups and tasks; skipped while another worker syncs."""
+        report: Dict[str, Any] = {}
+        with self._sync_lock() as acquired:
+            if not acquired:
+                return {"skipped": "sync already running"}
+            for kind in KINDS:
+                if kind == "tasks" and not getattr(config, "TASK_LIST_PATH", ""):
+                    continue
+                report[kind] = self._sync_kind(kind, client)
+        return report
+
+    def _sync_kind(self, kind: str, client: Any) -> Dict[str, Any]:
+        state = self._state(kind)
+        full_interval = getattr(config, "REPLICA_FULL_SYNC_INTERVAL_SECONDS", 24 * 3600)
+        started = time.time()
+        full = not state.get("watermark") or not state.get("full_synced_at") \
+            or started - state["full_synced_at"] > full_interval
+
+        filters: List[Dict[str, Any]] = []
+        if not full:
+            filters = [{
+                "field": getattr(config, "REPLICA_WATERMARK_FIELD", "pubts"),
+                "op": "egt",
+                "value1": state["watermark"],
+            }]
+
+        fetch: Callable[..., Dict[str, Any]]
+        fetch = client.get_followups if kind == "followups" else client.get_tasks
+        page_size = getattr(config, "REPLICA_PAGE_SIZE", 200)
+        max_pages = getattr(config, "REPLICA_MAX_PAGES", 500)
+        watermark_field = getattr(config, "REPLICA_WATERMARK_FIELD", "pubts")
+        watermark = state.get("watermark")
+        pulled = 0
+        complete = False
+        for page in range(1, max_pages + 1):
+            response = fetch("", page=page, page_size=page_size, filters=filters, cache=False)
+            batch = response.get("data", {}).get("recordList", []) or []
+            pulled += self.upsert(kind, batch, synced_at=started)
+            for item in batch:
+                value = item.get(watermark_field)
+                if value and (watermark is None or str(value) > str(watermark)):
+                    watermark = str(value)
+            if len(batch) < page_size:
+                complete = True
+                break
+        if not complete:
+            logger.warning("Replica %s sync stopped at REPLICA_MAX_PAGES=%s before the last page", kind, max_pages)
+
+        conn = self._connect()
+        with conn:
+            if full and complete:
+                # Rows not seen by a full pass that reached the last page were deleted upstream.
+                conn.execute(f"DELETE FROM {kind} WHERE synced_at < ?", (started,))
+            # 未讀到最後一頁的全量同步不算完成：不刪除、保留上次的 full_synced_at，下次重新全量同步
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (kind, watermark, synced_at, full_synced_at) "
+                "VALUES (?, ?, ?, ?)",
+                (kind, watermark, time.time(), started if full and complete else state.get("full_synced_at")),
+            )
+        return {"full": full, "complete": complete, "pulled": pulled, "watermark": watermark}
+
+    def start_background_sync(self, client: Any) -> None:
+        """Run ``sync_once`` every ``REPLICA_SYNC_INTERVAL_SECONDS`` in a daemon thread."""
+        if not self.enabled() or self._sync_thread is not None:
+            return
+        interval = getattr(config, "REPLICA_SYNC_INTERVAL_SECONDS", 120)
+
+        def _loop() -> None:
+            while True:
+                try:
+                    state = self._state("followups")
+                    if not state.get("synced_at") or time.time() - state["synced_at"] >= interval:
+                        self.sync_once(client)
+                except Exception:  # pragma: no cover - keep the loop alive
+                    logger.exception("Replica sync failed")
+                time.sleep(interval)
+
+        self._sync_thread = threading.Thread(target=tenants.bind(_loop), name="replica-sync", daemon=True)
+        self._sync_thread.start()
+
+
+REPLICA = tenants.PerTenant(FollowupReplica)
+os.register_at_fork(after_in_child=REPLICA._after_fork)
+
+
+if __name__ == "__main__":  # pragma: no cover - manual / cron sync
+    from server.crm_client import CRM_CLIENT
+
+    print(json.dumps(REPLICA.sync_once(CRM_CLIENT), ensure_ascii=False))
@@ -0,0 +1,384 @@
+"""Content-hashed, precompressed static files.
+
+Build step (run on deploy, after ``pip install``)::
+
+    python -m server.static_assets
+
+It copies ``style.css`` and everything in ``assets/`` into ``build/static``
+under content-hashed names (``style.3f9c0a1b2d.css``). Text files also get
+``.br`` / ``.gz`` siblings. A ``manifest.json`` maps each original name to
+its hashed copy. At runtime the HTML pages are served with their
+``style.css`` / ``/assets/...`` references rewritten to the hashed URLs.
+Those URLs never change content, so they are served with
+``Cache-Control: immutable`` and the best precompressed sibling the client
+accepts. Without a build, every URL stays unhashed and is served as before.
+
+When Pillow is installed, the build also writes resized variants of every
+image in ``assets/``. Variants come in each width of ``STATIC_IMAGE_WIDTHS``
+narrower than the original, and in WebP / AVIF where Pillow supports them.
+They are listed under the image's ``variants`` in the manifest. A request
+for the image gets the narrowest width that covers the width hint (``?w=``,
+or the ``Sec-CH-Width`` / ``Width`` client hint), in whichever format its
+``Accept`` header allows gives the smallest file. Rewritten ``<img>`` tags get a
+matching ``srcset``.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import mimetypes
+import re
+import shutil
+import sys
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import Response, request, send_file
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import compression
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+MANIFEST_NAME = "manifest.json"
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".html", ".json", ".txt"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Precompressed siblings that save less than this are not worth a second file.
+MIN_SAVING_RATIO = 0.9
+# "style.css" / "/assets/x.jpg" inside attributes, inline styles and scripts
+_REFERENCE_RE = re.compile(r"""(?<=["'(])/?(style\.css|assets/[^"'()\s?#]+)""")
+_IMG_TAG_RE = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+_IMG_SRC_RE = re.compile(r"""\ssrc=["']/?(assets/[^"'?#]+)["']""")
+RESIZABLE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+# format name -> (file suffix, MIME type, Pillow save options), most preferred first
+MODERN_FORMATS = {
+    "avif": (".avif", "image/avif", {"quality": 55, "speed": 8}),
+    "webp": (".webp", "image/webp", {"quality": 78, "method": 4}),
+}
+
+
+def build_dir() -> Path:
+    return ROOT_DIR / getattr(config, "STATIC_BUILD_DIR", "build/static")
+
+
+def _source_files() -> List[str]:
+    names = ["style.css"]
+    assets = ROOT_DIR / "assets"
+    if assets.is_dir():
+        names.extend(
+            path.relative_to(ROOT_DIR).as_posix()
+            for path in sorted(assets.rglob("*"))
+            if path.is_file() and not path.name.startswith(".")
+        )
+    return names
+
+
+def _hashed_name(name: str, digest: str) -> str:
+    path = Path(name)
+    return (path.parent / f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+
+def build(target: Optional[Path] = None) -> Dict[str, Any]:
+    """Write hashed copies, compressed siblings and the manifest; returns the manifest."""
+    target = target or build_dir()
+    target.mkdir(parents=True, exist_ok=True)
+    files: Dict[str, Dict[str, Any]] = {}
+    for name in _source_files():
+        source = ROOT_DIR / name
+        if not source.is_file():
+            continue
+        data = source.read_bytes()
+        hashed = _hashed_name(name, hashlib.sha256(data).hexdigest()[:10])
+        output = target / hashed
+        output.parent.mkdir(parents=True, exist_ok=True)
+        if not output.exists():
+            shutil.copyfile(source, output)
+        encodings: List[str] = []
+        if source.suffix.lower() in COMPRESSIBLE_SUFFIXES:
+            for encoding in compression.available_encodings():
+                packed = compression.compress(data, encoding, static=True)
+                if len(packed) <= len(data) * MIN_SAVING_RATIO:
+                    Path(f"{output}{compression.SUFFIXES[encoding]}").write_bytes(packed)
+                    encodings.append(encoding)
+        entry: Dict[str, Any] = {"path": hashed, "size": len(data), "encodings": encodings}
+        if source.suffix.lower() in RESIZABLE_SUFFIXES:
+            entry.update(_image_variants(source, hashed, target))
+        files[name] = entry
+
+    manifest = {"files": files}
+    keep = {target / MANIFEST_NAME}
+    for entry in files.values():
+        keep.add(target / entry["path"])
+        keep.update(Path(f"{target / entry['path']}{compression.SUFFIXES[enc]}") for enc in entry["encodings"])
+        keep.update(target / variant["path"] for variant in entry.get("variants", []))
+    for path in target.rglob("*"):
+        if path.is_file() and path not in keep:
+            path.unlink()
+    tmp = target / f".{MANIFEST_NAME}.tmp"
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), "utf-8")
+    tmp.replace(target / MANIFEST_NAME)
+    return manifest
+
+
+def _pillow() -> Optional[Any]:
+    """Pillow's ``PIL`` package, imported on first use: only the build step needs it."""
+    try:
+        import PIL.Image
+        import PIL.ImageOps
+        import PIL.features
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return PIL
+
+
+def _image_formats() -> List[str]:
+    return [name for name in MODERN_FORMATS if _pillow().features.check(name)]
+
+
+def _image_variants(source: Path, hashed: str, target: Path) -> Dict[str, Any]:
+    """Resized / re-encoded copies of one image; ``{}`` without Pillow or for unreadable files."""
+    pil = _pillow()
+    if pil is None:
+        return {}
+    Image, ImageOps = pil.Image, pil.ImageOps
+    try:
+        with Image.open(source) as opened:
+            stored_width, stored_height = opened.size
+            rotated = opened.getexif().get(0x0112) in (5, 6, 7, 8)  # EXIF orientation swaps the sides
+            original_width, original_height = (
+                (stored_height, stored_width) if rotated else (stored_width, stored_height)
+            )
+            widths = sorted(w for w in getattr(config, "STATIC_IMAGE_WIDTHS", (480, 960, 1600)) if w < original_width)
+            # Full-size WebP / AVIF copies of huge originals take minutes to encode; those stay JPEG-only.
+            full_size = original_width * original_height <= getattr(config, "STATIC_IMAGE_MAX_PIXELS", 4_000_000)
+            if not full_size and widths:
+                # Let the JPEG decoder downscale (DCT scaling): only the resized variants are needed.
+                scale = widths[-1] / original_width
+                opened.draft("RGB", (round(stored_width * scale), round(stored_height * scale)))
+            image = ImageOps.exif_transpose(opened)
+            image.load()
+    except (OSError, ValueError) as exc:
+        logger.warning("[Static] cannot read image %s: %s", source, exc)
+        return {}
+
+    original_format = "png" if source.suffix.lower() == ".png" else "jpeg"
+    if full_size:
+        widths.append(original_width)
+    stem = hashed.rsplit(".", 1)[0]  # "assets/banner.1f9351cb78"
+    variants: List[Dict[str, Any]] = []
+    for width in widths:
+        resized = image if width == original_width else image.resize(
+            (width, max(1, round(original_height * width / original_width))), Image.LANCZOS, reducing_gap=3.0
+        )
+        outputs: List[Tuple[str, str, str, Dict[str, Any]]] = [
+            (fmt, *MODERN_FORMATS[fmt]) for fmt in _image_formats()
+        ]
+        if width != original_width:
+            outputs.append((original_format, source.suffix.lower(), f"image/{original_format}",
+                            {"quality": 82, "optimize": True, "progressive": True}))
+        for fmt, suffix, mimetype, options in outputs:
+            path = f"{stem}.{width}w{suffix}"
+            output = target / path
+            if not output.exists():
+                frame = resized
+                if fmt == "jpeg" and frame.mode not in ("RGB", "L"):
+                    frame = frame.convert("RGB")
+                buffer = BytesIO()
+                frame.save(buffer, fmt.upper(), **options)
+                output.write_bytes(buffer.getvalue())
+            variants.append({
+                "path": path,
+                "width": width,
+                "format": fmt,
+                "type": mimetype,
+                "size": output.stat().st_size,
+            })
+    return {"width": original_width, "height": original_height, "variants": variants}
+
+
+class StaticAssets:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._by_hashed: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+    def _manifest(self) -> Dict[str, Dict[str, Any]]:
+        path = build_dir() / MANIFEST_NAME
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return self._files
+        with self._lock:
+            files: Dict[str, Dict[str, Any]] = {}
+            if mtime is not None:
+                try:
+                    files = json.loads(path.read_text("utf-8")).get("files") or {}
+                except (OSError, ValueError) as exc:
+                    logger.warning("[Static] unreadable manifest %s: %s", path, exc)
+            self._files = files
+            self._by_hashed = {}
+            for name, entry in files.items():
+                self._by_hashed[entry["path"]] = (name, entry)
+                for variant in entry.get("variants", []):
+                    self._by_hashed[variant["path"]] = (variant["path"], variant)
+            self._mtime = mtime
+        return files
+
+    def load(self) -> None:
+        self._manifest()
+
+    def url(self, name: str) -> str:
+        entry = self._manifest().get(name.lstrip("/"))
+        return f"/{entry['path']}" if entry else f"/{name.lstrip('/')}"
+
+    def srcset(self, name: str) -> str:
+        """``srcset`` of an image's widths; the format is negotiated per request."""
+        entry = self._manifest().get(name)
+        if not entry or not entry.get("variants"):
+            return ""
+        widths = sorted({variant["width"] for variant in entry["variants"]})
+        return ", ".join(f"/{entry['path']}?w={width} {width}w" for width in widths)
+
+    def _add_srcset(self, match: "re.Match[str]") -> str:
+        tag = match.group(0)
+        src = _IMG_SRC_RE.search(tag)
+        srcset = self.srcset(src.group(1)) if src else ""
+        if not srcset or "srcset=" in tag.lower():
+            return tag
+        sizes = "" if "sizes=" in tag.lower() else ' sizes="100vw"'
+        return f'{tag[:src.end()]} srcset="{srcset}"{sizes}{tag[src.end():]}'
+
+    def rewrite_html(self, text: str) -> str:
+        files = self._manifest()
+        if not files:
+            return text
+        text = _IMG_TAG_RE.sub(self._add_srcset, text)
+        return _REFERENCE_RE.sub(lambda m: self.url(m.group(1)) if m.group(1) in files else m.group(0), text)
+
+    def html_response(self, path: Path) -> Any:
+        """HTML page with hashed asset URLs; revalidated on every load (ETag)."""
+        body = self.rewrite_html(path.read_text("utf-8")).encode("utf-8")
+        encoding = None
+        if len(body) >= int(getattr(config, "COMPRESSION_MIN_BYTES", 1024)):
+            encoding = compression.negotiate(request.accept_encodings, compression.available_encodings())
+        response = Response(body, mimetype="text/html")
+        # Each encoding is a different representation, so it needs its own ETag.
+        etag = hashlib.sha256(body).hexdigest()[:16]
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        response.make_conditional(request)
+        if encoding and response.status_code == 200:
+            response.set_data(compression.compress(body, encoding))
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    def service_worker_response(self, path: Path, pages: List[str], assets: List[str]) -> Any:
+        """``sw.js`` with its precache list filled in; the cache version follows the hashed asset URLs."""
+        template = path.read_text("utf-8")
+        # Pages stay relative to the worker, so a tenant path prefix keeps its own scope.
+        urls = list(pages) + [self.url(name) for name in assets]
+        version = hashlib.sha256((template + "\n".join(urls)).encode("utf-8")).hexdigest()[:12]
+        body = (
+            template.replace("__PRECACHE_URLS__", json.dumps(urls))
+            .replace("__CACHE_VERSION__", version)
+            .encode("utf-8")
+        )
+        response = Response(body, mimetype="text/javascript")
+        response.set_etag(version)
+        # Browsers re-check the worker at most daily on their own; no-cache makes that check a revalidation.
+        response.headers["Cache-Control"] = "no-cache"
+        response.make_conditional(request)
+        return response
+
+    @staticmethod
+    def _width_hint() -> Optional[int]:
+        for value in (request.args.get("w"), request.headers.get("Sec-CH-Width"), request.headers.get("Width")):
+            try:
+                if value and int(value) > 0:
+                    return int(value)
+            except ValueError:
+                continue
+        return None
+
+    def _pick_variant(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Smallest file the client accepts at the narrowest width covering the hint; ``None`` means the original."""
+        accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+        usable = [
+            variant for variant in entry["variants"]
+            if variant["format"] not in MODERN_FORMATS or variant["type"] in accepted
+        ]
+        widths = sorted({variant["width"] for variant in usable} | {entry["width"]})
+        target = self._width_hint() or entry["width"]
+        width = next((w for w in widths if w >= target), widths[-1])
+        best = min((variant for variant in usable if variant["width"] == width),
+                   key=lambda variant: variant["size"], default=None)
+        if width == entry["width"] and (best is None or best["size"] >= entry["size"]):
+            return None
+        return best
+
+    def send(self, hashed: str) -> Optional[Any]:
+        """Serve a content-hashed file, an image variant, or a negotiated variant of an
+        unhashed image name; ``None`` when the build has nothing for ``hashed``."""
+        files = self._manifest()
+        found = self._by_hashed.get(hashed)
+        immutable = found is not None
+        original = files.get(hashed)
+        if found is None and original and original.get("variants"):
+            # Unhashed image URL: still negotiate, but only while the build matches the source.
+            try:
+                if (ROOT_DIR / hashed).stat().st_size == original["size"]:
+                    found = (hashed, original)
+            except OSError:
+                pass
+        if found is None:
+            return None
+        name, entry = found
+        negotiated = bool(entry.get("variants"))
+        if negotiated:
+            variant = self._pick_variant(entry)
+            if variant is not None:
+                name, entry = variant["path"], variant
+        path = build_dir() / entry["path"]
+        mimetype = entry.get("type") or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        encoding = compression.negotiate(request.accept_encodings, entry.get("encodings") or [])
+        if encoding:
+            path = Path(f"{path}{compression.SUFFIXES[encoding]}")
+        if not path.is_file():
+            return None
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if entry.get("encodings"):
+            response.vary.add("Accept-Encoding")
+        if negotiated:
+            response.vary.add("Accept")
+            response.vary.add("Sec-CH-Width")
+            response.headers["Accept-CH"] = "Sec-CH-Width"
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if immutable else "no-cache"
+        return response
+
+
+STATIC_ASSETS = StaticAssets()
+
+
+if __name__ == "__main__":
+    built = build()
+    for original, item in built["files"].items():
+        print(f"{original} -> {item['path']} {' '.join(item['encodings'])}".rstrip())
+        for variant in item.get("variants", []):
+            print(f"    {variant['path']} ({variant['size']} bytes)")
+    if _pillow() is None:
+        print("Pillow is not installed; image variants were skipped", file=sys.stderr)
+    print(f"{len(built['files'])} files written to {build_dir()}", file=sys.stderr)
@@ -0,0 +1,197 @@
+"""Structured, asynchronous logging for the ``server`` loggers.
+
+``install()`` attaches one handler to the ``server`` logger (``app.logger``
+is ``server.app``, and every module logger is ``server.<module>``). The
+request thread only stamps the record with the request id and puts it on a
+bounded queue. A listener thread does the ``%``-formatting and writes one
+JSON object per line to stderr (``LOG_FORMAT = "text"`` for plain lines in
+development). When the queue is full, records are dropped and counted; the
+request thread never blocks on logging.
+
+Each ``/api/`` request gets a correlation id: the caller's ``X-Request-Id``
+when it looks sane, otherwise a random one. The id is echoed in the
+response header and added to every record logged during the request.
+Records logged for a tenant other than the default one also carry its name.
+
+DEBUG records are sampled per request. A request is sampled with
+probability ``LOG_DEBUG_SAMPLE_RATE``, or when it sends ``X-Debug-Log``
+equal to ``LOG_DEBUG_TOKEN`` (or ``MAQUA_LOG_DEBUG_TOKEN``). A sampled
+request logs all its DEBUG records; the others log none. Per-record debug
+calls in hot loops should be guarded with ``debug_on()`` so unsampled
+requests do not even build the record. With ``LOG_LEVEL = "DEBUG"``,
+everything is logged, as before.
+"""
+from __future__ import annotations
+
+import atexit
+import contextvars
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueListener
+from typing import Any, Dict, Optional
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import tenants
+
+ROOT_LOGGER = "server"
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+# Attributes every LogRecord has; anything else came from ``extra=`` and is emitted as a field.
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_debug_sampled: contextvars.ContextVar[bool] = contextvars.ContextVar("debug_sampled", default=False)
+
+
+def _debug_token() -> str:
+    return os.getenv("MAQUA_LOG_DEBUG_TOKEN") or getattr(config, "LOG_DEBUG_TOKEN", "") or ""
+
+
+def _threshold() -> int:
+    level = logging.getLevelName(str(getattr(config, "LOG_LEVEL", "INFO")).upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def begin_request(request_id: Optional[str], debug_flag: Optional[str]) -> str:
+    """Bind the correlation id and the sampling decision to the current request."""
+    rid = request_id if request_id and _REQUEST_ID_RE.match(request_id) else secrets.token_hex(8)
+    _request_id.set(rid)
+    token = _debug_token()
+    flagged = bool(token and debug_flag and hmac.compare_digest(token.encode(), debug_flag.encode()))
+    rate = float(getattr(config, "LOG_DEBUG_SAMPLE_RATE", 0.0))
+    _debug_sampled.set(flagged or (rate > 0 and random.random() < rate))
+    return rid
+
+
+def end_request() -> None:
+    _request_id.set(None)
+    _debug_sampled.set(False)
+
+
+def request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def debug_on() -> bool:
+    """True when DEBUG records of the current request (or thread) will be written."""
+    return _debug_sampled.get() or _threshold() <= logging.DEBUG
+
+
+class _ContextFilter(logging.Filter):
+    """Stamps the request id (and tenant) and lets sampled requests log below LOG_LEVEL.
+
+    Attached to ``HANDLER``, so it runs in ``Handler.handle`` on the thread
+    that logged, before the record is queued. The request id, tenant and
+    sampling flag are context variables of that thread. Moved to the queue
+    listener's thread, the filter would see none of them.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < _threshold() and not _debug_sampled.get():
+            return False
+        record.request_id = _request_id.get()
+        tenant = tenants.current()
+        if not tenant.is_default:
+            record.tenant = tenant.name
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            payload["requestId"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, "request_id", None) or "-"
+        return super().format(record)
+
+
+class AsyncQueueHandler(logging.Handler):
+    """Hands records to a per-process listener thread; formatting happens there."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.dropped = 0
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.queue: "queue.Queue[logging.LogRecord]" = queue.Queue(int(getattr(config, "LOG_QUEUE_SIZE", 10000)))
+        self._listener: Optional[QueueListener] = None
+
+    def _after_fork(self) -> None:
+        # The parent's listener thread does not exist in the child; its queue may hold a locked mutex.
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _ensure_listener(self) -> None:
+        if self._listener is not None:
+            return
+        with self._start_lock:
+            if self._listener is not None:
+                return
+            output = logging.StreamHandler(sys.stderr)
+            if str(getattr(config, "LOG_FORMAT", "json")).lower() == "text":
+                output.setFormatter(_TextFormatter("[%(asctime)s] %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+            else:
+                output.setFormatter(JsonFormatter())
+            listener = QueueListener(self.queue, output)
+            listener.start()
+            self._listener = listener
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        listener = self._listener
+        if listener is not None:
+            listener.stop()  # drains the queue
+            self._listener = None
+
+
+HANDLER = AsyncQueueHandler()
+HANDLER.addFilter(_ContextFilter())
+os.register_at_fork(after_in_child=HANDLER._after_fork)
+atexit.register(HANDLER.flush)
+
+
+def install() -> logging.Logger:
+    """Route the ``server`` loggers through the async handler (idempotent)."""
+    logger = logging.getLogger(ROOT_LOGGER)
+    if HANDLER not in logger.handlers:
+        logger.addHandler(HANDLER)
+        logger.propagate = False
+    sampling = float(getattr(config, "LOG_DEBUG_SAMPLE_RATE", 0.0)) > 0 or bool(_debug_token())
+    # Without sampling, DEBUG calls stop at the level check and never build a record.
+    logger.setLevel(logging.DEBUG if sampling else _threshold())
+    return logger
@@ -0,0 +1,237 @@
+"""Several tenants (brands, each with its own YonBIP app) served by one set of workers.
+
+The module-level settings in ``config`` are the ``default`` tenant. Extra
+tenants are listed in ``TENANTS``. Each entry names the hosts it answers on
+and overrides settings such as ``APP_KEY``, ``APP_SECRET``, ``TENANT_ID``,
+``GATEWAY_URL`` or ``CRM_EVENT_SECRET``. A request is routed to a tenant by
+its ``Host`` header, or by a ``<TENANT_PATH_PREFIX>/<name>/`` path prefix,
+which ``TenantMiddleware`` strips before Flask routes the request.
+
+The current tenant is a context variable, like the request deadline. Services
+that hold tenant data are ``PerTenant`` proxies: one instance per tenant,
+created on first use, so every tenant has its own token, connection pool,
+caches and indexes. File-backed state (SQLite caches, snapshots, admission
+slots, export jobs) is namespaced by ``local_store``, which puts each extra
+tenant under ``<data dir>/tenants/<name>``. Threads start with an empty
+context, so background work is started through ``bind()``.
+
+Credentials never fall back to the default tenant: a tenant without its own
+``APP_KEY`` / ``APP_SECRET`` is a configuration error. Secrets are best set in
+the environment as ``MAQUA_TENANT_<NAME>_APP_SECRET`` (or ``..._CRM_EVENT_SECRET``).
+"""
+from __future__ import annotations
+
+import contextvars
+import functools
+import os
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+DEFAULT_TENANT = "default"
+ENVIRON_KEY = "maqua.tenant"
+# Settings that identify a tenant upstream; extra tenants never inherit them from the default.
+PRIVATE_SETTINGS = frozenset({"APP_KEY", "APP_SECRET", "TENANT_ID", "CRM_EVENT_SECRET"})
+REQUIRED_SETTINGS = ("APP_KEY", "APP_SECRET")
+ENV_SETTINGS = ("APP_SECRET", "CRM_EVENT_SECRET")
+_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class Tenant:
+    name: str
+    hosts: Tuple[str, ...] = ()
+    settings: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def is_default(self) -> bool:
+        return self.name == DEFAULT_TENANT
+
+
+DEFAULT = Tenant(DEFAULT_TENANT)
+
+
+def _build(name: str, entry: Dict[str, Any]) -> Tenant:
+    if not _NAME_RE.match(name) or name == DEFAULT_TENANT:
+        raise ValueError(f"invalid tenant name {name!r}")
+    settings = {key: value for key, value in entry.items() if key.isupper()}
+    for key in ENV_SETTINGS:
+        value = os.getenv(f"MAQUA_TENANT_{name.upper().replace('-', '_')}_{key}")
+        if value:
+            settings[key] = value
+    missing = [key for key in REQUIRED_SETTINGS if not settings.get(key)]
+    if missing:
+        raise ValueError(f"tenant {name!r} has no {', '.join(missing)}")
+    hosts = tuple(str(host).strip().lower() for host in entry.get("hosts") or () if str(host).strip())
+    return Tenant(name, hosts, settings)
+
+
+@functools.lru_cache(maxsize=1)
+def _table() -> Dict[str, Tenant]:
+    table = {DEFAULT_TENANT: DEFAULT}
+    for name, entry in (getattr(config, "TENANTS", {}) or {}).items():
+        table[name] = _build(name, entry or {})
+    return table
+
+
+def all_tenants() -> List[Tenant]:
+    """The default tenant first, then ``TENANTS`` in configuration order."""
+    return list(_table().values())
+
+
+def get(name: str) -> Optional[Tenant]:
+    return _table().get(name)
+
+
+_current: contextvars.ContextVar[Tenant] = contextvars.ContextVar("tenant", default=DEFAULT)
+
+
+def current() -> Tenant:
+    return _current.get()
+
+
+def activate(tenant: Tenant) -> None:
+    """Bind ``tenant`` to the current request; the app sets it back to ``DEFAULT`` on teardown."""
+    _current.set(tenant)
+
+
+@contextmanager
+def use(tenant: Tenant) -> Iterator[Tenant]:
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def bind(fn: Callable[..., T], tenant: Optional[Tenant] = None) -> Callable[..., T]:
+    """``fn`` run under ``tenant`` (default: the current one); for thread targets and pool tasks."""
+    bound = tenant or current()
+
+    @functools.wraps(fn)
+    def _run(*args: Any, **kwargs: Any) -> T:
+        with use(bound):
+            return fn(*args, **kwargs)
+
+    return _run
+
+
+def setting(name: str, default: Any = None) -> Any:
+    """A setting of the current tenant; extra tenants fall back to ``config`` except for ``PRIVATE_SETTINGS``."""
+    tenant = current()
+    if name in tenant.settings:
+        return tenant.settings[name]
+    if not tenant.is_default and name in PRIVATE_SETTINGS:
+        return default
+    return getattr(config, name, default)
+
+
+def path_prefix() -> str:
+    return "/" + str(getattr(config, "TENANT_PATH_PREFIX", "/t") or "/t").strip("/")
+
+
+def resolve(host: str, path: str) -> Tuple[Tenant, str]:
+    """Tenant of a request and the tenant path prefix it was addressed with ("" when routed by host)."""
+    table = _table()
+    prefix = path_prefix() + "/"
+    if len(table) > 1 and path.startswith(prefix):
+        name = path[len(prefix):].split("/", 1)[0]
+        tenant = table.get(name)
+        if tenant is not None and not tenant.is_default:
+            return tenant, prefix + name
+    hostname = host.rsplit(":", 1)[0].strip().lower() if host else ""
+    if hostname:
+        for tenant in table.values():
+            if hostname in tenant.hosts:
+                return tenant, ""
+    return DEFAULT, ""
+
+
+class TenantMiddleware:
+    """Picks the tenant before Flask routes the request and moves a tenant prefix into ``SCRIPT_NAME``."""
+
+    def __init__(self, wsgi_app: Callable[..., Any]) -> None:
+        self.wsgi_app = wsgi_app
+        all_tenants()  # fail at startup, not on the first request, when TENANTS is invalid
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]) -> Any:
+        path = environ.get("PATH_INFO") or "/"
+        tenant, script = resolve(environ.get("HTTP_HOST") or "", path)
+        if script:
+            if path == script:
+                # 頁面以相對路徑呼叫 api/，前綴必須以斜線結尾
+                location = environ.get("SCRIPT_NAME", "") + script + "/"
+                start_response("308 Permanent Redirect", [("Location", location), ("Content-Length", "0")])
+                return [b""]
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + script
+            environ["PATH_INFO"] = path[len(script):]
+        environ[ENVIRON_KEY] = tenant.name
+        return self.wsgi_app(environ, start_response)
+
+
+class PerTenant(Generic[T]):
+    """One ``factory()`` instance per tenant; attribute access goes to the current tenant's.
+
+    Instances are created inside their tenant's context, and ``setup_each``
+    callbacks run on every instance (existing and future) the same way, so
+    wiring such as call listeners reaches every tenant.
+    """
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        self._factory = factory
+        self._instances: Dict[str, T] = {}
+        self._setups: List[Callable[[T], Any]] = []
+        self._lock = threading.RLock()
+
+    def for_tenant(self, tenant: Optional[Tenant] = None) -> T:
+        tenant = tenant or current()
+        instance = self._instances.get(tenant.name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(tenant.name)
+            if instance is None:
+                with use(tenant):
+                    instance = self._factory()
+                    for setup in self._setups:
+                        setup(instance)
+                self._instances[tenant.name] = instance
+        return instance
+
+    def setup_each(self, setup: Callable[[T], Any]) -> None:
+        with self._lock:
+            self._setups.append(setup)
+            for name, instance in list(self._instances.items()):
+                with use(get(name) or DEFAULT):
+                    setup(instance)
+
+    def tenant_instances(self) -> Dict[str, T]:
+        return dict(self._instances)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.RLock()
+        for instance in self._instances.values():
+            after_fork = getattr(instance, "_after_fork", None)
+            if after_fork is not None:
+                after_fork()
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for names the proxy itself lacks; its own fields must not recurse.
+        if name.startswith("__") or name in ("_factory", "_instances", "_setups", "_lock"):
+            raise AttributeError(name)
+        return getattr(self.for_tenant(), name)
+
+    def __contains__(self, item: object) -> bool:
+        return item in self.for_tenant()  # type: ignore[operator]
+
+    def __len__(self) -> int:
+        return len(self.for_tenant())  # type: ignore[arg-type]
@@ -1,6 +1,16 @@
-"""Utilities for retrieving and caching YonBIP access tokens."""
+"""Utilities for retrieving and caching YonBIP access tokens.
+
+Each tenant (server/tenants.py) signs with its own ``APP_KEY`` /
+``APP_SECRET`` and caches its own token. With ``TOKEN_SHARED`` on, a fetched
+token is also written to the tenant's local data directory, so the other
+workers on the host reuse it instead of each signing and fetching their
+own. The fetch runs under a cross-process lock, so a fresh deploy makes one
+token request, not one per worker.
+"""
 from __future__ import annotations
 
+import fcntl
+import os
 import threading
 import time
 from dataclasses import dataclass
@@ -13,6 +23,10 @@ try:
 except ImportError:  # pragma: no cover
     import server.config_example as config  # fallback for development
 
+from server import deadline, local_store, tenants
+
+SHARED_TOKEN_NAME = "gateway_token.json"
+
 
 @dataclass
 class CachedToken:
@@ -21,31 +35,58 @@ class CachedToken:
 
 
 class TokenService:
-    _lock = threading.Lock()
-
     def __init__(self) -> None:
+        self._lock = threading.Lock()
         self._cache: Optional[CachedToken] = None
 
     def get_token(self, *, force_refresh: bool = False) -> str:
         with self._lock:
             if not force_refresh and self._cache and self._cache.expires_at > time.time():
                 return self._cache.token
+            if not getattr(config, "TOKEN_SHARED", True):
+                return self._refresh()
+            with open(local_store.data_path(SHARED_TOKEN_NAME + ".lock"), "w") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    shared = self._load_shared()
+                    # 強制刷新時，若其他 worker 已換過新 token 就直接沿用
+                    if shared and (not force_refresh or not self._cache or shared.token != self._cache.token):
+                        self._cache = shared
+                        return shared.token
+                    token = self._refresh()
+                    local_store.save_json(SHARED_TOKEN_NAME, {"token": token, "expiresAt": self._cache.expires_at})
+                    return token
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _after_fork(self) -> None:
+        # A lock held by the master at fork time would never be released in the child.
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> str:
+        token = self._fetch_token()
+        # The API returns expire seconds (e.g., 7200); subtract a buffer.
+        expire_seconds = getattr(self, "_last_expire", 7200)
+        expires_at = time.time() + max(expire_seconds - 60, 60)
+        self._cache = CachedToken(token=token, expires_at=expires_at)
+        return token
 
-            token = self._fetch_token()
-            # The API returns expire seconds (e.g., 7200); subtract a buffer.
-            expire_seconds = getattr(self, "_last_expire", 7200)
-            expires_at = time.time() + max(expire_seconds - 60, 60)
-            self._cache = CachedToken(token=token, expires_at=expires_at)
-            return token
+    @staticmethod
+    def _load_shared() -> Optional[CachedToken]:
+        payload = local_store.load_json(SHARED_TOKEN_NAME) or {}
+        token, expires_at = payload.get("token"), float(payload.get("expiresAt") or 0)
+        if not token or expires_at <= time.time():
+            return None
+        return CachedToken(token=str(token), expires_at=expires_at)
 
     def _fetch_token(self) -> str:
         timestamp = str(int(time.time() * 1000))
-        params = {"appKey": config.APP_KEY, "timestamp": timestamp}
-        signature = self._build_signature(params, config.APP_SECRET)
+        params = {"appKey": tenants.setting("APP_KEY", ""), "timestamp": timestamp}
+        signature = self._build_signature(params, tenants.setting("APP_SECRET", ""))
         params["signature"] = signature
 
-        url = config.TOKEN_URL.rstrip("/") + config.SELF_APP_TOKEN_PATH
-        resp = requests.get(url, params=params, timeout=10)
+        url = tenants.setting("TOKEN_URL").rstrip("/") + config.SELF_APP_TOKEN_PATH
+        resp = requests.get(url, params=params, timeout=deadline.timeout_for(10))
         resp.raise_for_status()
         data = resp.json()
         if data.get("code") != "00000":
@@ -76,4 +117,5 @@ class TokenService:
         return base64.b64encode(digest).decode("utf-8")
 
 
-TOKEN_SERVICE = TokenService()
+TOKEN_SERVICE = tenants.PerTenant(TokenService)
+os.register_at_fork(after_in_child=TOKEN_SERVICE._after_fork)
@@ -0,0 +1,119 @@
+"""Worker warm-up on boot, reported by ``/healthz/ready``.
+
+``gunicorn.conf.py`` runs ``WARMUP.run()`` in ``post_worker_init``. That
+hook runs on the thread that will serve requests and before the worker
+accepts any. The warm-up fetches (or reuses the shared) gateway token,
+opens ``GATEWAY_WARM_CONNECTIONS`` pooled TLS connections, opens the SQLite
+caches, loads the JSON indexes and the static manifest, and starts the
+background threads (replica sync, nightly cache warmer). A step that fails
+is logged and reported, but does not keep the worker out of rotation: a
+gateway outage must not take down pages that are answered locally. The
+whole run is capped by ``WORKER_WARMUP_TIMEOUT_SECONDS``, which stays below
+the gunicorn worker timeout.
+
+Nothing here runs at import time, so ``gunicorn --preload`` can import the
+app once in the master. With preload, ``preload()`` also runs the
+``shared`` steps there: they only read files into memory, and the workers
+inherit the result copy-on-write. Sockets, SQLite connections and threads
+are only ever opened in the workers.
+
+Outside gunicorn the first request starts the warm-up in a background
+thread, and ``/healthz/ready`` answers 503 until it finishes.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import server.config as config  # type: ignore
+except ImportError:  # pragma: no cover
+    import server.config_example as config  # type: ignore
+
+from server import deadline
+
+logger = logging.getLogger(__name__)
+
+Step = Tuple[str, Callable[[], Any]]
+
+
+class WarmUp:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._steps: List[Step] = []
+        self._shared: List[Step] = []
+        self._done = threading.Event()
+        self._report: List[Dict[str, Any]] = []
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._preloaded = False
+
+    def configure(self, steps: Sequence[Step], shared: Sequence[Step] = ()) -> None:
+        """``shared`` steps must be safe to run before a fork (no sockets, connections or threads)."""
+        self._steps = list(steps)
+        self._shared = list(shared)
+
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def started(self) -> bool:
+        return self._started_at is not None
+
+    def _run_steps(self, steps: Sequence[Step], *, preloaded: bool = False) -> None:
+        for name, step in steps:
+            started = time.monotonic()
+            entry: Dict[str, Any] = {"step": name}
+            if preloaded:
+                entry["preloaded"] = True
+            try:
+                result = step()
+                if result is not None:
+                    entry["result"] = result
+            except Exception as exc:
+                logger.warning("[WarmUp] %s failed: %s", name, exc)
+                # /healthz/ready is public; the message may contain signed gateway URLs.
+                entry["error"] = type(exc).__name__
+            entry["ms"] = round((time.monotonic() - started) * 1000)
+            self._report.append(entry)
+
+    def preload(self) -> None:
+        """Run the shared steps in the gunicorn master (``--preload``)."""
+        self._run_steps(self._shared, preloaded=True)
+        self._preloaded = True
+
+    def run(self) -> None:
+        """Run every step once; later calls wait for the first run instead of repeating it."""
+        if not self._lock.acquire(blocking=False):
+            self._done.wait()
+            return
+        try:
+            if self._done.is_set():
+                return
+            self._started_at = time.time()
+            steps = self._steps if self._preloaded else self._shared + self._steps
+            with deadline.budget(getattr(config, "WORKER_WARMUP_TIMEOUT_SECONDS", 20)):
+                self._run_steps(steps)
+            self._finished_at = time.time()
+            logger.info("[WarmUp] ready in %.2fs", self._finished_at - self._started_at)
+            self._done.set()
+        finally:
+            self._lock.release()
+
+    def start(self) -> None:
+        if self.started():
+            return
+        self._started_at = time.time()
+        threading.Thread(target=self.run, name="warm-up", daemon=True).start()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.ready() else "warming",
+            "startedAt": self._started_at,
+            "finishedAt": self._finished_at,
+            "steps": list(self._report),
+        }
+
+
+WARMUP = WarmUp()
@@ -0,0 +1,274 @@
+// Service worker for the technician pages (served by /sw.js in server/app.py, which fills in
+// PRECACHE_URLS with the current hashed asset URLs and derives VERSION from them).
+//
+// - App shell (pages, style.css, report banner): precached; served from cache, refreshed in the background.
+// - GET api/customers/<code>/followups: stale-while-revalidate, the newest API_MAX_ENTRIES responses.
+// - Photos (signed object-storage URLs): cache-first by path, ignoring the signature, the newest PHOTO_MAX_ENTRIES.
+// - POST api/followups while offline: queued in IndexedDB and replayed when the connection returns.
+const VERSION = '__CACHE_VERSION__';
+const PRECACHE_URLS = __PRECACHE_URLS__;
+
+// Tenants under a path prefix share the origin; keep their caches apart by scope.
+const PREFIX = `maqua:${self.registration.scope}:`;
+const SHELL_CACHE = `${PREFIX}shell-${VERSION}`;
+const STATIC_CACHE = `${PREFIX}static-${VERSION}`;
+const API_CACHE = `${PREFIX}api-${VERSION}`;
+const PHOTO_CACHE = `${PREFIX}photos-${VERSION}`;
+const CURRENT_CACHES = [SHELL_CACHE, STATIC_CACHE, API_CACHE, PHOTO_CACHE];
+
+const API_MAX_ENTRIES = 30;
+const API_MAX_AGE_MS = 24 * 60 * 60 * 1000;
+const STATIC_MAX_ENTRIES = 40;
+// Cross-origin photos are opaque responses; browsers count each one generously against the quota.
+const PHOTO_MAX_ENTRIES = 60;
+const CACHED_AT_HEADER = 'X-SW-Cached-At';
+
+const OUTBOX_DB = `${PREFIX}outbox`;
+const OUTBOX_STORE = 'followups';
+const OUTBOX_SYNC_TAG = 'followup-outbox';
+const OUTBOX_MAX_ATTEMPTS = 5;
+
+self.addEventListener('install', (event) => {
+  event.waitUntil(
+    caches.open(SHELL_CACHE)
+      .then((cache) => cache.addAll(PRECACHE_URLS.map((url) => new Request(url, { cache: 'reload' }))))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil((async () => {
+    const names = await caches.keys();
+    await Promise.all(
+      names
+        .filter((name) => name.startsWith(PREFIX) && !CURRENT_CACHES.includes(name))
+        .map((name) => caches.delete(name))
+    );
+    await self.clients.claim();
+    await replayOutbox();
+  })());
+});
+
+self.addEventListener('fetch', (event) => {
+  const { request } = event;
+  const url = new URL(request.url);
+  const sameOrigin = url.origin === self.location.origin;
+
+  if (request.method === 'POST' && sameOrigin && url.pathname.endsWith('/api/followups')) {
+    event.respondWith(saveFollowup(request));
+    return;
+  }
+  if (request.method !== 'GET') {
+    return;
+  }
+  if (!sameOrigin) {
+    if (request.destination === 'image') {
+      event.respondWith(cachedPhoto(event));
+    }
+    return;
+  }
+  if (/\/api\/customers\/[^/]+\/followups$/.test(url.pathname)) {
+    event.respondWith(followups(event));
+    return;
+  }
+  if (url.pathname.includes('/api/')) {
+    return;
+  }
+  if (request.mode === 'navigate') {
+    event.respondWith(staleWhileRevalidate(event, SHELL_CACHE, { ignoreSearch: true }));
+    return;
+  }
+  if (PRECACHE_URLS.some((entry) => new URL(entry, self.location).href === url.href)) {
+    event.respondWith(staleWhileRevalidate(event, SHELL_CACHE));
+    return;
+  }
+  if (url.pathname.startsWith('/assets/') || url.pathname.endsWith('.css')) {
+    event.respondWith(staleWhileRevalidate(event, STATIC_CACHE, { maxEntries: STATIC_MAX_ENTRIES }));
+  }
+});
+
+self.addEventListener('sync', (event) => {
+  if (event.tag === OUTBOX_SYNC_TAG) {
+    event.waitUntil(replayOutbox());
+  }
+});
+
+self.addEventListener('message', (event) => {
+  if (event.data && event.data.type === 'replay-outbox') {
+    event.waitUntil(replayOutbox());
+  }
+});
+
+// ------------------------------------------------------------------ caching
+
+async function trim(cacheName, maxEntries) {
+  const cache = await caches.open(cacheName);
+  const keys = await cache.keys();
+  // Keys come back in insertion order, and a re-put moves an entry to the end.
+  await Promise.all(keys.slice(0, Math.max(0, keys.length - maxEntries)).map((key) => cache.delete(key)));
+}
+
+async function staleWhileRevalidate(event, cacheName, { ignoreSearch = false, maxEntries = 0 } = {}) {
+  const cache = await caches.open(cacheName);
+  const cached = await cache.match(event.request, { ignoreSearch });
+  const refresh = fetch(event.request).then(async (response) => {
+    if (response.ok) {
+      await cache.put(event.request, response.clone());
+      if (maxEntries) {
+        await trim(cacheName, maxEntries);
+      }
+    }
+    return response;
+  });
+  if (cached) {
+    event.waitUntil(refresh.catch(() => undefined));
+    return cached;
+  }
+  // Offline, an image srcset width (?w=) we never fetched still has its precached original.
+  return refresh.catch(async (error) => (await caches.match(event.request, { ignoreSearch: true })) || Promise.reject(error));
+}
+
+async function stamped(response) {
+  const headers = new Headers(response.headers);
+  headers.set(CACHED_AT_HEADER, new Date().toISOString());
+  return new Response(await response.blob(), { status: response.status, statusText: response.statusText, headers });
+}
+
+async function followups(event) {
+  const cache = await caches.open(API_CACHE);
+  const cached = await cache.match(event.request);
+  const refresh = fetch(event.request).then(async (response) => {
+    // Partial answers (a stage timed out) are not worth keeping.
+    if (response.ok) {
+      const data = await response.clone().json().catch(() => null);
+      if (data && !data.partial) {
+        await cache.put(event.request, await stamped(response.clone()));
+        await trim(API_CACHE, API_MAX_ENTRIES);
+      }
+    }
+    return response;
+  });
+  const cachedAt = cached ? Date.parse(cached.headers.get(CACHED_AT_HEADER) || '') : NaN;
+  if (cached && Date.now() - cachedAt < API_MAX_AGE_MS) {
+    event.waitUntil(refresh.catch(() => undefined));
+    return cached;
+  }
+  // Too old to show first: wait for the network, but still answer offline.
+  return refresh.catch((error) => cached || Promise.reject(error));
+}
+
+async function cachedPhoto(event) {
+  // Signed URLs change on every re-sign while the object behind them does not.
+  const url = new URL(event.request.url);
+  const key = new Request(`${url.origin}${url.pathname}`);
+  const cache = await caches.open(PHOTO_CACHE);
+  const cached = await cache.match(key);
+  if (cached) {
+    return cached;
+  }
+  const response = await fetch(event.request);
+  if (response.ok || response.type === 'opaque') {
+    event.waitUntil(cache.put(key, response.clone()).then(() => trim(PHOTO_CACHE, PHOTO_MAX_ENTRIES)));
+  }
+  return response;
+}
+
+// ------------------------------------------------------------------- outbox
+
+function openOutbox() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open(OUTBOX_DB, 1);
+    open.onupgradeneeded = () => open.result.createObjectStore(OUTBOX_STORE, { keyPath: 'id', autoIncrement: true });
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+async function outbox(mode, action) {
+  const db = await openOutbox();
+  try {
+    return await new Promise((resolve, reject) => {
+      const tx = db.transaction(OUTBOX_STORE, mode);
+      const request = action(tx.objectStore(OUTBOX_STORE));
+      tx.oncomplete = () => resolve(request && request.result);
+      tx.onerror = () => reject(tx.error);
+    });
+  } finally {
+    db.close();
+  }
+}
+
+async function notifyClients(message) {
+  const clients = await self.clients.matchAll({ includeUncontrolled: true });
+  clients.forEach((client) => client.postMessage(message));
+}
+
+async function saveFollowup(request) {
+  const body = await request.clone().text();
+  try {
+    return await fetch(request);
+  } catch (error) {
+    // Network failure only; an HTTP error answer is passed through to the page as is.
+    await outbox('readwrite', (store) => store.add({
+      url: request.url,
+      body,
+      contentType: request.headers.get('Content-Type') || 'application/json',
+      queuedAt: Date.now(),
+      attempts: 0,
+    }));
+    if (self.registration.sync) {
+      await self.registration.sync.register(OUTBOX_SYNC_TAG).catch(() => undefined);
+    }
+    const pending = await outbox('readonly', (store) => store.count());
+    await notifyClients({ type: 'outbox', queued: 1, pending });
+    return new Response(
+      JSON.stringify({ code: 'QUEUED', message: '目前離線，紀錄已暫存，恢復連線後會自動送出。', queued: true, pending }),
+      { status: 202, headers: { 'Content-Type': 'application/json' } }
+    );
+  }
+}
+
+let replaying = null;
+
+function replayOutbox() {
+  // One replay at a time, so a sync event and an "online" message do not send an entry twice.
+  replaying = replaying || sendOutbox().finally(() => { replaying = null; });
+  return replaying;
+}
+
+async function sendOutbox() {
+  const entries = await outbox('readonly', (store) => store.getAll());
+  let sent = 0;
+  let dropped = 0;
+  for (const entry of entries || []) {
+    let response;
+    try {
+      response = await fetch(entry.url, {
+        method: 'POST',
+        body: entry.body,
+        headers: { 'Content-Type': entry.contentType },
+        credentials: 'same-origin',
+      });
+    } catch (error) {
+      break; // still offline; keep the rest in order
+    }
+    if (response.ok || (response.status >= 400 && response.status < 500)) {
+      // Rejected saves (4xx) would fail the same way again.
+      await outbox('readwrite', (store) => store.delete(entry.id));
+      if (response.ok) { sent += 1; } else { dropped += 1; }
+      continue;
+    }
+    entry.attempts += 1;
+    if (entry.attempts >= OUTBOX_MAX_ATTEMPTS) {
+      await outbox('readwrite', (store) => store.delete(entry.id));
+      dropped += 1;
+      continue;
+    }
+    await outbox('readwrite', (store) => store.put(entry));
+    break; // the server is struggling; try again on the next trigger
+  }
+  if (sent || dropped) {
+    const pending = await outbox('readonly', (store) => store.count());
+    await notifyClients({ type: 'outbox', sent, dropped, pending });
+  }
+}
@@ -0,0 +1,63 @@
+"""Shared fixtures: a private data directory and a scripted CRM gateway."""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytest
+
+# Keep the app's local indexes and caches away from real data while importing it.
+os.environ.setdefault("MAQUA_DATA_DIR", tempfile.mkdtemp(prefix="maqua-test-"))
+
+from server import crm_client, tenants  # noqa: E402
+
+Handler = Callable[[Optional[Dict[str, Any]], Optional[Dict[str, Any]]], Any]
+
+
+class FakeGateway:
+    """Stands in for ``CRMClient._send``: answers per path and records every call."""
+
+    def __init__(self) -> None:
+        self.calls: List[Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]] = []
+        self.handlers: Dict[str, Handler] = {}
+
+    def on(self, path: str, handler: Handler) -> None:
+        self.handlers[path] = handler
+
+    def paths(self) -> List[str]:
+        return [path for path, _, _ in self.calls]
+
+    def send(self, method: str, path: str, *, params: Optional[Dict[str, Any]] = None,
+             json_body: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        self.calls.append((path, json_body, params))
+        handler = self.handlers.get(path)
+        data = handler(json_body, params) if handler else {}
+        return {"code": "200", "data": data}
+
+
+def _per_tenant_services() -> List[tenants.PerTenant]:
+    services: Dict[int, tenants.PerTenant] = {}
+    for name, module in list(sys.modules.items()):
+        if name == "server" or name.startswith("server."):
+            for value in list(vars(module).values()):
+                if isinstance(value, tenants.PerTenant):
+                    services[id(value)] = value
+    return list(services.values())
+
+
+@pytest.fixture
+def data_dir(monkeypatch, tmp_path):
+    """A fresh data directory, with every per-tenant service rebuilt inside it."""
+    monkeypatch.setenv("MAQUA_DATA_DIR", str(tmp_path))
+    for service in _per_tenant_services():
+        monkeypatch.setattr(service, "_instances", {})
+    return tmp_path
+
+
+@pytest.fixture
+def gateway(monkeypatch, data_dir):
+    fake = FakeGateway()
+    monkeypatch.setattr(crm_client.CRMClient, "_send", lambda client, *args, **kwargs: fake.send(*args, **kwargs))
+    return fake
@@ -0,0 +1,144 @@
+"""Host-wide gateway slots, fast rejection and the write exemptions."""
+from __future__ import annotations
+
+import contextvars
+import json
+import multiprocessing
+import time
+
+import pytest
+
+from server import app as server_app
+from server import config, crm_events
+from server.admission import ADMISSION, AdmissionRejected
+
+OLD_REQUEST_START = "t=%.3f" % (time.time() - 60)
+
+
+@pytest.fixture(autouse=True)
+def _admission(monkeypatch, data_dir):
+    monkeypatch.setattr(config, "ADMISSION_ENABLED", True, raising=False)
+    monkeypatch.setattr(config, "ADMISSION_MAX_UPSTREAM_REQUESTS", 2, raising=False)
+    monkeypatch.setattr(config, "ADMISSION_SLOW_MAX_UPSTREAM_REQUESTS", 1, raising=False)
+    monkeypatch.setattr(ADMISSION, "_samples", {})
+
+
+def _admit(request_start=None) -> contextvars.Context:
+    """One request (in its own context) that made its first gateway call."""
+    context = contextvars.copy_context()
+    context.run(ADMISSION.begin_request, request_start)
+    context.run(ADMISSION.before_upstream, "/gateway")
+    return context
+
+
+def test_requests_beyond_the_slot_limit_are_rejected_until_one_ends():
+    first, second = _admit(), _admit()
+    with pytest.raises(AdmissionRejected) as rejected:
+        _admit()
+    assert rejected.value.retry_after >= 1
+
+    first.run(ADMISSION.end_request)
+    third = _admit()
+
+    for context in (second, third):
+        context.run(ADMISSION.end_request)
+
+
+def test_only_the_first_gateway_call_of_a_request_takes_a_slot():
+    context = _admit()
+    for _ in range(3):
+        context.run(ADMISSION.before_upstream, "/gateway")
+    other = _admit()
+
+    for held in (context, other):
+        held.run(ADMISSION.end_request)
+
+
+def test_a_slow_gateway_lowers_the_limit():
+    for _ in range(10):
+        ADMISSION._on_upstream_call("/gateway", config.ADMISSION_SLOW_GATEWAY_SECONDS + 1, None)
+    held = _admit()
+
+    with pytest.raises(AdmissionRejected):
+        _admit()
+    held.run(ADMISSION.end_request)
+
+
+def _hold_every_slot(ready, release) -> None:
+    held = [_admit() for _ in range(config.ADMISSION_MAX_UPSTREAM_REQUESTS)]
+    ready.set()
+    release.wait(10)
+    for context in held:
+        context.run(ADMISSION.end_request)
+
+
+def test_slots_are_shared_by_every_worker_on_the_host():
+    fork = multiprocessing.get_context("fork")
+    ready, release = fork.Event(), fork.Event()
+    worker = fork.Process(target=_hold_every_slot, args=(ready, release))
+    worker.start()
+    try:
+        assert ready.wait(10)
+        with pytest.raises(AdmissionRejected):
+            _admit()
+    finally:
+        release.set()
+        worker.join(10)
+    _admit().run(ADMISSION.end_request)
+
+
+def test_a_request_queued_too_long_is_rejected_before_the_gateway():
+    with pytest.raises(AdmissionRejected, match="queued"):
+        _admit(OLD_REQUEST_START)
+
+
+def test_rejected_lookups_answer_503_with_retry_after(gateway):
+    response = server_app.app.test_client().get(
+        "/api/customers/C1/followups", headers={"X-Request-Start": OLD_REQUEST_START}
+    )
+
+    assert response.status_code == 503
+    assert response.get_json()["code"] == "OVERLOADED"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert gateway.calls == []
+
+
+def test_saves_are_not_shed(gateway):
+    held = [_admit() for _ in range(config.ADMISSION_MAX_UPSTREAM_REQUESTS)]
+    try:
+        response = server_app.app.test_client().post(
+            "/api/followups",
+            json={"followContext": "x", "code": "F1", "followTime": "2025-01-01 10:00:00",
+                  "org": "9", "_status": "Insert", "customer_code": "C1"},
+            headers={"X-Request-Start": OLD_REQUEST_START},
+        )
+    finally:
+        for context in held:
+            context.run(ADMISSION.end_request)
+
+    assert response.status_code == 200
+    assert gateway.paths() == [config.FOLLOWUP_SAVE_PATH]
+
+
+def test_crm_events_are_not_shed(monkeypatch, gateway):
+    monkeypatch.setattr(config, "CRM_EVENT_SECRET", "secret", raising=False)
+    monkeypatch.delenv("MAQUA_CRM_EVENT_SECRET", raising=False)
+    begun = []
+    monkeypatch.setattr(ADMISSION, "begin_request", lambda *args: begun.append(args))
+    body = json.dumps({"type": "FOLLOWUP_UPDATE", "id": "e1", "content": {"customer_code": "C1"}}).encode()
+    timestamp = str(int(time.time()))
+
+    response = server_app.app.test_client().post(
+        "/api/crm/events",
+        data=body,
+        content_type="application/json",
+        headers={
+            "X-Event-Timestamp": timestamp,
+            "X-Event-Signature": crm_events.sign("secret", timestamp, body),
+            "X-Request-Start": OLD_REQUEST_START,
+        },
+    )
+
+    assert response.status_code == 200
+    assert begun == []
+    assert server_app.ADMISSION_EXEMPT_ENDPOINTS <= set(server_app.app.view_functions)
@@ -0,0 +1,152 @@
+"""Signed URL expiry parsing and the partial fetches of the attachment cache."""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from server import attachment_cache, config
+from server.attachment_cache import AttachmentCache, url_expiry
+
+SIGNED_AT = datetime(2025, 3, 1, 8, 0, 0, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://oss.example/a.jpg?OSSAccessKeyId=k&Expires=1740816000&Signature=s", 1740816000),
+    ("https://cdn.example/a.jpg?expires=1740816000", 1740816000),
+    ("https://s3.example/a.jpg?X-Amz-Date=20250301T080000Z&X-Amz-Expires=900&X-Amz-Signature=s",
+     SIGNED_AT + 900),
+    ("https://oss.example/a.jpg?x-oss-date=20250301T080000Z&x-oss-expires=3600&x-oss-signature=s",
+     SIGNED_AT + 3600),
+    ("https://blob.example/a.jpg?sv=2022-11-02&se=2025-03-01T08:00:00Z&sig=s", SIGNED_AT),
+    ("https://blob.example/a.jpg?se=2025-03-01T16:00:00%2B08:00&sig=s", SIGNED_AT),
+])
+def test_url_expiry_reads_each_signing_scheme(url, expected):
+    assert url_expiry(url) == expected
+
+
+@pytest.mark.parametrize("url", [
+    "https://files.example/a.jpg",
+    "https://files.example/a.jpg?Expires=soon",
+    "https://s3.example/a.jpg?X-Amz-Date=yesterday&X-Amz-Expires=900",
+    "https://s3.example/a.jpg?X-Amz-Expires=900",
+    "https://blob.example/a.jpg?se=not-a-date",
+])
+def test_url_expiry_is_none_when_the_url_does_not_say(url):
+    assert url_expiry(url) is None
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_750_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch, data_dir):
+    clock = Clock()
+    monkeypatch.setattr(attachment_cache, "time", SimpleNamespace(time=clock.time))
+    monkeypatch.setattr(config, "ATTACHMENT_URL_REFRESH_MARGIN_SECONDS", 120, raising=False)
+    monkeypatch.setattr(config, "ATTACHMENT_URL_DEFAULT_TTL_SECONDS", 600, raising=False)
+    return clock
+
+
+def _file(business_id: str, url: str = "") -> dict:
+    entry = {"fileId": "f" + business_id, "fileName": business_id + ".jpg"}
+    if url:
+        entry["signedUrl"] = url
+    return entry
+
+
+class Gateway:
+    def __init__(self, files) -> None:
+        self.files = files
+        self.requested = []
+
+    def __call__(self, ids):
+        self.requested.append(list(ids))
+        return {"code": "200", "data": {business_id: self.files(business_id) for business_id in ids}}
+
+
+def test_urls_are_refetched_once_inside_the_refresh_margin(clock):
+    cache = AttachmentCache()
+    expires = int(clock.now) + 600
+    gateway = Gateway(lambda business_id: [_file(business_id, f"https://oss.example/x?Expires={expires}")])
+
+    cache.lookup(["A"], gateway)
+    clock.now += 600 - 120 - 1
+    cache.lookup(["A"], gateway)
+    clock.now += 2
+    cache.lookup(["A"], gateway)
+
+    assert gateway.requested == [["A"], ["A"]]
+
+
+def test_urls_without_an_expiry_use_the_default_ttl(clock):
+    cache = AttachmentCache()
+    gateway = Gateway(lambda business_id: [_file(business_id, "https://files.example/x")])
+
+    cache.lookup(["A"], gateway)
+    clock.now += 600 - 120 - 1
+    cache.lookup(["A"], gateway)
+    clock.now += 2
+    cache.lookup(["A"], gateway)
+
+    assert gateway.requested == [["A"], ["A"]]
+
+
+def test_unsigned_files_are_kept_for_good(clock):
+    cache = AttachmentCache()
+    gateway = Gateway(lambda business_id: [_file(business_id)])
+
+    cache.lookup(["A"], gateway)
+    clock.now += 365 * 24 * 3600
+
+    assert cache.lookup(["A"], gateway)["data"] == {"A": [_file("A")]}
+    assert gateway.requested == [["A"]]
+
+
+def test_only_missing_or_expiring_ids_are_fetched_and_answers_are_merged(clock):
+    cache = AttachmentCache()
+    soon, later = int(clock.now) + 300, int(clock.now) + 3600
+    expiry = {"A": later, "B": soon, "C": later}
+    gateway = Gateway(lambda business_id: [
+        _file(business_id, f"https://oss.example/{business_id}?Expires={expiry[business_id]}")
+    ])
+    cache.lookup(["A", "B"], gateway)
+    clock.now += 200  # B's URL is now within the margin, A's is not
+
+    response = cache.lookup(["A", "B", "C", "A"], gateway)
+
+    assert gateway.requested == [["A", "B"], ["B", "C"]]
+    assert sorted(response["data"]) == ["A", "B", "C"]
+    assert response["data"]["A"][0]["signedUrl"] == f"https://oss.example/A?Expires={later}"
+    assert cache.hits == 1 and cache.fetched == 4
+
+
+def test_empty_answers_are_not_cached(clock):
+    cache = AttachmentCache()
+    gateway = Gateway(lambda business_id: [])
+
+    cache.lookup(["A"], gateway)
+    cache.lookup(["A"], gateway)
+
+    assert gateway.requested == [["A"], ["A"]]
+
+
+def test_an_unmergeable_answer_refetches_the_whole_batch(clock):
+    cache = AttachmentCache()
+    cache.lookup(["A"], Gateway(lambda business_id: [_file(business_id)]))
+    requested = []
+
+    def listing(ids):
+        requested.append(list(ids))
+        return {"code": "200", "data": [_file(business_id) for business_id in ids]}
+
+    response = cache.lookup(["A", "B"], listing)
+
+    assert requested == [["B"], ["A", "B"]]
+    assert response["data"] == [_file("A"), _file("B")]
@@ -0,0 +1,42 @@
+"""Several workers sharing one customer index snapshot."""
+from __future__ import annotations
+
+import pytest
+
+from server import config
+from server.customer_index import CustomerIndex
+
+
+@pytest.fixture(autouse=True)
+def _data_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("MAQUA_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "LOCAL_INDEX_RELOAD_SECONDS", 0, raising=False)
+
+
+def test_saves_merge_customers_learned_by_other_workers():
+    first, second = CustomerIndex(), CustomerIndex()
+    first.load()
+    second.load()
+
+    first.add("C1001", "大昌洗衣")
+    first.save(force=True)
+    second.add("C2002", "新興餐廳")
+    second.add_codes(["C3003"])
+    second.save(force=True)
+
+    fresh = CustomerIndex()
+    assert [item["code"] for item in fresh.suggest("C")] == ["C1001", "C2002", "C3003"]
+    assert first.suggest("新興") == [{"code": "C2002", "name": "新興餐廳"}]
+
+
+def test_local_rename_wins_over_the_snapshot():
+    first, second = CustomerIndex(), CustomerIndex()
+    first.add("C1001", "舊名")
+    first.save(force=True)
+    second.load()
+
+    second.add("C1001", "新名")
+    second.save(force=True)
+
+    assert first.suggest("C1001") == [{"code": "C1001", "name": "新名"}]
+    assert CustomerIndex().suggest("新") == [{"code": "C1001", "name": "新名"}]
@@ -0,0 +1,58 @@
+"""Technician day route: upstream calls stay proportional to the day's stops."""
+from __future__ import annotations
+
+from datetime import date, timedelta
+
+from server import app as server_app
+from server import config
+
+DAY = date.today() + timedelta(days=1)
+CODES = ["C%03d" % n for n in range(1, 31)]
+
+
+def _paged(records, body):
+    size = body["pageSize"]
+    start = (body["pageIndex"] - 1) * size
+    return {"recordList": records[start:start + size]}
+
+
+def _code_filter(body):
+    return next((vo["value1"] for vo in body.get("simpleVOs") or [] if vo["op"] == "in"), None)
+
+
+def _tasks(body, params):
+    codes = _code_filter(body)
+    if codes is None:
+        return _paged([{"customer_code": code, "ower_name": "客服003",
+                        "startDate": f"{DAY.isoformat()} {8 + n // 4:02d}:{n % 4 * 15:02d}:00"}
+                       for n, code in enumerate(CODES)], body)
+    return _paged([{"customer_code": code, "ower_name": "客服003", "startDate": DAY.isoformat()}
+                   for code in codes], body)
+
+
+def _followups(body, params):
+    codes = _code_filter(body)
+    assert codes is not None, "the route must not page every customer's followups"
+    return _paged([{"id": f"{code}-{n}", "customer_code": code, "customer_name": "N" + code,
+                    "ower_name": "維修幫A", "followTime": f"2025-0{n + 1}-01 10:00:00"}
+                   for code in codes for n in range(2)], body)
+
+
+def test_a_30_stop_day_takes_a_handful_of_gateway_calls(gateway):
+    gateway.on(config.TASK_LIST_PATH, _tasks)
+    gateway.on(config.FOLLOWUP_LIST_PATH, _followups)
+    gateway.on(config.CUSTOMER_ADDRESS_LIST_PATH, lambda body, params: [
+        {"merchantCode": code, "address": "addr " + code, "mobile": "9123%04d" % n}
+        for n, code in enumerate(body["codeList"])
+    ])
+
+    payload = server_app.app.test_client().get(f"/api/routes/day?date={DAY.isoformat()}").get_json()
+
+    assert payload["stopCount"] == 30
+    assert [stop["customerCode"] for stop in payload["stops"]] == CODES
+    assert all(stop["summary"]["latestServiceDate"] == "2025-02-01" for stop in payload["stops"])
+    assert all(stop["address"] == "addr " + stop["customerCode"] for stop in payload["stops"])
+    # 當天任務、地址、跟進紀錄、客戶任務各一次
+    assert sorted(gateway.paths()) == sorted([
+        config.TASK_LIST_PATH, config.CUSTOMER_ADDRESS_LIST_PATH, config.FOLLOWUP_LIST_PATH, config.TASK_LIST_PATH,
+    ])
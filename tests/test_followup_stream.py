@@ -0,0 +1,62 @@
+"""The Server-Sent Events version of the followup lookup."""
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Tuple
+
+from server import app as server_app
+from server import config
+
+RECORDS = [
+    {"id": "F1", "customer_code": "C1", "ower_name": "維修幫A", "followTime": "2025-06-02 10:00:00"},
+    {"id": "F2", "customer_code": "C1", "ower_name": "維修幫A", "followTime": "2025-03-02 10:00:00",
+     "picture1": "abcdef222222"},
+    {"id": "F3", "customer_code": "C1", "ower_name": "維修幫B", "followTime": "2025-01-02 10:00:00",
+     "picture1": "abcdef333333"},
+]
+
+
+def _files(body, params):
+    return {business_id: [{"fileId": "f" + business_id, "fileName": "p.jpg",
+                           "signedUrl": f"https://files.example/{business_id}?Expires=9999999999"}]
+            for business_id in body["businessIds"]}
+
+
+def _frames(body: str) -> List[Tuple[str, Dict[str, Any]]]:
+    assert body.endswith("\n\n")
+    frames = []
+    for chunk in body[:-2].split("\n\n"):
+        event_line, data_line = chunk.split("\n")
+        assert event_line.startswith("event: ") and data_line.startswith("data: ")
+        frames.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+    return frames
+
+
+def _lookup(gateway, path: str):
+    gateway.on(config.FOLLOWUP_LIST_PATH, lambda body, params: {"recordList": RECORDS})
+    gateway.on(config.FOLLOWUP_QUERY_FILES_PATH, _files)
+    return server_app.app.test_client().get(path)
+
+
+def test_stream_sends_resolution_and_summary_before_the_photos(gateway):
+    response = _lookup(gateway, "/api/customers/C1/followups/stream")
+
+    assert response.mimetype == "text/event-stream"
+    frames = _frames(response.get_data(as_text=True))
+    assert [event for event, _ in frames] == ["resolved", "summary", "record", "done"]
+    resolved, summary, record, done = (data for _, data in frames)
+    assert resolved["resolvedCustomerCode"] == "C1"
+    assert summary["summary"]["latestServiceDate"] == "2025-06-02"
+    # 與一般 API 相同：只推送第一筆有照片的紀錄，之後的附件不再查詢
+    assert record["followupId"] == "F2"
+    assert done["records"] == [record]
+    files_calls = [body for path, body, _ in gateway.calls if path == config.FOLLOWUP_QUERY_FILES_PATH]
+    assert files_calls == [{"businessIds": ["abcdef222222"]}]
+
+
+def test_stream_done_event_matches_the_json_endpoint(gateway):
+    streamed = _frames(_lookup(gateway, "/api/customers/C1/followups/stream").get_data(as_text=True))[-1][1]
+    plain = _lookup(gateway, "/api/customers/C1/followups").get_json()
+
+    for key in ("resolvedCustomerCode", "suggestedCodes", "records", "tasks", "summary", "partial"):
+        assert json.loads(json.dumps(streamed[key], default=str)) == plain[key], key
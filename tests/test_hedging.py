@@ -0,0 +1,131 @@
+"""Hedged gateway calls: budget, pool threads, inline fallback and write timeouts."""
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from server import config
+from server.crm_client import CRM_CLIENT
+from server.hedging import GatewayLatency
+
+PATH = config.FOLLOWUP_LIST_PATH
+
+
+@pytest.fixture(autouse=True)
+def _hedging(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_ENABLED", True, raising=False)
+    monkeypatch.setattr(config, "HEDGE_BUDGET_RATIO", 1.0, raising=False)
+    monkeypatch.setattr(config, "HEDGE_BUDGET_BURST", 2, raising=False)
+    monkeypatch.setattr(config, "HEDGE_MAX_THREADS", 4, raising=False)
+    monkeypatch.setattr(config, "GATEWAY_LATENCY_MIN_SAMPLES", 20, raising=False)
+    monkeypatch.setattr(config, "GATEWAY_TIMEOUT_SECONDS", 15, raising=False)
+    monkeypatch.setattr(config, "GATEWAY_TIMEOUT_MIN_SECONDS", 3, raising=False)
+
+
+def _primed(path: str = PATH, seconds: float = 0.01) -> GatewayLatency:
+    latency = GatewayLatency()
+    for _ in range(20):
+        latency.record(path, seconds)
+    return latency
+
+
+def _tokens(latency: GatewayLatency) -> float:
+    return latency._tokens.get("default", 0.0)
+
+
+def _wait_idle(latency: GatewayLatency) -> None:
+    for _ in range(200):
+        if latency._busy == 0:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"{latency._busy} pool threads still reserved")
+
+
+def test_each_hedgeable_call_earns_budget_up_to_the_burst(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_BUDGET_RATIO", 0.25, raising=False)
+    latency = GatewayLatency()
+
+    latency.call(PATH, lambda timeout: "ok")
+    latency.call(config.CUSTOMER_DETAIL_PATH, lambda timeout: "ok")  # not hedgeable: earns nothing
+    assert _tokens(latency) == 0.0  # no latency window yet, so no hedge and no earning
+
+    latency = _primed()
+    for _ in range(20):
+        latency.call(PATH, lambda timeout: "ok")
+    assert _tokens(latency) == 2
+
+
+def test_a_slow_primary_is_hedged_and_the_loser_releases_its_thread():
+    latency = _primed()
+    release = threading.Event()
+    calls = []
+
+    def attempt(timeout):
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    assert latency.call(PATH, attempt) == "fast"
+    assert (latency.hedges_sent, latency.hedges_won) == (1, 1)
+    assert _tokens(latency) == 0  # earned one, spent one
+    assert latency._busy == 1  # the losing primary still holds its thread
+
+    release.set()
+    _wait_idle(latency)
+    assert all(name.startswith("gateway-hedge") for name in calls)
+
+
+def test_a_primary_answering_in_time_returns_the_token_and_the_spare_thread():
+    latency = _primed(seconds=1.0)
+
+    assert latency.call(PATH, lambda timeout: "ok") == "ok"
+
+    assert latency.hedges_sent == 0
+    assert _tokens(latency) == 1
+    _wait_idle(latency)
+
+
+def test_calls_run_inline_without_budget(monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_BUDGET_RATIO", 0.5, raising=False)
+    latency = _primed()
+    caller = threading.current_thread()
+
+    assert latency.call(PATH, lambda timeout: threading.current_thread()) is caller
+    assert latency._pool is None
+
+
+def test_calls_run_inline_when_the_pool_is_taken():
+    latency = _primed()
+    latency._busy = config.HEDGE_MAX_THREADS - 1
+    caller = threading.current_thread()
+
+    assert latency.call(PATH, lambda timeout: threading.current_thread()) is caller
+    assert _tokens(latency) == 1  # earned, not spent
+
+
+def test_reads_adapt_their_timeout_but_writes_keep_the_ceiling():
+    latency = _primed(config.FOLLOWUP_SAVE_PATH, seconds=0.1)
+    timeouts = []
+
+    latency.call(config.FOLLOWUP_SAVE_PATH, lambda timeout: timeouts.append(timeout))
+    latency.call(config.FOLLOWUP_SAVE_PATH, lambda timeout: timeouts.append(timeout), idempotent=False)
+
+    assert timeouts == [3, 15]
+
+
+def test_save_followup_is_sent_as_a_write(monkeypatch, gateway):
+    seen = []
+    monkeypatch.setattr(
+        "server.crm_client.GATEWAY_LATENCY.call",
+        lambda path, attempt, idempotent=True: seen.append((path, idempotent)) or attempt(15),
+    )
+
+    CRM_CLIENT.save_followup({"customer_code": "C1"})
+    CRM_CLIENT.get_followups("C1")
+
+    assert seen[0] == (config.FOLLOWUP_SAVE_PATH, False)
+    assert all(idempotent for path, idempotent in seen[1:])
@@ -0,0 +1,111 @@
+"""Shared L2 response cache: keys, TTLs and write-through invalidation."""
+from __future__ import annotations
+
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+from server import app as server_app
+from server import config, l2_cache
+from server.crm_client import CRM_CLIENT
+from server.l2_cache import L2Cache
+
+PATH = config.FOLLOWUP_LIST_PATH
+
+
+def _list_calls(gateway):
+    return [body for path, body, _ in gateway.calls if path == PATH]
+
+
+def test_keys_ignore_the_token_and_key_order():
+    body = {"pageIndex": 1, "simpleVOs": [{"field": "customer.code", "op": "eq", "value1": "C1"}]}
+    key = L2Cache.make_key("post", PATH, {"access_token": "a", "x": 1}, body)
+
+    assert key == L2Cache.make_key("POST", PATH, {"x": 1, "access_token": "b"}, dict(reversed(body.items())))
+    assert key != L2Cache.make_key("POST", PATH, {"x": 1}, dict(body, pageIndex=2))
+    assert key != L2Cache.make_key("POST", config.CUSTOMER_DETAIL_PATH, {"x": 1}, body)
+
+
+def test_entries_expire_after_their_path_ttl(monkeypatch, data_dir):
+    monkeypatch.setattr(config, "L2_CACHE_TTLS", {PATH: 60}, raising=False)
+    cache = L2Cache()
+    cache.put("k", PATH, {"data": 1}, {"C1"})
+    assert cache.get("k") == {"data": 1}
+
+    later = l2_cache.time.time() + 61
+    monkeypatch.setattr(l2_cache, "time", SimpleNamespace(time=lambda: later))
+
+    assert cache.get("k") is None
+
+
+def test_paths_without_a_ttl_are_not_cached(data_dir):
+    cache = L2Cache()
+    cache.put("k", config.FOLLOWUP_SAVE_PATH, {"data": 1}, {"C1"})
+
+    assert cache.get("k") is None
+
+
+@pytest.mark.parametrize("saved", [{"customer_code": "C1"}, {"customer": "111"}])
+def test_a_save_drops_the_customers_cached_pages(gateway, saved):
+    gateway.on(PATH, lambda body, params: {"recordList": [
+        {"id": "F1", "customer_code": "C1", "customer": "111", "ower_name": "維修幫A"},
+    ]})
+    CRM_CLIENT.get_followups("C1", page_size=20)
+    CRM_CLIENT.get_followups("C1", page_size=20)
+    assert len(_list_calls(gateway)) == 1
+
+    CRM_CLIENT.save_followup(dict(saved, content="x"))
+    CRM_CLIENT.get_followups("C1", page_size=20)
+
+    assert len(_list_calls(gateway)) == 2
+
+
+def test_a_save_keeps_other_customers_pages(gateway):
+    gateway.on(PATH, lambda body, params: {"recordList": [{"id": "F2", "customer_code": "C2"}]})
+    CRM_CLIENT.get_followups("C2", page_size=20)
+
+    CRM_CLIENT.save_followup({"customer_code": "C1"})
+    CRM_CLIENT.get_followups("C2", page_size=20)
+
+    assert len(_list_calls(gateway)) == 1
+
+
+def test_a_save_drops_the_phone_search_page_that_resolved_to_the_customer(gateway):
+    phone = "91234567"
+
+    def _followups(body, params):
+        vo = body["simpleVOs"][0]
+        if vo["op"] == "like" and vo["value1"] == phone:
+            return {"recordList": [{"id": "F1", "customer": "222", "org": "9", "ower_name": "維修幫A",
+                                    "followTime": "2025-03-02 10:00:00"}]}
+        return {"recordList": []}
+
+    gateway.on(PATH, _followups)
+    gateway.on(config.CUSTOMER_DETAIL_PATH, lambda body, params: {"code": "C2"})
+    client = server_app.app.test_client()
+
+    assert client.get(f"/api/customers/{phone}/followups").get_json()["resolvedCustomerCode"] == "C2"
+    like_calls = len([body for body in _list_calls(gateway) if body["simpleVOs"][0]["op"] == "like"])
+
+    CRM_CLIENT.save_followup({"customer_code": "C2"})
+    client.get(f"/api/customers/{phone}/followups")
+
+    assert len([body for body in _list_calls(gateway) if body["simpleVOs"][0]["op"] == "like"]) == like_calls + 1
+
+
+def _put_in_child(key: str) -> None:
+    L2Cache().put(key, PATH, {"from": "child"}, {"C9"})
+
+
+def test_entries_are_shared_between_processes(data_dir):
+    L2Cache().open()
+    child = multiprocessing.get_context("fork").Process(target=_put_in_child, args=("shared",))
+    child.start()
+    child.join(10)
+    assert child.exitcode == 0
+
+    cache = L2Cache()
+    assert cache.get("shared") == {"from": "child"}
+    assert cache.invalidate(["C9"], paths=[PATH], include_unfiltered=False) == 1
+    assert cache.get("shared") is None
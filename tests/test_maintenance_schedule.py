@@ -0,0 +1,118 @@
+"""Parity of the NumPy bulk schedule engine with the per-customer reference summary."""
+from __future__ import annotations
+
+import os
+import random
+import tempfile
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+pytest.importorskip("numpy")
+
+# Keep the app's local indexes and caches away from real data while importing it.
+os.environ.setdefault("MAQUA_DATA_DIR", tempfile.mkdtemp(prefix="maqua-test-"))
+
+from server import app as server_app  # noqa: E402
+from server.record_utils import record_customer_code  # noqa: E402
+
+FIELDS = ("customerName", "latestServiceDate", "previousServiceDate", "nextServiceDate")
+FOLLOWUP_OWNERS = ("維修幫A", "維修幫B", "銷售")
+TASK_OWNERS = ("客服003", "其他")
+TASK_DATE_FIELDS = ("startDate", "planDate", "endDate", "nope")
+
+
+def _random_records(seed: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    rng = random.Random(seed)
+    today = date.today()
+
+    def when() -> str:
+        return (today + timedelta(days=rng.randint(-400, 120))).isoformat() + " 10:00:00"
+
+    followups = []
+    for _ in range(3000):
+        code = "C%04d" % rng.randint(0, 400)
+        followups.append({
+            "customer_code": code,
+            "customer_name": "N" + code + str(rng.randint(0, 3)),
+            "ower_name": rng.choice(FOLLOWUP_OWNERS),
+            "followTime": rng.choice([when(), when(), when(), "", None]),
+        })
+    tasks = []
+    for _ in range(1000):
+        code = "C%04d" % rng.randint(0, 500)
+        tasks.append({
+            "customer_code": code,
+            "ower_name": rng.choice(TASK_OWNERS),
+            rng.choice(TASK_DATE_FIELDS): when(),
+        })
+    return followups, tasks
+
+
+def _mismatches(followups: List[Dict[str, Any]], tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    followups_by_code: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    tasks_by_code: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for item in followups:
+        followups_by_code[record_customer_code(item)].append(item)
+    for task in tasks:
+        tasks_by_code[record_customer_code(task)].append(task)
+
+    offset_days = getattr(server_app.config, "MAINTENANCE_NEXT_DATE_OFFSET_DAYS", 0)
+    mismatches = []
+    for code, bulk in server_app._bulk_maintenance_summaries(followups, tasks).items():
+        reference = server_app._extract_maintenance_summary(
+            code, {"data": {"recordList": followups_by_code.get(code, [])}}, tasks_by_code.get(code, [])
+        )
+        if offset_days:
+            reference["nextServiceDate"] = server_app._shift_date_string(reference.get("nextServiceDate"), offset_days)
+        for key in FIELDS:
+            if bulk.get(key) != reference.get(key):
+                mismatches.append({"customerCode": code, "field": key,
+                                   "bulk": bulk.get(key), "reference": reference.get(key)})
+    return mismatches
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+@pytest.mark.parametrize("max_gap_days", [None, 30])
+@pytest.mark.parametrize("offset_days", [0, 14])
+def test_bulk_schedule_matches_reference(monkeypatch, seed, max_gap_days, offset_days):
+    monkeypatch.setattr(server_app.config, "MAINTENANCE_TASK_MAX_GAP_DAYS", max_gap_days, raising=False)
+    monkeypatch.setattr(server_app.config, "MAINTENANCE_NEXT_DATE_OFFSET_DAYS", offset_days, raising=False)
+    followups, tasks = _random_records(seed)
+
+    assert _mismatches(followups, tasks) == []
+
+
+def test_bulk_schedule_covers_every_visited_customer():
+    followups, tasks = _random_records(7)
+    visited = {
+        record_customer_code(item) for item in followups
+        if "維修幫" in item["ower_name"] and item["followTime"]
+    }
+
+    assert visited <= set(server_app._bulk_maintenance_summaries(followups, tasks))
+
+
+def test_records_with_only_a_customer_id_count_for_their_customer(monkeypatch, data_dir):
+    monkeypatch.setattr(server_app.config, "REPLICA_ENABLED", True, raising=False)
+    server_app.REPLICA.remember_customer_id("555", "C0007")
+    today = date.today()
+    followups = [
+        {"customer_code": "C0007", "customer_name": "N", "ower_name": "維修幫A",
+         "followTime": (today - timedelta(days=200)).isoformat() + " 10:00:00"},
+        {"customer": "555", "customer_name": "N", "ower_name": "維修幫B",
+         "followTime": (today - timedelta(days=20)).isoformat() + " 10:00:00"},
+    ]
+    tasks = [{"customer": 555, "ower_name": "客服003", "startDate": (today + timedelta(days=30)).isoformat()}]
+
+    bulk = server_app._bulk_maintenance_summaries(followups, tasks)
+    reference = server_app._extract_maintenance_summary("C0007", {"data": {"recordList": followups}}, tasks)
+    offset_days = getattr(server_app.config, "MAINTENANCE_NEXT_DATE_OFFSET_DAYS", 0)
+    if offset_days:
+        reference["nextServiceDate"] = server_app._shift_date_string(reference.get("nextServiceDate"), offset_days)
+
+    assert set(bulk) == {"C0007"}
+    for key in FIELDS:
+        assert bulk["C0007"].get(key) == reference.get(key), key
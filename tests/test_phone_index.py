@@ -0,0 +1,64 @@
+"""Several workers sharing one phone index snapshot."""
+from __future__ import annotations
+
+import pytest
+
+from server import config
+from server.phone_index import PhoneIndex
+
+
+@pytest.fixture(autouse=True)
+def _data_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("MAQUA_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "LOCAL_INDEX_RELOAD_SECONDS", 0, raising=False)
+
+
+def test_saves_merge_phones_learned_by_other_workers():
+    first, second = PhoneIndex(), PhoneIndex()
+    first.load()
+    second.load()
+
+    first.observe_addresses([{"mobile": "91234567"}], ["C1"])
+    first.save()
+    second.observe_addresses([{"mobile": "98765432"}], ["C2"])
+    second.save()
+
+    fresh = PhoneIndex()
+    assert fresh.lookup("91234567") == ["C1"]
+    assert fresh.lookup("98765432") == ["C2"]
+    assert first.lookup("98765432") == ["C2"]
+
+
+def test_expiry_survives_a_save_by_a_worker_that_missed_it():
+    first, second = PhoneIndex(), PhoneIndex()
+    first.observe_addresses([{"mobile": "98765432"}], ["C2"])
+    first.save()
+    second.load()
+
+    first.expire(["C2"])
+    first.save()
+    second.observe_addresses([{"mobile": "55554444"}], ["C3"])
+    second.save()
+
+    assert PhoneIndex().stale_codes(["C2", "C3"]) == ["C2"]
+
+    second.observe_addresses([{"mobile": "98765000"}], ["C2"])
+    second.save()
+
+    fresh = PhoneIndex()
+    assert fresh.stale_codes(["C2"]) == []
+    assert fresh.lookup("98765000") == ["C2"]
+    assert fresh.lookup("98765432") == []
+
+
+def test_multi_code_batch_keeps_phones_of_codes_it_cannot_attribute():
+    index = PhoneIndex()
+    index.observe_addresses([{"mobile": "91234567"}], ["C1"])
+    index.observe_addresses([{"mobile": "98765432"}], ["C2"])
+
+    index.observe_addresses([{"merchantCode": "C2", "mobile": "55554444"}, {"mobile": "66667777"}], ["C1", "C2"])
+
+    assert index.lookup("91234567") == ["C1"]
+    assert index.lookup("98765432") == []
+    assert index.lookup("55554444") == ["C2"]
+    assert index.lookup("66667777") == []
@@ -0,0 +1,55 @@
+"""Phone lookups that start from the local phone index."""
+from __future__ import annotations
+
+from server import app as server_app
+from server import config
+from server.phone_index import PHONE_INDEX
+
+PHONE = "91234567"
+ADDRESSES = {"C1": "22223333", "C2": PHONE}
+
+
+def _followups(body, params):
+    vo = body["simpleVOs"][0]
+    if vo["field"] == "customer.name" and vo["op"] == "like" and vo["value1"] == PHONE:
+        return {"recordList": [{
+            "id": "F1", "customer": "222", "org": "9", "customer_name": "乙公司",
+            "ower_name": "維修幫A", "followTime": "2025-03-02 10:00:00",
+        }]}
+    return {"recordList": []}
+
+
+def _addresses(body, params):
+    return [{"merchantCode": code, "mobile": ADDRESSES[code]} for code in body["codeList"]]
+
+
+def test_stale_index_hit_falls_back_to_the_phone_search(gateway):
+    gateway.on(config.FOLLOWUP_LIST_PATH, _followups)
+    gateway.on(config.CUSTOMER_ADDRESS_LIST_PATH, _addresses)
+    gateway.on(config.CUSTOMER_DETAIL_PATH, lambda body, params: {
+        "code": "C2", "merchantAddressInfos": [{"mobile": PHONE}],
+    })
+    # 索引仍記著電話屬於 C1，但 C1 已換號碼、沒有任何跟進紀錄
+    PHONE_INDEX.observe_addresses([{"mobile": PHONE}], ["C1"])
+
+    payload = server_app.app.test_client().get(f"/api/customers/{PHONE}/followups").get_json()
+
+    assert payload["resolvedCustomerCode"] == "C2"
+    assert payload["filterInfo"]["phoneIndexStale"] == ["C1"]
+    assert payload["filterInfo"]["searchFallback"] == "customer.name"
+    assert PHONE_INDEX.lookup(PHONE) == ["C2"]
+    assert PHONE_INDEX.lookup(ADDRESSES["C1"]) == ["C1"]
+
+
+def test_index_hit_with_records_skips_the_phone_search(gateway):
+    gateway.on(config.FOLLOWUP_LIST_PATH, lambda body, params: {"recordList": [{
+        "id": "F1", "customer_code": "C1", "ower_name": "維修幫A", "followTime": "2025-03-02 10:00:00",
+    }]} if body["simpleVOs"][0]["value1"] == "C1" else {"recordList": []})
+    PHONE_INDEX.observe_addresses([{"mobile": PHONE}], ["C1"])
+
+    payload = server_app.app.test_client().get(f"/api/customers/{PHONE}/followups").get_json()
+
+    assert payload["resolvedCustomerCode"] == "C1"
+    assert payload["filterInfo"]["phoneIndexCodes"] == ["C1"]
+    assert all(body["simpleVOs"][0]["op"] == "eq"
+               for path, body, _ in gateway.calls if path == config.FOLLOWUP_LIST_PATH)
@@ -0,0 +1,116 @@
+"""Incremental sync, freshness and live fallback of the local replica."""
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import pytest
+
+from server import config
+from server.replica import FollowupReplica
+
+
+class FakeClient:
+    """Pages ``records`` the way the list APIs do, honouring the ``egt`` watermark filter."""
+
+    def __init__(self, records: List[Dict[str, Any]]) -> None:
+        self.records = records
+        self.filters: List[List[Dict[str, Any]]] = []
+
+    def get_followups(self, customer_code: str = "", page: int = 1, page_size: int = 10, *,
+                      filters=None, cache: bool = True) -> Dict[str, Any]:
+        filters = list(filters or [])
+        self.filters.append(filters)
+        matching = [item for item in self.records
+                    if all(str(item.get(vo["field"]) or "") >= str(vo["value1"]) for vo in filters)]
+        start = (page - 1) * page_size
+        return {"code": "200", "data": {"recordList": matching[start:start + page_size]}}
+
+
+def _followup(record_id: str, pubts: str, **fields: Any) -> Dict[str, Any]:
+    return dict({"id": record_id, "pubts": pubts, "ower_name": "維修幫A",
+                 "followTime": f"2025-0{record_id[-1]}-01 10:00:00"}, **fields)
+
+
+@pytest.fixture
+def replica(monkeypatch, data_dir):
+    monkeypatch.setattr(config, "REPLICA_ENABLED", True, raising=False)
+    monkeypatch.setattr(config, "TASK_LIST_PATH", "", raising=False)
+    monkeypatch.setattr(config, "REPLICA_PAGE_SIZE", 2, raising=False)
+    monkeypatch.setattr(config, "REPLICA_MAX_STALENESS_SECONDS", 300, raising=False)
+    return FollowupReplica()
+
+
+def _ids(page: Dict[str, Any]) -> List[str]:
+    return sorted(item["id"] for item in page["data"]["recordList"])
+
+
+def test_incremental_sync_pulls_only_changes_after_the_watermark(replica):
+    client = FakeClient([
+        _followup("F1", "2025-01-01", customer_code="C1"),
+        _followup("F2", "2025-01-02", customer_code="C1"),
+        _followup("F3", "2025-01-03", customer_code="C2"),
+    ])
+    first = replica.sync_once(client)["followups"]
+    assert first == {"full": True, "complete": True, "pulled": 3, "watermark": "2025-01-03"}
+
+    client.records.append(_followup("F4", "2025-01-04", customer_code="C1"))
+    client.filters.clear()
+    second = replica.sync_once(client)["followups"]
+
+    assert second["full"] is False
+    assert client.filters[0] == [{"field": "pubts", "op": "egt", "value1": "2025-01-03"}]
+    assert second["pulled"] == 2  # F3 again (egt) and F4
+    assert _ids(replica.get_followups("C1")) == ["F1", "F2", "F4"]
+    assert replica.get_followups("C1")["_meta"]["source"] == "replica"
+
+
+def test_reads_go_live_once_the_replica_is_stale(monkeypatch, replica):
+    replica.sync_once(FakeClient([_followup("F1", "2025-01-01", customer_code="C1")]))
+    assert replica.get_followups("C1") is not None
+
+    monkeypatch.setattr(config, "REPLICA_MAX_STALENESS_SECONDS", -1, raising=False)
+
+    assert replica.is_fresh("followups") is False
+    assert replica.get_followups("C1") is None
+    assert replica.all_records("followups") is None
+
+
+def test_a_customer_with_unmapped_rows_is_read_live_until_the_id_is_known(replica):
+    replica.sync_once(FakeClient([
+        _followup("F1", "2025-01-01", customer_code="C1", customer="111"),
+        _followup("F2", "2025-01-02", customer="111"),
+        _followup("F3", "2025-01-03", customer="222"),
+    ]))
+
+    # F2 belongs to C1 but is stored without a code: a page with F1 only would be partial.
+    assert replica.get_followups("C1") is None
+
+    replica.remember_customer_id("111", "C1")
+
+    assert _ids(replica.get_followups("C1")) == ["F1", "F2"]
+    # F3's id is unmapped, but C1's own id is known, so F3 cannot be C1's.
+    assert replica.get_followups("C1") is not None
+    assert replica.get_followups("C2") is None
+
+
+def test_an_exact_live_page_maps_the_customer_id(replica):
+    replica.sync_once(FakeClient([_followup("F3", "2025-01-03", customer="222")]))
+    assert replica.get_followups("C2") is None
+
+    replica.store_customer_page("followups", "C2", [_followup("F3", "2025-01-03", customer="222")],
+                                complete=True, exact=True)
+
+    assert replica.code_for_customer_id("222") == "C2"
+    assert _ids(replica.get_followups("C2")) == ["F3"]
+
+
+def test_a_sweep_cut_short_deletes_nothing(monkeypatch, replica):
+    client = FakeClient([_followup("F%d" % n, "2025-01-0%d" % n, customer_code="C1") for n in range(1, 6)])
+    replica.sync_once(client)
+    monkeypatch.setattr(config, "REPLICA_MAX_PAGES", 1, raising=False)
+    monkeypatch.setattr(config, "REPLICA_FULL_SYNC_INTERVAL_SECONDS", -1, raising=False)
+
+    report = replica.sync_once(client)["followups"]
+
+    assert report["full"] is True and report["complete"] is False
+    assert len(replica.all_records("followups")) == 5
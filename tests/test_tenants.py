@@ -0,0 +1,80 @@
+"""Two tenants served by one process never see each other's data."""
+from __future__ import annotations
+
+import pytest
+
+from server import app as server_app
+from server import config, local_store, tenants
+from server.crm_client import CRM_CLIENT
+from server.customer_index import CUSTOMER_INDEX
+from server.known_codes import NEGATIVE_CACHE
+from server.l2_cache import L2_CACHE
+from server.phone_index import PHONE_INDEX
+
+
+@pytest.fixture
+def brand(monkeypatch, data_dir):
+    monkeypatch.setattr(config, "TENANTS", {
+        "brand2": {
+            "hosts": ["brand2.example"],
+            "APP_KEY": "key2",
+            "APP_SECRET": "secret2",
+            "GATEWAY_URL": "https://brand2-gateway.example/",
+        },
+    }, raising=False)
+    tenants._table.cache_clear()
+    yield tenants.get("brand2")
+    tenants._table.cache_clear()
+
+
+def test_each_tenant_has_its_own_data_dir(brand, data_dir):
+    assert local_store.data_dir() == data_dir
+    with tenants.use(brand):
+        assert local_store.data_dir() == data_dir / "tenants" / "brand2"
+        assert tenants.setting("APP_KEY") == "key2"
+        assert tenants.setting("TENANT_ID") is None  # private settings never fall back to the default
+
+
+def test_indexes_and_caches_are_per_tenant(brand):
+    PHONE_INDEX.observe_addresses([{"mobile": "91234567"}], ["C1"])
+    PHONE_INDEX.save()
+    CUSTOMER_INDEX.add("C1", "甲公司")
+    CUSTOMER_INDEX.save(force=True)
+    L2_CACHE.put("key", config.FOLLOWUP_LIST_PATH, {"data": "default"}, {"C1"})
+    NEGATIVE_CACHE.put("C404", {"code": "OK"})
+
+    with tenants.use(brand):
+        assert PHONE_INDEX.for_tenant() is not PHONE_INDEX.for_tenant(tenants.DEFAULT)
+        assert PHONE_INDEX.lookup("91234567") == []
+        assert "C1" not in CUSTOMER_INDEX
+        assert L2_CACHE.get("key") is None
+        assert NEGATIVE_CACHE.get("C404") is None
+        assert CRM_CLIENT.gateway_url == "https://brand2-gateway.example"
+
+        PHONE_INDEX.observe_addresses([{"mobile": "91234567"}], ["B7"])
+        PHONE_INDEX.save()
+
+    assert PHONE_INDEX.lookup("91234567") == ["C1"]
+    assert "C1" in CUSTOMER_INDEX
+    assert L2_CACHE.get("key") == {"data": "default"}
+
+
+@pytest.mark.parametrize("host, path", [
+    ("brand2.example", "/api/customers/C1/followups"),
+    ("localhost", "/t/brand2/api/customers/C1/followups"),
+])
+def test_requests_run_as_the_tenant_they_address(brand, gateway, host, path):
+    seen = []
+    gateway.on(config.FOLLOWUP_LIST_PATH, lambda body, params: seen.append(tenants.current().name) or {
+        "recordList": [{"id": "F1", "customer_code": "C1", "ower_name": "維修幫A",
+                        "followTime": "2025-03-02 10:00:00"}],
+    })
+
+    payload = server_app.app.test_client().get(path, headers={"Host": host}).get_json()
+
+    assert payload["resolvedCustomerCode"] == "C1"
+    assert seen and set(seen) == {"brand2"}
+    assert tenants.current() is tenants.DEFAULT
+    with tenants.use(brand):
+        assert "C1" in CUSTOMER_INDEX
+    assert "C1" not in CUSTOMER_INDEX